@@ -11,21 +11,31 @@ from DB import (
     ChainStepResponse,
     Chain as ChainDB,
     Provider as ProviderModel,
-    User,
     Extension,
+    OAuthProvider,
+    UserOAuth,
     UserPreferences,
     get_session,
-    UserOAuth,
-    OAuthProvider,
+    query_only,
 )
 from Providers import Providers
 from Extensions import Extensions
 from Globals import getenv, DEFAULT_SETTINGS, DEFAULT_USER
 from MagicalAuth import get_user_id, is_agixt_admin
+from IdentityCache import (
+    IdentityCache,
+    get_cached_agent_id,
+    get_cached_registration_settings,
+    get_cached_user_id,
+    invalidate_agent_id,
+)
 from agixtsdk import AGiXTSDK
 from fastapi import HTTPException
+from sqlalchemy import String, and_, cast, literal
 from datetime import datetime, timezone, timedelta
 import logging
+import hashlib
+import copy
 import json
 import numpy as np
 import os
@@ -58,8 +68,7 @@ def add_agent(agent_name, provider_settings=None, commands=None, user=DEFAULT_US
     if agent:
         session.close()
         return {"message": f"Agent {agent_name} already exists."}
-    user_data = session.query(User).filter(User.email == user).first()
-    user_id = user_data.id
+    user_id = get_user_id(user=user)
 
     if provider_settings is None or provider_settings == "" or provider_settings == {}:
         provider_settings = DEFAULT_SETTINGS
@@ -97,8 +106,7 @@ def add_agent(agent_name, provider_settings=None, commands=None, user=DEFAULT_US
 
 def delete_agent(agent_name, user=DEFAULT_USER):
     session = get_session()
-    user_data = session.query(User).filter(User.email == user).first()
-    user_id = user_data.id
+    user_id = get_user_id(user=user)
     agent = (
         session.query(AgentModel)
         .filter(AgentModel.name == agent_name, AgentModel.user_id == user_id)
@@ -138,13 +146,14 @@ def delete_agent(agent_name, user=DEFAULT_USER):
     session.delete(agent)
     session.commit()
     session.close()
+    invalidate_agent_id(user_id=user_id, agent_name=agent_name)
+    invalidate_agent(user=user, agent_name=agent_name)
     return {"message": f"Agent {agent_name} deleted."}, 200
 
 
 def rename_agent(agent_name, new_name, user=DEFAULT_USER):
     session = get_session()
-    user_data = session.query(User).filter(User.email == user).first()
-    user_id = user_data.id
+    user_id = get_user_id(user=user)
     agent = (
         session.query(AgentModel)
         .filter(AgentModel.name == agent_name, AgentModel.user_id == user_id)
@@ -156,9 +165,14 @@ def rename_agent(agent_name, new_name, user=DEFAULT_USER):
     agent.name = new_name
     session.commit()
     session.close()
+    invalidate_agent_id(user_id=user_id, agent_name=agent_name)
+    invalidate_agent_id(user_id=user_id, agent_name=new_name)
+    invalidate_agent(user=user, agent_name=agent_name)
+    invalidate_agent(user=user, agent_name=new_name)
     return {"message": f"Agent {agent_name} renamed to {new_name}."}, 200
 
 
+@query_only
 def get_agents(user=DEFAULT_USER):
     session = get_session()
     agents = session.query(AgentModel).filter(AgentModel.user.has(email=user)).all()
@@ -184,8 +198,29 @@ class Agent:
         user = user if user is not None else DEFAULT_USER
         self.user = user.lower()
         self.user_id = get_user_id(user=self.user)
-        self.AGENT_CONFIG = self.get_agent_config()
+        self.config_version, config = get_versioned_agent_config(
+            agent_name=self.agent_name, user=self.user, registration_settings=False
+        )
+        # The agent's own settings, the user's registration settings are applied per request
+        self.agent_settings = config["settings"]
+        self.AGENT_CONFIG = {
+            "settings": self.get_request_settings(),
+            "commands": config["commands"],
+        }
         self.load_config_keys()
+        self.load_providers(ApiClient=ApiClient)
+        self.extensions = Extensions(
+            agent_name=self.agent_name,
+            agent_config=self.AGENT_CONFIG,
+            ApiClient=ApiClient,
+            user=self.user,
+        )
+        self.available_commands = self.extensions.get_available_commands()
+        self.agent_id = str(self.get_agent_id())
+        self.working_directory = os.path.join(os.getcwd(), "WORKSPACE", self.agent_id)
+        os.makedirs(self.working_directory, exist_ok=True)
+
+    def load_providers(self, ApiClient: AGiXTSDK = None):
         if "settings" not in self.AGENT_CONFIG:
             self.AGENT_CONFIG["settings"] = {}
         self.PROVIDER_SETTINGS = (
@@ -275,16 +310,28 @@ class Agent:
             self.chunk_size = self.EMBEDDINGS_PROVIDER.chunk_size
         else:
             self.chunk_size = 256
-        self.extensions = Extensions(
-            agent_name=self.agent_name,
-            agent_config=self.AGENT_CONFIG,
-            ApiClient=ApiClient,
-            user=self.user,
-        )
-        self.available_commands = self.extensions.get_available_commands()
-        self.agent_id = str(self.get_agent_id())
-        self.working_directory = os.path.join(os.getcwd(), "WORKSPACE", self.agent_id)
-        os.makedirs(self.working_directory, exist_ok=True)
+
+    def for_request(self, ApiClient: AGiXTSDK = None):
+        """
+        Returns a copy of this agent for one request. The copy shares the extensions and
+        command list, but gets its own config and newly built providers, since providers keep
+        per-call state such as failure counts. The user's registration settings are applied
+        again, so changes to them are not hidden by the cached agent.
+        """
+        agent = copy.copy(self)
+        agent.AGENT_CONFIG = {
+            "settings": self.get_request_settings(),
+            "commands": dict(self.AGENT_CONFIG["commands"]),
+        }
+        agent.load_config_keys()
+        agent.load_providers(ApiClient=ApiClient)
+        return agent
+
+    def get_request_settings(self) -> dict:
+        """The agent's settings with the user's current registration settings applied."""
+        settings = dict(self.agent_settings)
+        settings.update(get_cached_registration_settings(self.user_id))
+        return settings
 
     def load_config_keys(self):
         config_keys = [
@@ -298,75 +345,22 @@ class Agent:
                 setattr(self, key, self.AGENT_CONFIG[key])
 
     def get_registration_requirement_settings(self):
-        with open("registration_requirements.json", "r") as read_file:
-            data = json.load(read_file)
-        agent_settings = {}
-        user_preferences_keys = []
-        for key in data:
-            user_preferences_keys.append(key)
-        session = get_session()
-        user_preferences = (
-            session.query(UserPreferences)
-            .filter(UserPreferences.user_id == self.user_id)
-            .all()
-        )
-        for user_preference in user_preferences:
-            if user_preference.pref_key in user_preferences_keys:
-                agent_settings[user_preference.pref_key] = str(
-                    user_preference.pref_value
-                )
-        session.close()
-        return agent_settings
+        return dict(get_cached_registration_settings(self.user_id))
 
     def get_agent_config(self):
+        return get_agent_config(agent_name=self.agent_name, user=self.user)
+
+    def get_sso_providers(self) -> tuple:
+        """Returns the sorted, lowercased names of the OAuth providers the user has connected."""
         session = get_session()
-        agent = (
-            session.query(AgentModel)
-            .filter(
-                AgentModel.name == self.agent_name, AgentModel.user_id == self.user_id
-            )
-            .first()
+        providers = (
+            session.query(OAuthProvider.name)
+            .join(UserOAuth, UserOAuth.provider_id == OAuthProvider.id)
+            .filter(UserOAuth.user_id == self.user_id)
+            .all()
         )
-        if not agent:
-            # Check if it is a global agent
-            global_user = session.query(User).filter(User.email == DEFAULT_USER).first()
-            agent = (
-                session.query(AgentModel)
-                .filter(
-                    AgentModel.name == self.agent_name,
-                    AgentModel.user_id == global_user.id,
-                )
-                .first()
-            )
-        config = {"settings": {}, "commands": {}}
-        if agent:
-            all_commands = session.query(Command).all()
-            agent_settings = (
-                session.query(AgentSettingModel).filter_by(agent_id=agent.id).all()
-            )
-            agent_commands = (
-                session.query(AgentCommand)
-                .filter(AgentCommand.agent_id == agent.id)
-                .all()
-            )
-            # Process all commands, including chains
-            for command in all_commands:
-                config["commands"][command.name] = any(
-                    ac.command_id == command.id and ac.state for ac in agent_commands
-                )
-            for setting in agent_settings:
-                config["settings"][setting.name] = setting.value
-            session.close()
-            user_settings = self.get_registration_requirement_settings()
-            for key, value in user_settings.items():
-                config["settings"][key] = value
-            return config
-        config = {"settings": DEFAULT_SETTINGS, "commands": {}}
-        user_settings = self.get_registration_requirement_settings()
-        for key, value in user_settings.items():
-            config["settings"][key] = value
         session.close()
-        return config
+        return tuple(sorted({str(name).lower() for (name,) in providers}))
 
     async def inference(self, prompt: str, tokens: int = 0, images: list = []):
         if not prompt:
@@ -417,28 +411,10 @@ class Agent:
     def get_agent_extensions(self):
         extensions = self.extensions.get_extensions()
         new_extensions = []
-        session = get_session()
-        user_oauth = (
-            session.query(UserOAuth).filter(UserOAuth.user_id == self.user_id).all()
-        )
-        microsoft_sso = False
-        google_sso = False
-        github_sso = False
-        if user_oauth:
-            for oauth in user_oauth:
-                provider = (
-                    session.query(OAuthProvider)
-                    .filter(OAuthProvider.id == oauth.provider_id)
-                    .first()
-                )
-                if provider:
-                    if str(provider.name).lower() == "microsoft":
-                        microsoft_sso = True
-                    if str(provider.name).lower() == "google":
-                        google_sso = True
-                    if str(provider.name).lower() == "github":
-                        github_sso = True
-        session.close()
+        sso_providers = self.get_sso_providers()
+        microsoft_sso = "microsoft" in sso_providers
+        google_sso = "google" in sso_providers
+        github_sso = "github" in sso_providers
         for extension in extensions:
             if str(extension["extension_name"]).lower() == "microsoft":
                 if not microsoft_sso:
@@ -489,14 +465,15 @@ class Agent:
         )
         if not agent:
             if self.user == DEFAULT_USER:
+                session.close()
                 return f"Agent {self.agent_name} not found."
             # Check if it is a global agent and copy it if necessary
-            global_user = session.query(User).filter(User.email == DEFAULT_USER).first()
+            global_user_id = get_cached_user_id(DEFAULT_USER)
             global_agent = (
                 session.query(AgentModel)
                 .filter(
                     AgentModel.name == self.agent_name,
-                    AgentModel.user_id == global_user.id,
+                    AgentModel.user_id == global_user_id,
                 )
                 .first()
             )
@@ -590,8 +567,13 @@ class Agent:
                     )
                     session.add(agent_setting)
 
+        session.query(AgentModel).filter(AgentModel.id == self.agent_id).update(
+            {AgentModel.config_version: AgentModel.config_version + 1},
+            synchronize_session=False,
+        )
         try:
             session.commit()
+            invalidate_agent(user=self.user, agent_name=self.agent_name)
             logging.info(f"Agent {self.agent_name} configuration updated successfully.")
         except Exception as e:
             session.rollback()
@@ -671,6 +653,7 @@ class Agent:
             .first()
         )
         if not agent:
+            session.close()
             return f"Agent {self.agent_name} not found."
         browsed_link = AgentBrowsedLink(
             agent_id=agent.id, url=url, conversation_id=conversation_id
@@ -700,6 +683,7 @@ class Agent:
             .first()
         )
         if not agent:
+            session.close()
             return f"Agent {self.agent_name} not found."
         browsed_link = (
             session.query(AgentBrowsedLink)
@@ -707,6 +691,7 @@ class Agent:
             .first()
         )
         if not browsed_link:
+            session.close()
             return f"Link {url} not found."
         session.delete(browsed_link)
         session.commit()
@@ -714,25 +699,176 @@ class Agent:
         return f"Link {url} deleted from browsed links."
 
     def get_agent_id(self):
-        session = get_session()
-        agent = (
-            session.query(AgentModel)
-            .filter(
-                AgentModel.name == self.agent_name, AgentModel.user_id == self.user_id
-            )
-            .first()
-        )
-        if not agent:
-            agent = (
-                session.query(AgentModel)
-                .filter(
-                    AgentModel.name == self.agent_name,
-                    AgentModel.user.has(email=DEFAULT_USER),
+        agent_id = get_cached_agent_id(user_id=self.user_id, agent_name=self.agent_name)
+        if not agent_id:
+            # Fall back to the global agent with the same name
+            global_user_id = get_cached_user_id(DEFAULT_USER)
+            if global_user_id:
+                agent_id = get_cached_agent_id(
+                    user_id=global_user_id, agent_name=self.agent_name
                 )
-                .first()
+        return agent_id
+
+
+AGENT_INSTANCES = "agent_instance"
+AGENT_CONFIGS = "agent_config"
+
+# Agents of this worker, keyed by (user, agent name), copied for each request by get_agent.
+# Each entry also holds the agent's config version and API key digest, so a changed config
+# or key rebuilds the agent.
+agent_registry = IdentityCache(
+    ttl=int(getenv("AGENT_REGISTRY_TTL")),
+    max_size=int(getenv("AGENT_REGISTRY_SIZE")),
+)
+
+# Settings and enabled commands of each agent, keyed by agent ID and shared by every user of
+# the agent. Entries hold the config version they were loaded at.
+agent_configs = IdentityCache(
+    ttl=int(getenv("AGENT_CONFIG_CACHE_TTL")),
+    max_size=int(getenv("AGENT_CONFIG_CACHE_SIZE")),
+)
+
+
+def get_agent_config_version(user_id, agent_name):
+    """
+    Returns the ID and config version of the user's agent, or of the global agent with that
+    name, or None if neither exists.
+    """
+    agent_id = get_cached_agent_id(user_id=user_id, agent_name=agent_name)
+    if not agent_id:
+        global_user_id = get_cached_user_id(DEFAULT_USER)
+        if global_user_id:
+            agent_id = get_cached_agent_id(
+                user_id=global_user_id, agent_name=agent_name
             )
-            session.close()
-            if not agent:
-                return None
-        session.close()
-        return agent.id
+    if not agent_id:
+        return None
+    session = get_session()
+    agent = (
+        session.query(AgentModel.config_version)
+        .filter(AgentModel.id == agent_id)
+        .first()
+    )
+    session.close()
+    return (str(agent_id), agent[0]) if agent else None
+
+
+def get_agent(
+    agent_name=None, user=DEFAULT_USER, ApiClient: AGiXTSDK = None, api_key=None
+):
+    """
+    Returns an Agent for one request. Its extensions and command list come from this worker's
+    registry, and are only loaded again when the agent is not cached or its config version
+    or API key changed, which costs one indexed lookup of the config version. Providers keep
+    per-call state, so every request gets its own.
+
+    Args:
+        agent_name (str): Name of the agent.
+        user (str): Email of the user.
+        ApiClient (AGiXTSDK): Client the agent's providers and extensions call back with.
+        api_key (str): API key `ApiClient` was created with.
+
+    Returns:
+        Agent: The agent. Agents that do not exist are built on every call.
+    """
+    agent_name = agent_name if agent_name is not None else "AGiXT"
+    user = (user if user is not None else DEFAULT_USER).lower()
+    version = get_agent_config_version(
+        user_id=get_user_id(user=user), agent_name=agent_name
+    )
+    digest = hashlib.sha256(str(api_key).encode()).hexdigest()
+    entry = agent_registry.get(AGENT_INSTANCES, (user, agent_name))
+    if entry is not None and entry[0] == (version, digest):
+        return entry[1].for_request(ApiClient=ApiClient)
+    agent = Agent(agent_name=agent_name, user=user, ApiClient=ApiClient)
+    if version is not None:
+        # The cached copy keeps its own config, its providers are replaced on every use
+        template = copy.copy(agent)
+        template.AGENT_CONFIG = {
+            "settings": dict(agent.AGENT_CONFIG["settings"]),
+            "commands": dict(agent.AGENT_CONFIG["commands"]),
+        }
+        agent_registry.set(
+            AGENT_INSTANCES, (user, agent_name), ((version, digest), template)
+        )
+    return agent
+
+
+def invalidate_agent(user, agent_name):
+    agent_registry.invalidate(AGENT_INSTANCES, (str(user).lower(), agent_name))
+
+
+def load_agent_config(agent_id):
+    """
+    Loads the agent's settings and the enabled state of every command in one query.
+    Commands the agent has no row for are disabled.
+    """
+    session = get_session()
+    commands = session.query(
+        literal("command").label("kind"),
+        Command.name.label("name"),
+        cast(AgentCommand.state, String).label("value"),
+    ).outerjoin(
+        AgentCommand,
+        and_(AgentCommand.command_id == Command.id, AgentCommand.agent_id == agent_id),
+    )
+    settings = session.query(
+        literal("setting").label("kind"),
+        AgentSettingModel.name.label("name"),
+        AgentSettingModel.value.label("value"),
+    ).filter(AgentSettingModel.agent_id == agent_id)
+    rows = commands.union_all(settings).all()
+    session.close()
+    config = {"settings": {}, "commands": {}}
+    for kind, name, value in rows:
+        if kind == "setting":
+            config["settings"][name] = value
+        else:
+            enabled = str(value).lower() in ("true", "1", "t")
+            config["commands"][name] = config["commands"].get(name, False) or enabled
+    return config
+
+
+def get_versioned_agent_config(
+    agent_name, user=DEFAULT_USER, registration_settings: bool = True
+):
+    """
+    Returns the settings and commands of the user's agent, or of the global agent with that
+    name, with the user's registration settings applied unless `registration_settings` is
+    off. Agents that do not exist get the default settings and no commands.
+
+    The config is cached per agent and reloaded when its config version changes, so a cached
+    config costs one indexed lookup of the version.
+
+    Args:
+        agent_name (str): Name of the agent.
+        user (str): Email of the user.
+        registration_settings (bool): Whether to apply the user's registration settings.
+
+    Returns:
+        tuple: The agent's ID and config version, or None if it does not exist, and a dict
+            with its "settings" and "commands". Callers get their own copy to modify.
+    """
+    user = (user if user is not None else DEFAULT_USER).lower()
+    user_id = get_user_id(user=user)
+    version = get_agent_config_version(user_id=user_id, agent_name=agent_name)
+    if version is None:
+        config = {"settings": dict(DEFAULT_SETTINGS), "commands": {}}
+    else:
+        agent_id, config_version = version
+        entry = agent_configs.get(AGENT_CONFIGS, agent_id)
+        if entry is None or entry[0] != config_version:
+            entry = (config_version, load_agent_config(agent_id))
+            agent_configs.set(AGENT_CONFIGS, agent_id, entry)
+        config = {
+            "settings": dict(entry[1]["settings"]),
+            "commands": dict(entry[1]["commands"]),
+        }
+    if registration_settings:
+        config["settings"].update(get_cached_registration_settings(user_id))
+    return version, config
+
+
+def get_agent_config(agent_name, user=DEFAULT_USER):
+    """Returns the cached settings and commands of the agent, see get_versioned_agent_config."""
+    return get_versioned_agent_config(agent_name=agent_name, user=user)[1]
@@ -13,7 +13,15 @@ WORKERS = int(getenv("UVICORN_WORKERS"))
 AGIXT_URI = getenv("AGIXT_URI")
 
 # Defining these here to be referenced externally.
-from Agent import Agent, add_agent, delete_agent, rename_agent, get_agents
+from Agent import (
+    Agent,
+    add_agent,
+    delete_agent,
+    rename_agent,
+    get_agents,
+    get_agent,
+    get_agent_config,
+)
 from Chain import Chain
 from Prompts import Prompts
 from Conversations import Conversations
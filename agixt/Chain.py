@@ -1,5 +1,6 @@
 from DB import (
     get_session,
+    query_only,
     Chain as ChainDB,
     ChainStep,
     ChainStepResponse,
@@ -9,7 +10,6 @@ from DB import (
     ChainStepArgument,
     Prompt,
     Command,
-    User,
     TaskCategory,
     TaskItem,
 )
@@ -17,6 +17,7 @@ from Globals import getenv, DEFAULT_USER
 from Prompts import Prompts
 from Extensions import Extensions
 from MagicalAuth import get_user_id
+from IdentityCache import get_cached_user_id
 import logging
 import asyncio
 
@@ -31,13 +32,14 @@ class Chain:
         self.user = user
         self.user_id = get_user_id(self.user)
 
+    @query_only
     def get_chain(self, chain_name):
         session = get_session()
         chain_name = chain_name.replace("%20", " ")
-        user_data = session.query(User).filter(User.email == DEFAULT_USER).first()
+        global_user_id = get_cached_user_id(DEFAULT_USER)
         chain_db = (
             session.query(ChainDB)
-            .filter(ChainDB.user_id == user_data.id, ChainDB.name == chain_name)
+            .filter(ChainDB.user_id == global_user_id, ChainDB.name == chain_name)
             .first()
         )
         if chain_db is None:
@@ -106,11 +108,12 @@ class Chain:
         session.close()
         return chain_data
 
+    @query_only
     def get_chains(self):
         session = get_session()
-        user_data = session.query(User).filter(User.email == DEFAULT_USER).first()
+        global_user_id = get_cached_user_id(DEFAULT_USER)
         global_chains = (
-            session.query(ChainDB).filter(ChainDB.user_id == user_data.id).all()
+            session.query(ChainDB).filter(ChainDB.user_id == global_user_id).all()
         )
         chains = session.query(ChainDB).filter(ChainDB.user_id == self.user_id).all()
         chain_list = []
@@ -160,16 +163,13 @@ class Chain:
                 session.query(ChainDB)
                 .filter(
                     ChainDB.name == chain_name,
-                    ChainDB.user_id
-                    == session.query(User)
-                    .filter(User.email == DEFAULT_USER)
-                    .first()
-                    .id,
+                    ChainDB.user_id == get_cached_user_id(DEFAULT_USER),
                 )
                 .first()
             )
         if not chain:
             logging.error(f"Chain {chain_name} not found.")
+            session.close()
             return
         agent = (
             session.query(Agent)
@@ -181,11 +181,7 @@ class Chain:
                 session.query(Agent)
                 .filter(
                     Agent.name == agent_name,
-                    Agent.user_id
-                    == session.query(User)
-                    .filter(User.email == DEFAULT_USER)
-                    .first()
-                    .id,
+                    Agent.user_id == get_cached_user_id(DEFAULT_USER),
                 )
                 .first()
             )
@@ -210,11 +206,7 @@ class Chain:
                     session.query(Prompt)
                     .filter(
                         Prompt.name == prompt["prompt_name"],
-                        Prompt.user_id
-                        == session.query(User)
-                        .filter(User.email == DEFAULT_USER)
-                        .first()
-                        .id,
+                        Prompt.user_id == get_cached_user_id(DEFAULT_USER),
                     )
                     .first()
                 )
@@ -236,11 +228,7 @@ class Chain:
                     session.query(ChainDB)
                     .filter(
                         ChainDB.name == prompt[argument_key],
-                        ChainDB.user_id
-                        == session.query(User)
-                        .filter(User.email == DEFAULT_USER)
-                        .first()
-                        .id,
+                        ChainDB.user_id == get_cached_user_id(DEFAULT_USER),
                     )
                     .first()
                 )
@@ -449,10 +437,10 @@ class Chain:
     def get_steps(self, chain_name):
         session = get_session()
         chain_name = chain_name.replace("%20", " ")
-        user_data = session.query(User).filter(User.email == DEFAULT_USER).first()
+        global_user_id = get_cached_user_id(DEFAULT_USER)
         chain_db = (
             session.query(ChainDB)
-            .filter(ChainDB.user_id == user_data.id, ChainDB.name == chain_name)
+            .filter(ChainDB.user_id == global_user_id, ChainDB.name == chain_name)
             .first()
         )
         if chain_db is None:
@@ -908,6 +896,7 @@ class Chain:
             session.close()
             return chain_run_id
         else:
+            session.close()
             return await self.get_chain_run_id(chain_name=chain_name)
 
     def get_chain_args(self, chain_name):
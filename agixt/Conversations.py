@@ -1,15 +1,30 @@
-from datetime import datetime
+from datetime import datetime, timezone
+import uuid
 import logging
 from DB import (
     Conversation,
     Message,
-    User,
-    UserPreferences,
     get_session,
+    get_message_type,
+    DATABASE_TYPE,
+    MESSAGE_TYPE_ACTIVITY,
+    MESSAGE_TYPE_MESSAGE,
 )
 from Globals import getenv, DEFAULT_USER
+from IdentityCache import (
+    cache_conversation_id,
+    get_cached_conversation_id,
+    get_cached_user_id,
+    IdentityCache,
+    get_cached_timezone,
+    invalidate_conversation_id,
+)
+from MessageLog import flush_messages, message_log
+from sqlalchemy import String, and_, case, insert, not_, or_, type_coerce
 from sqlalchemy.sql import func
 import pytz
+import json
+from fastapi import HTTPException
 
 logging.basicConfig(
     level=getenv("LOG_LEVEL"),
@@ -17,6 +32,10 @@ logging.basicConfig(
 )
 
 
+EXPORT_BATCH_SIZE = 1000
+PREVIEW_LENGTH = 100
+
+
 def get_conversation_name_by_id(conversation_id, user_id):
     session = get_session()
     conversation = (
@@ -35,15 +54,614 @@ def get_conversation_name_by_id(conversation_id, user_id):
     return conversation_name
 
 
+def is_activity(content) -> bool:
+    return str(content).startswith("[ACTIVITY]")
+
+
+def is_interaction(content) -> bool:
+    # What prompts see as conversation history, no activities or audio players
+    return not str(content).startswith(
+        ("[ACTIVITY]", "[SUBACTIVITY]", "<audio controls>")
+    )
+
+
+def localize_timestamps(timestamps: list, local_tz) -> list:
+    """
+    Converts naive UTC timestamps to aware timestamps in `local_tz`. The UTC offset is looked
+    up once per 15 minute UTC window instead of once per timestamp, since timezone
+    transitions fall on those boundaries.
+    """
+    offsets = {}
+    localized = []
+    for timestamp in timestamps:
+        if timestamp is None:
+            localized.append(None)
+            continue
+        window = timestamp.replace(
+            minute=timestamp.minute - timestamp.minute % 15, second=0, microsecond=0
+        )
+        tzinfo = offsets.get(window)
+        if tzinfo is None:
+            tzinfo = timezone(
+                pytz.utc.localize(window).astimezone(local_tz).utcoffset()
+            )
+            offsets[window] = tzinfo
+        localized.append((timestamp + tzinfo.utcoffset(None)).replace(tzinfo=tzinfo))
+    return localized
+
+
+def encode_cursor(message) -> str:
+    return f"{message['timestamp'].isoformat()}|{message['id']}"
+
+
+def decode_cursor(cursor: str):
+    """Parses a cursor from encode_cursor, raising a 400 error if it is malformed."""
+    try:
+        timestamp, row_id = cursor.split("|", 1)
+        timestamp = datetime.fromisoformat(timestamp)
+        row_id = uuid.UUID(row_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    return (
+        keyset_timestamp(timestamp),
+        str(row_id) if DATABASE_TYPE == "sqlite" else row_id,
+    )
+
+
+def keyset_column(column):
+    """
+    Returns the timestamp column as keyset pagination compares and sorts it. SQLite keeps
+    server-default timestamps as text without microseconds, which would compare unequal to
+    the same instant written with them, so those are padded.
+    """
+    if DATABASE_TYPE != "sqlite":
+        return column
+    return type_coerce(
+        case((func.length(column) == 19, column.op("||")(".000000")), else_=column),
+        String,
+    )
+
+
+def keyset_timestamp(timestamp: datetime):
+    """Returns a cursor timestamp in the form keyset_column compares against."""
+    if DATABASE_TYPE != "sqlite":
+        return timestamp
+    return timestamp.strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+def get_history_segments(session, conversation_id) -> list:
+    """
+    Returns the (conversation ID, fork point) segments that make up a conversation's
+    history, the conversation itself first with no limit, then each ancestor it was forked
+    from, limited to the messages up to the fork point. A fork point is the (timestamp,
+    message ID) of the last shared message, with no message ID for forks made before it
+    was recorded.
+    """
+    segments = [(conversation_id, None)]
+    until = None
+    current_id = conversation_id
+    while True:
+        fork = (
+            session.query(
+                Conversation.parent_id,
+                Conversation.fork_timestamp,
+                Conversation.fork_message_id,
+            )
+            .filter(Conversation.id == current_id)
+            .first()
+        )
+        if not fork or not fork.parent_id or fork.parent_id in dict(segments):
+            return segments
+        fork_point = (fork.fork_timestamp, fork.fork_message_id)
+        # Forking at a message inherited from further up limits every level above
+        if until is None or fork_point_key(fork_point) < fork_point_key(until):
+            until = fork_point
+        current_id = fork.parent_id
+        segments.append((current_id, until))
+
+
+def fork_point_key(fork_point):
+    # A fork point without a message ID covers its whole timestamp, so it sorts last
+    timestamp, message_id = fork_point
+    return (timestamp, message_id is None, str(message_id or ""))
+
+
+def history_filter(segments: list):
+    """Returns the filter selecting the messages of the given history segments."""
+    conditions = []
+    for conversation_id, until in segments:
+        if until is None:
+            conditions.append(Message.conversation_id == conversation_id)
+            continue
+        timestamp, message_id = until
+        if message_id is None:
+            bound = Message.timestamp <= timestamp
+        else:
+            # Legacy SQLite timestamps have whole seconds, so ties are common
+            timestamp_key = keyset_column(Message.timestamp)
+            timestamp = keyset_timestamp(timestamp)
+            bound = or_(
+                timestamp_key < timestamp,
+                and_(timestamp_key == timestamp, Message.id <= message_id),
+            )
+        conditions.append(and_(Message.conversation_id == conversation_id, bound))
+    return conditions[0] if len(conditions) == 1 else or_(*conditions)
+
+
+def conversation_filter(session, conversation_id):
+    """Returns the filter selecting every message in a conversation's history, forks included."""
+    return history_filter(get_history_segments(session, conversation_id))
+
+
+def history_summary(session, conversation_id) -> dict:
+    """
+    Returns the message count and the preview and timestamp of the last message of a
+    conversation's whole history, as get_conversation_list reports them. Activities are
+    left out, and messages inherited from the conversations it was forked from included.
+    """
+    history = conversation_filter(session, conversation_id)
+    message_count = (
+        session.query(func.count(Message.id))
+        .filter(history, Message.message_type == MESSAGE_TYPE_MESSAGE)
+        .scalar()
+    )
+    last_message = (
+        session.query(
+            func.substr(Message.content, 1, PREVIEW_LENGTH), Message.timestamp
+        )
+        .filter(history, Message.message_type == MESSAGE_TYPE_MESSAGE)
+        .order_by(Message.timestamp.desc())
+        .first()
+    )
+    return {
+        "message_count": message_count,
+        "last_message": last_message[0] if last_message else None,
+        "last_message_at": last_message[1] if last_message else None,
+    }
+
+
+def materialize_fork(session, conversation_id) -> dict:
+    """
+    Copies the messages a fork inherits into the fork itself and detaches it from its
+    parent, so they can be changed without affecting the parent or its other forks. The
+    caller commits.
+
+    Returns:
+        dict: New message ID for each inherited message ID.
+    """
+    segments = get_history_segments(session, conversation_id)
+    if len(segments) == 1:
+        return {}
+    message_ids = {}
+    rows = []
+    inherited = (
+        session.query(
+            Message.id,
+            Message.role,
+            Message.content,
+            Message.timestamp,
+            Message.updated_at,
+            Message.updated_by,
+            Message.feedback_received,
+        )
+        .filter(history_filter(segments[1:]))
+        .order_by(keyset_column(Message.timestamp), Message.id)
+        .all()
+    )
+    # Copies get IDs in the same order, so messages that share a timestamp keep their order
+    new_ids = sorted(uuid.uuid4() for _ in inherited)
+    for message, message_id in zip(inherited, new_ids):
+        message_ids[str(message.id)] = str(message_id)
+        content = message.content
+        parent_id = get_message_type(content)[1]
+        if parent_id in message_ids:
+            content = content.replace(parent_id, message_ids[parent_id], 1)
+        rows.append(
+            {
+                "id": str(message_id) if DATABASE_TYPE == "sqlite" else message_id,
+                "role": message.role,
+                "content": content,
+                "conversation_id": conversation_id,
+                "timestamp": message.timestamp,
+                "updated_at": message.updated_at,
+                "updated_by": message.updated_by,
+                "feedback_received": message.feedback_received,
+            }
+        )
+    for i in range(0, len(rows), EXPORT_BATCH_SIZE):
+        session.execute(insert(Message), rows[i : i + EXPORT_BATCH_SIZE])
+    # Subactivities the fork logged under an inherited activity follow it to the copy
+    subactivities = (
+        session.query(Message)
+        .filter(
+            Message.conversation_id == conversation_id,
+            Message.parent_activity_id != None,
+        )
+        .all()
+    )
+    for message in subactivities:
+        if message.parent_activity_id in message_ids:
+            new_parent_id = message_ids[message.parent_activity_id]
+            message.content = message.content.replace(
+                message.parent_activity_id, new_parent_id, 1
+            )
+            message.parent_activity_id = new_parent_id
+    # Forks of this conversation that were made at an inherited message point at its copy
+    descendant_ids = get_descendant_ids(session, conversation_id)
+    if descendant_ids:
+        forks = (
+            session.query(Conversation.id, Conversation.fork_message_id)
+            .filter(
+                Conversation.id.in_(descendant_ids),
+                Conversation.fork_message_id != None,
+            )
+            .all()
+        )
+        for fork_id, fork_message_id in forks:
+            if str(fork_message_id) in message_ids:
+                new_id = message_ids[str(fork_message_id)]
+                session.query(Conversation).filter(Conversation.id == fork_id).update(
+                    {
+                        Conversation.fork_message_id: (
+                            new_id if DATABASE_TYPE == "sqlite" else uuid.UUID(new_id)
+                        )
+                    },
+                    synchronize_session=False,
+                )
+    session.query(Conversation).filter(Conversation.id == conversation_id).update(
+        {
+            Conversation.parent_id: None,
+            Conversation.fork_timestamp: None,
+            Conversation.fork_message_id: None,
+        },
+        synchronize_session=False,
+    )
+    return message_ids
+
+
+def get_descendant_ids(session, conversation_id) -> list:
+    """Returns the IDs of every fork of the conversation, forks of forks included."""
+    descendant_ids = []
+    parent_ids = [conversation_id]
+    while parent_ids:
+        parent_ids = [
+            fork_id
+            for (fork_id,) in session.query(Conversation.id)
+            .filter(Conversation.parent_id.in_(parent_ids))
+            .all()
+            if fork_id not in descendant_ids
+        ]
+        descendant_ids.extend(parent_ids)
+    return descendant_ids
+
+
+def release_forks(session, conversation_id, since=None):
+    """
+    Materializes the forks of a conversation that share its messages from `since` on, or
+    every fork if `since` is None, before those messages are changed or deleted.
+    """
+    query = session.query(Conversation.id).filter(
+        Conversation.parent_id == conversation_id
+    )
+    if since is not None:
+        query = query.filter(Conversation.fork_timestamp >= since)
+    for (fork_id,) in query.all():
+        materialize_fork(session, fork_id)
+
+
+def find_message(session, conversation_id, message_id=None, content=None):
+    """
+    Finds a message in a conversation's history, by ID or else by content, to be changed.
+    A message the conversation inherited from its parent is copied into it first, and
+    forks that share the message get their own copies, so the change stays in this
+    conversation.
+    """
+    query = session.query(Message).filter(conversation_filter(session, conversation_id))
+    if message_id is not None:
+        query = query.filter(Message.id == message_id)
+    else:
+        query = query.filter(Message.content == content)
+    message = query.first()
+    if not message:
+        return None
+    if str(message.conversation_id) != str(conversation_id):
+        message_ids = materialize_fork(session, conversation_id)
+        message = (
+            session.query(Message)
+            .filter(Message.id == message_ids[str(message.id)])
+            .first()
+        )
+    release_forks(session, conversation_id, since=message.timestamp)
+    return message
+
+
+def format_timestamp(timestamp):
+    return timestamp.isoformat() if timestamp else None
+
+
+def parse_timestamp(timestamp):
+    # Stored timestamps are naive UTC
+    if not timestamp:
+        return None
+    timestamp = datetime.fromisoformat(str(timestamp))
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+
+def conversation_record(row) -> str:
+    record = {
+        "type": "conversation",
+        "name": row.name,
+        "created_at": format_timestamp(row.created_at),
+        "updated_at": format_timestamp(row.updated_at),
+    }
+    return json.dumps(record) + "\n"
+
+
+def message_record(row) -> str:
+    record = {
+        "type": "message",
+        "id": str(row.message_id),
+        "role": row.role,
+        "message": row.content,
+        "timestamp": format_timestamp(row.timestamp),
+        "updated_at": format_timestamp(row.message_updated_at),
+        "feedback_received": bool(row.feedback_received),
+    }
+    return json.dumps(record) + "\n"
+
+
+def iter_export_lines(user_id, conversation_id=None):
+    """
+    Yields a user's conversations as NDJSON lines, each conversation record followed by its
+    messages oldest first. Rows are streamed from a server-side cursor in batches of
+    EXPORT_BATCH_SIZE, so memory use does not grow with the number of messages. Forks are
+    exported with the history they inherit.
+
+    Args:
+        user_id: ID of the user whose conversations are exported.
+        conversation_id: Export only this conversation, or None for all of them.
+
+    Yields:
+        str: One JSON record per line.
+    """
+    flush_messages()
+    session = get_session()
+    message_columns = [
+        Message.id.label("message_id"),
+        Message.role,
+        Message.content,
+        Message.timestamp,
+        Message.updated_at.label("message_updated_at"),
+        Message.feedback_received,
+    ]
+    try:
+        query = (
+            session.query(
+                Conversation.id,
+                Conversation.name,
+                Conversation.created_at,
+                Conversation.updated_at,
+                *message_columns,
+            )
+            .outerjoin(Message, Message.conversation_id == Conversation.id)
+            .filter(Conversation.user_id == user_id, Conversation.parent_id == None)
+        )
+        if conversation_id:
+            query = query.filter(Conversation.id == conversation_id)
+        query = query.order_by(Conversation.id, Message.timestamp).execution_options(
+            stream_results=True, yield_per=EXPORT_BATCH_SIZE
+        )
+        current_conversation_id = None
+        for row in query:
+            if row.id != current_conversation_id:
+                current_conversation_id = row.id
+                yield conversation_record(row)
+            if row.message_id is not None:
+                yield message_record(row)
+        # A fork's history spans several conversations, so each is read on its own
+        forks = session.query(
+            Conversation.id,
+            Conversation.name,
+            Conversation.created_at,
+            Conversation.updated_at,
+        ).filter(Conversation.user_id == user_id, Conversation.parent_id != None)
+        if conversation_id:
+            forks = forks.filter(Conversation.id == conversation_id)
+        for fork in forks.order_by(Conversation.id).all():
+            yield conversation_record(fork)
+            messages = (
+                session.query(*message_columns)
+                .filter(conversation_filter(session, fork.id))
+                .order_by(Message.timestamp)
+                .execution_options(stream_results=True, yield_per=EXPORT_BATCH_SIZE)
+            )
+            for row in messages:
+                yield message_record(row)
+    finally:
+        session.close()
+
+
+class ConversationImporter:
+    """
+    Writes exported conversation records back to the database with multi-row inserts.
+
+    Records are added in export order. A conversation record switches the target to the
+    user's conversation with that name, creating it if needed, and message records are
+    appended to the current target. Messages get new IDs, and keep their timestamps when
+    the record has one. Subactivities are pointed at the new IDs of their activities. With
+    `use_record_names` off, conversation records are skipped and every message goes to
+    `conversation_name`.
+    """
+
+    def __init__(
+        self,
+        user=DEFAULT_USER,
+        conversation_name=None,
+        batch_size=1000,
+        use_record_names=True,
+    ):
+        self.user = user
+        self.use_record_names = use_record_names
+        self.user_id = get_cached_user_id(user)
+        self.conversation_name = conversation_name
+        self.conversation_id = None
+        self.batch_size = batch_size
+        self.rows = []
+        self.conversations = set()
+        self.activity_ids = {}
+        self.messages = 0
+
+    def get_conversation_id(self, session):
+        if self.conversation_id is None:
+            if not self.conversation_name:
+                self.conversation_name = "-"
+            self.conversation_id = get_cached_conversation_id(
+                user_id=self.user_id, conversation_name=self.conversation_name
+            )
+            if not self.conversation_id:
+                conversation = Conversation(
+                    name=self.conversation_name, user_id=self.user_id
+                )
+                session.add(conversation)
+                session.commit()
+                self.conversation_id = conversation.id
+                cache_conversation_id(
+                    user_id=self.user_id,
+                    conversation_name=self.conversation_name,
+                    conversation_id=self.conversation_id,
+                )
+            self.conversations.add(str(self.conversation_id))
+        return self.conversation_id
+
+    def validate_record(self, record):
+        """
+        Checks that add_records can import the record, so a bad record can be reported
+        before anything is written.
+
+        Args:
+            record: A decoded NDJSON record.
+
+        Raises:
+            ValueError: If the record is missing a field or has one of the wrong type.
+        """
+        if not isinstance(record, dict):
+            raise ValueError("Record must be a JSON object.")
+        if record.get("type") == "conversation":
+            if self.use_record_names and (
+                not isinstance(record.get("name"), str) or not record["name"]
+            ):
+                raise ValueError("Conversation record must have a name.")
+            return
+        for field in ("role", "message"):
+            if not isinstance(record.get(field), str):
+                raise ValueError(f"Message record must have a string {field}.")
+        for field in ("timestamp", "updated_at"):
+            try:
+                parse_timestamp(record.get(field))
+            except ValueError:
+                raise ValueError(f"Message record has an invalid {field}.")
+
+    def add_records(self, records: list):
+        """
+        Adds records and writes them in batches of `batch_size`.
+
+        Args:
+            records (list): Conversation and message records, as produced by iter_export_lines,
+                that passed validate_record.
+        """
+        session = get_session()
+        try:
+            for record in records:
+                if record.get("type") == "conversation":
+                    if not self.use_record_names:
+                        continue
+                    self.write(session)
+                    self.conversation_name = record["name"]
+                    self.conversation_id = None
+                    continue
+                role = record["role"]
+                if role.lower() == "user":
+                    role = "USER"
+                timestamp = (
+                    parse_timestamp(record.get("timestamp"))
+                    or message_log.new_timestamp()
+                )
+                message_id = uuid.uuid4()
+                content = record["message"]
+                message_type, parent_id = get_message_type(content)
+                if message_type == MESSAGE_TYPE_ACTIVITY and record.get("id"):
+                    self.activity_ids[str(record["id"])] = str(message_id)
+                elif parent_id in self.activity_ids:
+                    content = content.replace(
+                        parent_id, self.activity_ids[parent_id], 1
+                    )
+                self.rows.append(
+                    {
+                        "id": (
+                            str(message_id) if DATABASE_TYPE == "sqlite" else message_id
+                        ),
+                        "role": role,
+                        "content": content,
+                        "conversation_id": self.get_conversation_id(session),
+                        "timestamp": timestamp,
+                        "updated_at": parse_timestamp(record.get("updated_at"))
+                        or timestamp,
+                        "feedback_received": bool(
+                            record.get("feedback_received", False)
+                        ),
+                    }
+                )
+                if len(self.rows) >= self.batch_size:
+                    self.write(session)
+            self.write(session)
+        finally:
+            session.close()
+
+    def write(self, session):
+        if not self.rows:
+            return
+        session.execute(insert(Message), self.rows)
+        conversation_ids = list({row["conversation_id"] for row in self.rows})
+        session.query(Conversation).filter(
+            Conversation.id.in_(conversation_ids)
+        ).update({Conversation.updated_at: func.now()}, synchronize_session=False)
+        session.commit()
+        self.messages += len(self.rows)
+        self.rows = []
+
+
 class Conversations:
     def __init__(self, conversation_name=None, user=DEFAULT_USER):
         self.conversation_name = conversation_name
         self.user = user
+        # Latest activity logged or looked up through this object, other workers may log
+        # newer ones, so it is not shared beyond this object's request
+        self.last_activity_id = None
+
+    def export_lines(self):
+        """Yields this conversation as NDJSON lines, see iter_export_lines."""
+        if not self.conversation_name:
+            self.conversation_name = "-"
+        conversation_id = get_cached_conversation_id(
+            user_id=get_cached_user_id(self.user),
+            conversation_name=self.conversation_name,
+        )
+        if not conversation_id:
+            return iter(())
+        return iter_export_lines(
+            user_id=get_cached_user_id(self.user), conversation_id=conversation_id
+        )
+
+    def export_all_lines(self):
+        """Yields every conversation of the user as NDJSON lines, see iter_export_lines."""
+        return iter_export_lines(user_id=get_cached_user_id(self.user))
 
     def export_conversation(self):
+        flush_messages()
         session = get_session()
-        user_data = session.query(User).filter(User.email == self.user).first()
-        user_id = user_data.id
+        user_id = get_cached_user_id(self.user)
         if not self.conversation_name:
             self.conversation_name = "-"
         conversation = (
@@ -56,10 +674,11 @@ class Conversations:
         )
         history = {"interactions": []}
         if not conversation:
+            session.close()
             return history
         messages = (
             session.query(Message)
-            .filter(Message.conversation_id == conversation.id)
+            .filter(conversation_filter(session, conversation.id))
             .all()
         )
         for message in messages:
@@ -73,41 +692,35 @@ class Conversations:
         return history
 
     def get_conversations(self):
-        session = get_session()
-        user_data = session.query(User).filter(User.email == self.user).first()
-        user_id = user_data.id
+        return list(self.get_conversations_with_ids().values())
 
-        # Use a LEFT OUTER JOIN to get conversations and their messages
-        conversations = (
-            session.query(Conversation)
-            .outerjoin(Message, Message.conversation_id == Conversation.id)
-            .filter(Conversation.user_id == user_id)
-            .filter(Message.id != None)  # Only get conversations with messages
-            .order_by(Conversation.updated_at.desc())
-            .distinct()
-            .all()
+    def user_conversations(self, session, user_id):
+        # Conversations of the user that have messages, newest activity first. EXISTS
+        # stops at the first message instead of joining every message and deduplicating.
+        has_messages = (
+            session.query(Message.id)
+            .filter(Message.conversation_id == Conversation.id)
+            .exists()
+        )
+        return session.query(
+            Conversation.id,
+            Conversation.name,
+            Conversation.created_at,
+            Conversation.updated_at,
+        ).filter(
+            Conversation.user_id == user_id,
+            or_(has_messages, Conversation.parent_id != None),
         )
-
-        conversation_list = [conversation.name for conversation in conversations]
-        session.close()
-        return conversation_list
 
     def get_conversations_with_ids(self):
+        flush_messages()
         session = get_session()
-        user_data = session.query(User).filter(User.email == self.user).first()
-        user_id = user_data.id
-
-        # Use a LEFT OUTER JOIN to get conversations and their messages
+        user_id = get_cached_user_id(self.user)
         conversations = (
-            session.query(Conversation)
-            .outerjoin(Message, Message.conversation_id == Conversation.id)
-            .filter(Conversation.user_id == user_id)
-            .filter(Message.id != None)  # Only get conversations with messages
-            .order_by(Conversation.updated_at.desc())
-            .distinct()
+            self.user_conversations(session, user_id)
+            .order_by(Conversation.updated_at.desc(), Conversation.id.desc())
             .all()
         )
-
         result = {
             str(conversation.id): conversation.name for conversation in conversations
         }
@@ -115,21 +728,14 @@ class Conversations:
         return result
 
     def get_conversations_with_detail(self):
+        flush_messages()
         session = get_session()
-        user_data = session.query(User).filter(User.email == self.user).first()
-        user_id = user_data.id
-
-        # Use a LEFT OUTER JOIN to get conversations and their messages
+        user_id = get_cached_user_id(self.user)
         conversations = (
-            session.query(Conversation)
-            .outerjoin(Message, Message.conversation_id == Conversation.id)
-            .filter(Conversation.user_id == user_id)
-            .filter(Message.id != None)  # Only get conversations with messages
-            .order_by(Conversation.updated_at.desc())
-            .distinct()
+            self.user_conversations(session, user_id)
+            .order_by(Conversation.updated_at.desc(), Conversation.id.desc())
             .all()
         )
-
         result = {
             str(conversation.id): {
                 "name": conversation.name,
@@ -141,139 +747,366 @@ class Conversations:
         session.close()
         return result
 
-    def get_conversation(self, limit=100, page=1):
+    def get_conversation_list(self, limit=50, before=None, search=None):
+        """
+        Gets one page of the user's conversations, most recently updated first, with their
+        message count and a preview of the last message, activities not included. The page is
+        one query, plus two per fork on it. Pages use a keyset on the conversation's
+        updated_at and ID.
+
+        Args:
+            limit (int): Number of conversations per page.
+            before (str): `next_cursor` from the previous page, or None for the first page.
+            search (str): Only include conversations whose name contains this text,
+                ignoring case.
+
+        Returns:
+            dict: "conversations", and "next_cursor" for the following page, or None if
+                this is the last page.
+        """
+        flush_messages()
+        user_id = get_cached_user_id(self.user)
         session = get_session()
-        user_data = session.query(User).filter(User.email == self.user).first()
-        user_id = user_data.id
-        if not self.conversation_name:
-            self.conversation_name = "-"
-        conversation = (
-            session.query(Conversation)
+        # Correlated subqueries, each answered from the message indexes for one
+        # conversation of the page
+        # Activities are not counted, so the count and the preview cover the same messages
+        message_count = (
+            session.query(func.count(Message.id))
             .filter(
-                Conversation.name == self.conversation_name,
-                Conversation.user_id == user_id,
+                Message.conversation_id == Conversation.id,
+                Message.message_type == MESSAGE_TYPE_MESSAGE,
             )
-            .first()
+            .scalar_subquery()
         )
-        if not conversation:
-            # Create the conversation
-            conversation = Conversation(name=self.conversation_name, user_id=user_id)
-            session.add(conversation)
-            session.commit()
+        last_message = (
+            session.query(Message)
+            .filter(
+                Message.conversation_id == Conversation.id,
+                Message.message_type == MESSAGE_TYPE_MESSAGE,
+            )
+            .order_by(Message.timestamp.desc())
+            .limit(1)
+        )
+        last_message_preview = last_message.with_entities(
+            func.substr(Message.content, 1, PREVIEW_LENGTH)
+        ).scalar_subquery()
+        last_message_at = last_message.with_entities(
+            Message.timestamp
+        ).scalar_subquery()
+        query = self.user_conversations(session, user_id).add_columns(
+            Conversation.parent_id,
+            message_count.label("message_count"),
+            last_message_preview.label("last_message"),
+            last_message_at.label("last_message_at"),
+        )
+        if search:
+            pattern = (
+                search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            )
+            query = query.filter(Conversation.name.ilike(f"%{pattern}%", escape="\\"))
+        updated_at_key = keyset_column(Conversation.updated_at)
+        if before:
+            updated_at, conversation_id = decode_cursor(before)
+            query = query.filter(
+                or_(
+                    updated_at_key < updated_at,
+                    and_(
+                        updated_at_key == updated_at,
+                        Conversation.id < conversation_id,
+                    ),
+                )
+            )
+        rows = (
+            query.order_by(updated_at_key.desc(), Conversation.id.desc())
+            .limit(limit + 1)
+            .all()
+        )
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(
+                {"id": rows[-1].id, "timestamp": rows[-1].updated_at}
+            )
+        conversations = []
+        for row in rows:
+            conversation = {
+                "id": str(row.id),
+                "name": row.name,
+                "created_at": row.created_at,
+                "updated_at": row.updated_at,
+                "message_count": row.message_count,
+                "last_message": row.last_message,
+                "last_message_at": row.last_message_at,
+            }
+            if row.parent_id is not None:
+                # The subqueries only see a fork's own messages, not the ones it inherits
+                conversation.update(history_summary(session, row.id))
+            conversations.append(conversation)
+        session.close()
+        return {"conversations": conversations, "next_cursor": next_cursor}
+
+    def get_conversation(self, limit=100, page=1):
+        # Read only: a missing conversation is not created, and the user's timezone comes
+        # from the preferences cache
+        flush_messages()
+        if not self.conversation_name:
+            self.conversation_name = "-"
+        user_id = get_cached_user_id(self.user)
+        conversation_id = get_cached_conversation_id(
+            user_id=user_id, conversation_name=self.conversation_name
+        )
+        if not conversation_id:
+            return {"interactions": []}
+        session = get_session()
         offset = (page - 1) * limit
         messages = (
-            session.query(Message)
-            .filter(Message.conversation_id == conversation.id)
+            session.query(
+                Message.id,
+                Message.role,
+                Message.content,
+                Message.timestamp,
+                Message.updated_at,
+                Message.updated_by,
+                Message.feedback_received,
+            )
+            .filter(conversation_filter(session, conversation_id))
             .order_by(Message.timestamp.asc())
             .limit(limit)
             .offset(offset)
             .all()
         )
+        session.close()
         if not messages:
-            session.close()
             return {"interactions": []}
-        return_messages = []
-        # Check if there is a user preference for timezone
-        user_preferences = (
-            session.query(UserPreferences)
-            .filter(
-                UserPreferences.user_id == user_id,
-                UserPreferences.pref_key == "timezone",
-            )
-            .first()
+        local_tz = get_cached_timezone(user_id)
+        timestamps = localize_timestamps(
+            [message.timestamp for message in messages], local_tz
         )
-        if not user_preferences:
-            user_preferences = UserPreferences(
-                user_id=user_id, pref_key="timezone", pref_value=getenv("TZ")
-            )
-            session.add(user_preferences)
-            session.commit()
-        gmt = pytz.timezone("GMT")
-        local_tz = pytz.timezone(user_preferences.pref_value)
-        for message in messages:
-            msg = {
+        updated_at = localize_timestamps(
+            [message.updated_at for message in messages], local_tz
+        )
+        return_messages = [
+            {
                 "id": message.id,
                 "role": message.role,
                 "message": message.content,
-                "timestamp": gmt.localize(message.timestamp).astimezone(local_tz),
-                "updated_at": gmt.localize(message.updated_at).astimezone(local_tz),
+                "timestamp": timestamps[i],
+                "updated_at": updated_at[i],
                 "updated_by": message.updated_by,
                 "feedback_received": message.feedback_received,
             }
-            return_messages.append(msg)
-        session.close()
+            for i, message in enumerate(messages)
+        ]
         return {"interactions": return_messages}
 
-    def fork_conversation(self, message_id):
+    def get_latest_messages(self, session, conversation_id, activities: bool, limit):
+        query = session.query(Message).filter(
+            conversation_filter(session, conversation_id)
+        )
+        if activities:
+            query = query.filter(Message.message_type == MESSAGE_TYPE_ACTIVITY)
+        else:
+            query = query.filter(
+                Message.message_type == MESSAGE_TYPE_MESSAGE,
+                not_(Message.content.like("<audio controls>%")),
+            )
+        messages = (
+            query.order_by(Message.timestamp.desc(), Message.id.desc())
+            .limit(limit)
+            .all()
+        )
+        return [
+            {
+                "id": str(message.id),
+                "role": message.role,
+                "message": message.content,
+                "timestamp": message.timestamp,
+            }
+            for message in reversed(messages)
+        ]
+
+    def get_recent_history(self, limit=5, activity_limit=5):
+        """
+        Gets the latest conversation interactions and activities for prompt building.
+
+        Interactions leave out activities, subactivities and audio players. Only the latest
+        rows of each are read from the database.
+
+        Args:
+            limit (int): Number of interactions to return.
+            activity_limit (int): Number of activities to return.
+
+        Returns:
+            dict: "interactions" and "activities", oldest first, with timestamps in the
+                user's timezone.
+        """
+        if not self.conversation_name:
+            self.conversation_name = "-"
+        user_id = get_cached_user_id(self.user)
+        conversation_id = get_cached_conversation_id(
+            user_id=user_id, conversation_name=self.conversation_name
+        )
+        if not conversation_id:
+            return {"interactions": [], "activities": []}
+        flush_messages()
         session = get_session()
-        user_data = session.query(User).filter(User.email == self.user).first()
-        user_id = user_data.id
+        recent = [
+            (
+                self.get_latest_messages(
+                    session, conversation_id, activities=activities, limit=count
+                )
+                if count > 0
+                else []
+            )
+            for activities, count in ((False, limit), (True, activity_limit))
+        ]
+        session.close()
+        local_tz = get_cached_timezone(user_id)
+        interactions, activities = [
+            [
+                {**message, "timestamp": timestamp}
+                for message, timestamp in zip(
+                    messages,
+                    localize_timestamps(
+                        [message["timestamp"] for message in messages], local_tz
+                    ),
+                )
+            ]
+            for messages in recent
+        ]
+        return {"interactions": interactions, "activities": activities}
 
-        # Get the original conversation
-        original_conversation = (
-            session.query(Conversation)
-            .filter(
-                Conversation.name == self.conversation_name,
-                Conversation.user_id == user_id,
+    def get_conversation_history(self, limit=100, before=None):
+        """
+        Gets one page of the conversation, newest page first, using keyset pagination on
+        the message timestamp and ID instead of an offset.
+
+        Args:
+            limit (int): Number of messages per page.
+            before (str): `next_cursor` from the previous page, or None for the latest page.
+
+        Returns:
+            dict: "interactions" oldest first, and "next_cursor" for the page before this
+                one, or None if this is the first page of the conversation.
+        """
+        flush_messages()
+        if not self.conversation_name:
+            self.conversation_name = "-"
+        user_id = get_cached_user_id(self.user)
+        conversation_id = get_cached_conversation_id(
+            user_id=user_id, conversation_name=self.conversation_name
+        )
+        if not conversation_id:
+            return {"interactions": [], "next_cursor": None}
+        session = get_session()
+        query = session.query(Message).filter(
+            conversation_filter(session, conversation_id)
+        )
+        timestamp_key = keyset_column(Message.timestamp)
+        if before:
+            timestamp, message_id = decode_cursor(before)
+            query = query.filter(
+                or_(
+                    timestamp_key < timestamp,
+                    and_(timestamp_key == timestamp, Message.id < message_id),
+                )
             )
-            .first()
+        messages = (
+            query.order_by(timestamp_key.desc(), Message.id.desc())
+            .limit(limit + 1)
+            .all()
         )
+        next_cursor = None
+        if len(messages) > limit:
+            messages = messages[:limit]
+            next_cursor = encode_cursor(
+                {"id": messages[-1].id, "timestamp": messages[-1].timestamp}
+            )
+        session.close()
+        messages.reverse()
+        local_tz = get_cached_timezone(user_id)
+        timestamps = localize_timestamps(
+            [message.timestamp for message in messages], local_tz
+        )
+        updated_at = localize_timestamps(
+            [message.updated_at for message in messages], local_tz
+        )
+        interactions = [
+            {
+                "id": message.id,
+                "role": message.role,
+                "message": message.content,
+                "timestamp": timestamps[i],
+                "updated_at": updated_at[i],
+                "updated_by": message.updated_by,
+                "feedback_received": message.feedback_received,
+            }
+            for i, message in enumerate(messages)
+        ]
+        return {"interactions": interactions, "next_cursor": next_cursor}
 
-        if not original_conversation:
+    def fork_conversation(self, message_id):
+        """
+        Forks the conversation at a message. The fork references this conversation and the
+        message's timestamp and ID instead of copying the history, so forking takes the same time
+        however long the conversation is. Messages logged to the fork are stored in the
+        fork only.
+
+        Args:
+            message_id: ID of the last message the fork shares with this conversation.
+
+        Returns:
+            str: Name of the new conversation, or None if the message was not found.
+        """
+        flush_messages()
+        user_id = get_cached_user_id(self.user)
+        conversation_id = get_cached_conversation_id(
+            user_id=user_id, conversation_name=self.conversation_name
+        )
+        if not conversation_id:
             logging.info(f"No conversation found to fork.")
-            session.close()
             return None
-
-        # Get all messages up to and including the specified message_id
-        messages = (
-            session.query(Message)
+        session = get_session()
+        fork_point = (
+            session.query(Message.timestamp, Message.id)
             .filter(
-                Message.conversation_id == original_conversation.id,
-                Message.id <= message_id,
+                conversation_filter(session, conversation_id),
+                Message.id == message_id,
             )
-            .order_by(Message.timestamp.asc())
-            .all()
+            .first()
         )
-
-        if not messages:
-            logging.info(f"No messages found in the conversation to fork.")
+        if not fork_point:
+            logging.info(f"No message found in the conversation to fork at.")
             session.close()
             return None
-
-        # Create a new conversation
         new_conversation_name = (
             f"{self.conversation_name}_fork_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
         )
-        new_conversation = Conversation(name=new_conversation_name, user_id=user_id)
+        new_conversation = Conversation(
+            name=new_conversation_name,
+            user_id=user_id,
+            parent_id=conversation_id,
+            fork_timestamp=fork_point.timestamp,
+            fork_message_id=fork_point.id,
+        )
         session.add(new_conversation)
-        session.flush()  # This will assign an id to new_conversation
-
-        # Copy messages to the new conversation
-        for message in messages:
-            new_message = Message(
-                role=message.role,
-                content=message.content,
-                conversation_id=new_conversation.id,
-                timestamp=message.timestamp,
-                updated_at=message.updated_at,
-                updated_by=message.updated_by,
-                feedback_received=message.feedback_received,
-            )
-            session.add(new_message)
-
         session.commit()
-        forked_conversation_id = str(new_conversation.id)
+        forked_conversation_id = new_conversation.id
         session.close()
-
+        cache_conversation_id(
+            user_id=user_id,
+            conversation_name=new_conversation_name,
+            conversation_id=forked_conversation_id,
+        )
         logging.info(
             f"Conversation forked successfully. New conversation ID: {forked_conversation_id}"
         )
         return new_conversation_name
 
     def get_activities(self, limit=100, page=1):
+        flush_messages()
         session = get_session()
-        user_data = session.query(User).filter(User.email == self.user).first()
-        user_id = user_data.id
+        user_id = get_cached_user_id(self.user)
         if not self.conversation_name:
             self.conversation_name = "-"
         conversation = (
@@ -290,7 +1123,10 @@ class Conversations:
         offset = (page - 1) * limit
         messages = (
             session.query(Message)
-            .filter(Message.conversation_id == conversation.id)
+            .filter(
+                conversation_filter(session, conversation.id),
+                Message.message_type == MESSAGE_TYPE_ACTIVITY,
+            )
             .order_by(Message.timestamp.asc())
             .limit(limit)
             .offset(offset)
@@ -299,25 +1135,22 @@ class Conversations:
         if not messages:
             session.close()
             return {"activities": []}
-        return_activities = []
-        for message in messages:
-            if message.content.startswith("[ACTIVITY]"):
-                msg = {
-                    "id": message.id,
-                    "role": message.role,
-                    "message": message.content,
-                    "timestamp": message.timestamp,
-                }
-                return_activities.append(msg)
-        # Order messages by timestamp oldest to newest
-        return_activities = sorted(return_activities, key=lambda x: x["timestamp"])
+        return_activities = [
+            {
+                "id": message.id,
+                "role": message.role,
+                "message": message.content,
+                "timestamp": message.timestamp,
+            }
+            for message in messages
+        ]
         session.close()
         return {"activities": return_activities}
 
     def get_subactivities(self, activity_id):
+        flush_messages()
         session = get_session()
-        user_data = session.query(User).filter(User.email == self.user).first()
-        user_id = user_data.id
+        user_id = get_cached_user_id(self.user)
         if not self.conversation_name:
             self.conversation_name = "-"
         conversation = (
@@ -333,27 +1166,25 @@ class Conversations:
             return ""
         messages = (
             session.query(Message)
-            .filter(Message.conversation_id == conversation.id)
+            .filter(
+                conversation_filter(session, conversation.id),
+                Message.parent_activity_id == str(activity_id),
+            )
             .order_by(Message.timestamp.asc())
             .all()
         )
         if not messages:
             session.close()
             return ""
-        return_subactivities = []
-        for message in messages:
-            if message.content.startswith(f"[SUBACTIVITY][{activity_id}]"):
-                msg = {
-                    "id": message.id,
-                    "role": message.role,
-                    "message": message.content,
-                    "timestamp": message.timestamp,
-                }
-                return_subactivities.append(msg)
-        # Order messages by timestamp oldest to newest
-        return_subactivities = sorted(
-            return_subactivities, key=lambda x: x["timestamp"]
-        )
+        return_subactivities = [
+            {
+                "id": message.id,
+                "role": message.role,
+                "message": message.content,
+                "timestamp": message.timestamp,
+            }
+            for message in messages
+        ]
         session.close()
         # Return it as a string with timestamps per subactivity in markdown format
         subactivities = "\n".join(
@@ -366,8 +1197,7 @@ class Conversations:
 
     def new_conversation(self, conversation_content=[]):
         session = get_session()
-        user_data = session.query(User).filter(User.email == self.user).first()
-        user_id = user_data.id
+        user_id = get_cached_user_id(self.user)
         # Check if the conversation already exists for the agent
         existing_conversation = (
             session.query(Conversation)
@@ -382,41 +1212,39 @@ class Conversations:
             conversation = Conversation(name=self.conversation_name, user_id=user_id)
             session.add(conversation)
             session.commit()
-            if conversation_content != []:
-                for interaction in conversation_content:
-                    self.log_interaction(
-                        role=interaction["role"],
-                        message=interaction["message"],
-                    )
+            cache_conversation_id(
+                user_id=user_id,
+                conversation_name=self.conversation_name,
+                conversation_id=conversation.id,
+            )
         else:
             conversation = existing_conversation
         session.close()
+        if not existing_conversation and conversation_content != []:
+            ConversationImporter(
+                user=self.user, conversation_name=self.conversation_name
+            ).add_records(conversation_content)
         return conversation
 
     def get_thinking_id(self, agent_name):
-        session = get_session()
-        user_data = session.query(User).filter(User.email == self.user).first()
-        user_id = user_data.id
+        flush_messages()
         if not self.conversation_name:
             self.conversation_name = "-"
-        conversation = (
-            session.query(Conversation)
-            .filter(
-                Conversation.name == self.conversation_name,
-                Conversation.user_id == user_id,
-            )
-            .first()
+        conversation_id = get_cached_conversation_id(
+            user_id=get_cached_user_id(self.user),
+            conversation_name=self.conversation_name,
         )
-        if not conversation:
-            session.close()
+        if not conversation_id:
             return None
+        session = get_session()
+        history = conversation_filter(session, conversation_id)
 
         # Get the most recent non-thinking activity message
         current_parent_activity = (
             session.query(Message)
             .filter(
-                Message.conversation_id == conversation.id,
-                Message.content.like("[ACTIVITY]%"),
+                history,
+                Message.message_type == MESSAGE_TYPE_ACTIVITY,
                 Message.content != "[ACTIVITY] Thinking.",
             )
             .order_by(Message.timestamp.desc())
@@ -427,7 +1255,8 @@ class Conversations:
         current_thinking = (
             session.query(Message)
             .filter(
-                Message.conversation_id == conversation.id,
+                history,
+                Message.message_type == MESSAGE_TYPE_ACTIVITY,
                 Message.content == "[ACTIVITY] Thinking.",
             )
             .order_by(Message.timestamp.desc())
@@ -478,46 +1307,24 @@ class Conversations:
                 )
             else:
                 message = message.replace("[SUBACTIVITY] ", "[ACTIVITY] ")
-        session = get_session()
-        user_data = session.query(User).filter(User.email == self.user).first()
-        user_id = user_data.id
-        conversation = (
-            session.query(Conversation)
-            .filter(
-                Conversation.name == self.conversation_name,
-                Conversation.user_id == user_id,
-            )
-            .first()
-        )
+        user_id = get_cached_user_id(self.user)
         if role.lower() == "user":
             role = "USER"
-        if not conversation:
-            conversation = self.new_conversation()
-            session.close()
-            session = get_session()
-        try:
-            new_message = Message(
-                role=role,
-                content=message,
-                conversation_id=conversation.id,
-            )
-            # Update the conversation's updated_at timestamp
-            conversation.updated_at = func.now()
-        except Exception as e:
-            conversation = self.new_conversation()
-            session.close()
-            session = get_session()
-            new_message = Message(
-                role=role,
-                content=message,
-                conversation_id=conversation.id,
-            )
-            # Update the conversation's updated_at timestamp
-            conversation.updated_at = func.now()
-
-        session.add(new_message)
-        session.commit()
-
+        # The message log checks the name when it writes, so the cached ID is not verified here
+        conversation_id = get_cached_conversation_id(
+            user_id=user_id, conversation_name=self.conversation_name, verify=False
+        )
+        if not conversation_id:
+            conversation_id = self.new_conversation().id
+        message_id, timestamp = message_log.append(
+            user_id=user_id,
+            conversation_name=self.conversation_name,
+            conversation_id=conversation_id,
+            role=role,
+            content=message,
+        )
+        if is_activity(message):
+            self.last_activity_id = message_id
         if role.lower() == "user":
             logging.info(f"{self.user}: {message}")
         else:
@@ -527,14 +1334,12 @@ class Conversations:
                 logging.error(f"{role}: {message}")
             else:
                 logging.info(f"{role}: {message}")
-        message_id = str(new_message.id)
-        session.close()
         return message_id
 
     def delete_conversation(self):
+        flush_messages()
         session = get_session()
-        user_data = session.query(User).filter(User.email == self.user).first()
-        user_id = user_data.id
+        user_id = get_cached_user_id(self.user)
         if not self.conversation_name:
             self.conversation_name = "-"
         conversation = (
@@ -550,6 +1355,8 @@ class Conversations:
             session.close()
             return
 
+        # Forks keep their own copy of the history they shared with this conversation
+        release_forks(session, conversation.id)
         session.query(Message).filter(
             Message.conversation_id == conversation.id
         ).delete()
@@ -557,12 +1364,16 @@ class Conversations:
             Conversation.id == conversation.id, Conversation.user_id == user_id
         ).delete()
         session.commit()
+        invalidate_conversation_id(
+            user_id=user_id, conversation_name=self.conversation_name
+        )
+        self.last_activity_id = None
         session.close()
 
     def delete_message(self, message):
+        flush_messages()
         session = get_session()
-        user_data = session.query(User).filter(User.email == self.user).first()
-        user_id = user_data.id
+        user_id = get_cached_user_id(self.user)
 
         conversation = (
             session.query(Conversation)
@@ -577,22 +1388,8 @@ class Conversations:
             logging.info(f"No conversation found.")
             session.close()
             return
-        message_id = (
-            session.query(Message)
-            .filter(
-                Message.conversation_id == conversation.id,
-                Message.content == message,
-            )
-            .first()
-        ).id
-        message = (
-            session.query(Message)
-            .filter(
-                Message.conversation_id == conversation.id,
-                Message.id == message_id,
-            )
-            .first()
-        )
+        message_id = message
+        message = find_message(session, conversation.id, content=message)
 
         if not message:
             logging.info(
@@ -602,12 +1399,13 @@ class Conversations:
             return
         session.delete(message)
         session.commit()
+        self.last_activity_id = None
         session.close()
 
     def delete_message_by_id(self, message_id):
+        flush_messages()
         session = get_session()
-        user_data = session.query(User).filter(User.email == self.user).first()
-        user_id = user_data.id
+        user_id = get_cached_user_id(self.user)
 
         conversation = (
             session.query(Conversation)
@@ -622,14 +1420,7 @@ class Conversations:
             logging.info(f"No conversation found.")
             session.close()
             return
-        message = (
-            session.query(Message)
-            .filter(
-                Message.conversation_id == conversation.id,
-                Message.id == message_id,
-            )
-            .first()
-        )
+        message = find_message(session, conversation.id, message_id=message_id)
 
         if not message:
             logging.info(
@@ -639,12 +1430,13 @@ class Conversations:
             return
         session.delete(message)
         session.commit()
+        self.last_activity_id = None
         session.close()
 
     def toggle_feedback_received(self, message):
+        flush_messages()
         session = get_session()
-        user_data = session.query(User).filter(User.email == self.user).first()
-        user_id = user_data.id
+        user_id = get_cached_user_id(self.user)
         conversation = (
             session.query(Conversation)
             .filter(
@@ -657,22 +1449,8 @@ class Conversations:
             logging.info(f"No conversation found.")
             session.close()
             return
-        message_id = (
-            session.query(Message)
-            .filter(
-                Message.conversation_id == conversation.id,
-                Message.content == message,
-            )
-            .first()
-        ).id
-        message = (
-            session.query(Message)
-            .filter(
-                Message.conversation_id == conversation.id,
-                Message.id == message_id,
-            )
-            .first()
-        )
+        message_id = message
+        message = find_message(session, conversation.id, content=message)
         if not message:
             logging.info(
                 f"No message found with ID '{message_id}' in conversation '{self.conversation_name}'."
@@ -684,9 +1462,9 @@ class Conversations:
         session.close()
 
     def has_received_feedback(self, message):
+        flush_messages()
         session = get_session()
-        user_data = session.query(User).filter(User.email == self.user).first()
-        user_id = user_data.id
+        user_id = get_cached_user_id(self.user)
         conversation = (
             session.query(Conversation)
             .filter(
@@ -699,19 +1477,12 @@ class Conversations:
             logging.info(f"No conversation found.")
             session.close()
             return
-        message_id = (
-            session.query(Message)
-            .filter(
-                Message.conversation_id == conversation.id,
-                Message.content == message,
-            )
-            .first()
-        ).id
+        message_id = message
         message = (
             session.query(Message)
             .filter(
-                Message.conversation_id == conversation.id,
-                Message.id == message_id,
+                conversation_filter(session, conversation.id),
+                Message.content == message,
             )
             .first()
         )
@@ -726,9 +1497,9 @@ class Conversations:
         return feedback_received
 
     def update_message(self, message, new_message):
+        flush_messages()
         session = get_session()
-        user_data = session.query(User).filter(User.email == self.user).first()
-        user_id = user_data.id
+        user_id = get_cached_user_id(self.user)
         conversation = (
             session.query(Conversation)
             .filter(
@@ -741,22 +1512,8 @@ class Conversations:
             logging.info(f"No conversation found.")
             session.close()
             return
-        message_id = (
-            session.query(Message)
-            .filter(
-                Message.conversation_id == conversation.id,
-                Message.content == message,
-            )
-            .first()
-        ).id
-        message = (
-            session.query(Message)
-            .filter(
-                Message.conversation_id == conversation.id,
-                Message.id == message_id,
-            )
-            .first()
-        )
+        message_id = message
+        message = find_message(session, conversation.id, content=message)
         if not message:
             logging.info(
                 f"No message found with ID '{message_id}' in conversation '{self.conversation_name}'."
@@ -764,13 +1521,15 @@ class Conversations:
             session.close()
             return
         message.content = new_message
+        message.message_type, message.parent_activity_id = get_message_type(new_message)
         session.commit()
+        self.last_activity_id = None
         session.close()
 
     def update_message_by_id(self, message_id, new_message):
+        flush_messages()
         session = get_session()
-        user_data = session.query(User).filter(User.email == self.user).first()
-        user_id = user_data.id
+        user_id = get_cached_user_id(self.user)
         conversation = (
             session.query(Conversation)
             .filter(
@@ -783,14 +1542,7 @@ class Conversations:
             logging.info(f"No conversation found.")
             session.close()
             return
-        message = (
-            session.query(Message)
-            .filter(
-                Message.conversation_id == conversation.id,
-                Message.id == message_id,
-            )
-            .first()
-        )
+        message = find_message(session, conversation.id, message_id=message_id)
         if not message:
             logging.info(
                 f"No message found with ID '{message_id}' in conversation '{self.conversation_name}'."
@@ -798,33 +1550,35 @@ class Conversations:
             session.close()
             return
         message.content = new_message
+        message.message_type, message.parent_activity_id = get_message_type(new_message)
         session.commit()
+        self.last_activity_id = None
         session.close()
 
     def get_conversation_id(self):
-        session = get_session()
-        user_data = session.query(User).filter(User.email == self.user).first()
-        user_id = user_data.id
-        conversation = (
-            session.query(Conversation)
-            .filter(
-                Conversation.name == self.conversation_name,
-                Conversation.user_id == user_id,
-            )
-            .first()
+        user_id = get_cached_user_id(self.user)
+        conversation_id = get_cached_conversation_id(
+            user_id=user_id, conversation_name=self.conversation_name
         )
-        if not conversation:
+        if not conversation_id:
+            session = get_session()
             conversation = Conversation(name=self.conversation_name, user_id=user_id)
             session.add(conversation)
             session.commit()
-        conversation_id = str(conversation.id)
-        session.close()
-        return conversation_id
+            conversation_id = conversation.id
+            session.close()
+            cache_conversation_id(
+                user_id=user_id,
+                conversation_name=self.conversation_name,
+                conversation_id=conversation_id,
+            )
+        return str(conversation_id)
 
     def rename_conversation(self, new_name: str):
+        # Messages queued under the old name belong to the conversation being renamed
+        flush_messages()
         session = get_session()
-        user_data = session.query(User).filter(User.email == self.user).first()
-        user_id = user_data.id
+        user_id = get_cached_user_id(self.user)
         conversation = (
             session.query(Conversation)
             .filter(
@@ -840,34 +1594,31 @@ class Conversations:
         conversation.name = new_name
         session.commit()
         session.close()
+        invalidate_conversation_id(
+            user_id=user_id, conversation_name=self.conversation_name
+        )
+        invalidate_conversation_id(user_id=user_id, conversation_name=new_name)
 
     def get_last_activity_id(self):
-        session = get_session()
-        user_data = session.query(User).filter(User.email == self.user).first()
-        user_id = user_data.id
+        if self.last_activity_id:
+            return self.last_activity_id
         if not self.conversation_name:
             self.conversation_name = "-"
-        conversation = (
-            session.query(Conversation)
-            .filter(
-                Conversation.name == self.conversation_name,
-                Conversation.user_id == user_id,
-            )
-            .first()
+        conversation_id = get_cached_conversation_id(
+            user_id=get_cached_user_id(self.user),
+            conversation_name=self.conversation_name,
         )
-        if not conversation:
-            session.close()
+        if not conversation_id:
             return None
+        flush_messages()
+        session = get_session()
         last_activity = (
-            session.query(Message)
-            .filter(Message.conversation_id == conversation.id)
-            .filter(Message.content.like("[ACTIVITY]%"))
-            .order_by(Message.timestamp.desc())
+            session.query(Message.id)
+            .filter(conversation_filter(session, conversation_id))
+            .filter(Message.message_type == MESSAGE_TYPE_ACTIVITY)
+            .order_by(Message.timestamp.desc(), Message.id.desc())
             .first()
         )
-        if not last_activity:
-            session.close()
-            return None
-        last_id = last_activity.id
         session.close()
-        return last_id
+        self.last_activity_id = str(last_activity[0]) if last_activity else None
+        return self.last_activity_id
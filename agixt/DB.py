@@ -1,7 +1,13 @@
 import uuid
 import time
+import asyncio
 import logging
+import importlib.util
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
 from sqlalchemy import (
+    event,
     create_engine,
     Column,
     Text,
@@ -10,9 +16,11 @@ from sqlalchemy import (
     ForeignKey,
     DateTime,
     Boolean,
+    Index,
     func,
+    inspect,
 )
-from sqlalchemy.orm import sessionmaker, relationship, declarative_base
+from sqlalchemy.orm import Session, sessionmaker, relationship, declarative_base
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.sql import text
 from Globals import getenv
@@ -43,10 +51,245 @@ except Exception as e:
     engine = None
 
 
+pool_metrics = {
+    "connections_created": 0,
+    "checkouts": 0,
+    "checkins": 0,
+    "sessions_created": 0,
+    "sessions_reused": 0,
+    "units_of_work": 0,
+    "async_runs": 0,
+}
+_pool_metrics_lock = threading.Lock()
+
+
+def _count(metric: str):
+    with _pool_metrics_lock:
+        pool_metrics[metric] += 1
+
+
+if engine is not None:
+    event.listen(engine, "connect", lambda *args: _count("connections_created"))
+    event.listen(engine, "checkout", lambda *args: _count("checkouts"))
+    event.listen(engine, "checkin", lambda *args: _count("checkins"))
+
+
+class UnitOfWorkSession(Session):
+    """
+    Session that can be shared by a unit of work. While it is shared, close() hands it back
+    to the unit of work instead of closing it.
+    """
+
+    unit_of_work = None
+
+    def close(self):
+        if self.unit_of_work is not None:
+            # Same as close(), detach loaded objects and discard uncommitted changes, which
+            # also returns the connection to the pool, but keep the session for the next caller
+            self.expunge_all()
+            if self.in_transaction():
+                self.rollback()
+            self.unit_of_work.release(self)
+            return
+        super().close()
+
+
+SessionLocal = sessionmaker(bind=engine, autoflush=False, class_=UnitOfWorkSession)
+
+
+class UnitOfWork:
+    """
+    One session reused by every get_session() call in a request or background task. The
+    session is lent to one caller at a time; a caller that asks while it is lent out gets its
+    own session, so nested and concurrent calls keep separate transactions as before. It only
+    holds a pooled connection while a caller has it, not for the whole request.
+    """
+
+    def __init__(self, is_async: bool = False):
+        self.session = None
+        self.in_use = False
+        self.is_async = is_async
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            if self.in_use:
+                return None
+            if self.session is None:
+                self.session = SessionLocal()
+                self.session.unit_of_work = self
+                _count("sessions_created")
+            else:
+                _count("sessions_reused")
+            self.in_use = True
+        if not self.session.is_active:
+            # A previous caller hit an error without rolling back
+            self.session.rollback()
+        return self.session
+
+    def release(self, session):
+        with self.lock:
+            if session is self.session:
+                self.in_use = False
+
+    def close(self):
+        """Closes the session. Changes a caller left uncommitted are rolled back."""
+        with self.lock:
+            session = self.session
+            self.session = None
+            self.in_use = False
+        if session is None:
+            return
+        session.unit_of_work = None
+        session.close()
+
+
+_unit_of_work = ContextVar("unit_of_work", default=None)
+
+
 def get_session():
-    Session = sessionmaker(bind=engine, autoflush=False)
-    session = Session()
-    return session
+    """
+    Returns a database session. Inside session_scope() this is the unit of work's shared
+    session when it is free, otherwise a new session. Callers close it with session.close().
+    """
+    unit_of_work = _unit_of_work.get()
+    if unit_of_work is not None:
+        session = unit_of_work.acquire()
+        if session is not None:
+            return session
+    return new_session()
+
+
+def new_session():
+    """
+    Returns a session of its own, never the unit of work's. Inside run_db on the async engine
+    it is bound to the async engine too, so its queries do not block the event loop.
+    """
+    _count("sessions_created")
+    if in_async_run():
+        return AsyncSessionLocal().sync_session
+    return SessionLocal()
+
+
+def in_async_run() -> bool:
+    """True while run_db is running code on the async engine."""
+    unit_of_work = _unit_of_work.get()
+    return unit_of_work is not None and unit_of_work.is_async
+
+
+@contextmanager
+def session_scope():
+    """
+    Runs the enclosed block as one unit of work. Every get_session() call in it, including
+    calls in awaited coroutines, reuses one session. Changes are only kept if the code that
+    made them committed, anything left pending is rolled back on exit. Nested scopes join the
+    outer one.
+    """
+    if _unit_of_work.get() is not None:
+        yield _unit_of_work.get()
+        return
+    unit_of_work = UnitOfWork()
+    token = _unit_of_work.set(unit_of_work)
+    _count("units_of_work")
+    try:
+        yield unit_of_work
+    finally:
+        _unit_of_work.reset(token)
+        unit_of_work.close()
+
+
+def get_pool_metrics() -> dict:
+    """Connection pool state and session counters for this worker."""
+    with _pool_metrics_lock:
+        metrics = dict(pool_metrics)
+    if engine is not None:
+        pool = engine.pool
+        metrics["pool"] = pool.status()
+        for name in ["size", "checkedin", "checkedout", "overflow"]:
+            if hasattr(pool, name):
+                metrics[name] = getattr(pool, name)()
+    return metrics
+
+
+try:
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+except ImportError:
+    create_async_engine = None
+
+async_engine = None
+AsyncSessionLocal = None
+ASYNC_DRIVER = "aiosqlite" if DATABASE_TYPE == "sqlite" else "asyncpg"
+if (
+    engine is not None
+    and create_async_engine is not None
+    and getenv("DATABASE_ASYNC").lower() == "true"
+):
+    if importlib.util.find_spec(ASYNC_DRIVER) is None:
+        logging.info(f"{ASYNC_DRIVER} is not installed, database calls use threads.")
+    else:
+        try:
+            if DATABASE_TYPE != "sqlite":
+                async_engine = create_async_engine(
+                    f"postgresql+asyncpg://{LOGIN_URI}", pool_size=40, max_overflow=-1
+                )
+            else:
+                async_engine = create_async_engine(
+                    f"sqlite+aiosqlite:///{DATABASE_NAME}.db"
+                )
+            AsyncSessionLocal = async_sessionmaker(
+                async_engine, autoflush=False, sync_session_class=UnitOfWorkSession
+            )
+        except Exception as e:
+            logging.info(f"Async database engine unavailable, using threads: {e}")
+            async_engine = None
+
+
+def query_only(function):
+    """
+    Marks a repository function that only runs database queries, so run_db may run it on
+    the async engine. Functions that read files, write queued messages, call providers or do
+    other blocking work must not be marked, since they would block the event loop there.
+    """
+    function.query_only = True
+    return function
+
+
+async def run_db(function, *args, **kwargs):
+    """
+    Runs synchronous database code, such as a Conversations or Chain method, from async code
+    without blocking the event loop.
+
+    Functions marked with @query_only run on the async engine when its driver is installed
+    (asyncpg for Postgres, aiosqlite for SQLite): every get_session() call inside `function`
+    gets one session on the async engine, and its queries are awaited on the event loop
+    through SQLAlchemy's greenlet bridge. Everything else runs in a worker thread.
+
+    Args:
+        function: Callable to run.
+        *args: Positional arguments for `function`.
+        **kwargs: Keyword arguments for `function`.
+
+    Returns:
+        The return value of `function`.
+    """
+    if AsyncSessionLocal is None or not getattr(function, "query_only", False):
+        return await asyncio.to_thread(function, *args, **kwargs)
+    unit_of_work = UnitOfWork(is_async=True)
+    async with AsyncSessionLocal() as async_session:
+        # Lend the async session's sync facade to get_session() like a unit of work
+        unit_of_work.session = async_session.sync_session
+        unit_of_work.session.unit_of_work = unit_of_work
+        token = _unit_of_work.set(unit_of_work)
+        _count("async_runs")
+        try:
+            result = await async_session.run_sync(
+                lambda session: function(*args, **kwargs)
+            )
+        finally:
+            # Like a unit of work, changes `function` did not commit are rolled back on close
+            _unit_of_work.reset(token)
+            unit_of_work.session.unit_of_work = None
+    return result
 
 
 def get_new_id():
@@ -243,6 +486,8 @@ class Agent(Base):
         ForeignKey("user.id"),
         nullable=True,
     )
+    # Bumped on every settings or commands change so cached agents can be rebuilt
+    config_version = Column(Integer, nullable=False, default=0, server_default="0")
     settings = relationship("AgentSetting", backref="agent")  # One-to-many relationship
     browsed_links = relationship("AgentBrowsedLink", backref="agent")
     user = relationship("User", backref="agent")
@@ -300,6 +545,50 @@ class Conversation(Base):
         nullable=True,
     )
     user = relationship("User", backref="conversation")
+    # A fork reads its parent's messages up to fork_timestamp, then its own
+    parent_id = Column(
+        UUID(as_uuid=True) if DATABASE_TYPE != "sqlite" else String,
+        ForeignKey("conversation.id"),
+        nullable=True,
+    )
+    fork_timestamp = Column(DateTime, nullable=True)
+    # Ties on fork_timestamp are broken by message ID, as in keyset pagination
+    fork_message_id = Column(
+        UUID(as_uuid=True) if DATABASE_TYPE != "sqlite" else String,
+        nullable=True,
+    )
+    __table_args__ = (
+        Index("ix_conversation_user_name", "user_id", "name"),
+        Index("ix_conversation_user_updated", "user_id", "updated_at"),
+        Index("ix_conversation_parent", "parent_id"),
+    )
+
+
+MESSAGE_TYPE_MESSAGE = "message"
+MESSAGE_TYPE_ACTIVITY = "activity"
+MESSAGE_TYPE_SUBACTIVITY = "subactivity"
+
+
+def get_message_type(content):
+    """Returns the message type and parent activity ID encoded in a message's content prefix"""
+    content = str(content)
+    if content.startswith("[ACTIVITY]"):
+        return MESSAGE_TYPE_ACTIVITY, None
+    if content.startswith("[SUBACTIVITY]"):
+        if content.startswith("[SUBACTIVITY]["):
+            end = content.find("]", 14)
+            if end != -1 and end > 14:
+                return MESSAGE_TYPE_SUBACTIVITY, content[14:end]
+        return MESSAGE_TYPE_SUBACTIVITY, None
+    return MESSAGE_TYPE_MESSAGE, None
+
+
+def default_message_type(context):
+    return get_message_type(context.get_current_parameters()["content"])[0]
+
+
+def default_parent_activity_id(context):
+    return get_message_type(context.get_current_parameters()["content"])[1]
 
 
 class Message(Base):
@@ -324,6 +613,21 @@ class Message(Base):
         nullable=True,
     )
     feedback_received = Column(Boolean, default=False)
+    # Denormalized from the [ACTIVITY] and [SUBACTIVITY][id] content prefixes
+    message_type = Column(String, default=default_message_type, nullable=True)
+    parent_activity_id = Column(
+        String, default=default_parent_activity_id, nullable=True
+    )
+    __table_args__ = (
+        Index("ix_message_conversation_timestamp", "conversation_id", "timestamp"),
+        Index(
+            "ix_message_conversation_type_timestamp",
+            "conversation_id",
+            "message_type",
+            "timestamp",
+        ),
+        Index("ix_message_parent_activity", "parent_activity_id"),
+    )
 
 
 class Setting(Base):
@@ -490,6 +794,14 @@ class ChainStepResponse(Base):
     )
     timestamp = Column(DateTime, server_default=func.now())
     content = Column(Text, nullable=False)
+    __table_args__ = (
+        Index(
+            "ix_chain_step_response_step_run",
+            "chain_step_id",
+            "chain_run_id",
+            "timestamp",
+        ),
+    )
 
 
 class Extension(Base):
@@ -623,9 +935,57 @@ class Prompt(Base):
         ForeignKey("user.id"),
         nullable=True,
     )
+    # Bumped on every edit so each worker can tell its cached copy is stale
+    version = Column(Integer, nullable=False, default=0, server_default="0")
     prompt_category = relationship("PromptCategory", backref="prompts")
     user = relationship("User", backref="prompt")
     arguments = relationship("Argument", backref="prompt", cascade="all, delete-orphan")
+    __table_args__ = (Index("ix_prompt_name_user", "name", "user_id"),)
+
+
+class MemorySource(Base):
+    __tablename__ = "memory_source"
+    id = Column(
+        UUID(as_uuid=True) if DATABASE_TYPE != "sqlite" else String,
+        primary_key=True,
+        default=get_new_id if DATABASE_TYPE == "sqlite" else uuid.uuid4,
+    )
+    collection_name = Column(String, nullable=False)
+    external_source = Column(Text, nullable=False)
+    created_at = Column(DateTime, server_default=func.now())
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+    __table_args__ = (
+        Index(
+            "ix_memory_source_collection_source",
+            "collection_name",
+            "external_source",
+            unique=True,
+        ),
+    )
+
+
+class MemorySourceChunk(Base):
+    __tablename__ = "memory_source_chunk"
+    id = Column(
+        UUID(as_uuid=True) if DATABASE_TYPE != "sqlite" else String,
+        primary_key=True,
+        default=get_new_id if DATABASE_TYPE == "sqlite" else uuid.uuid4,
+    )
+    memory_source_id = Column(
+        UUID(as_uuid=True) if DATABASE_TYPE != "sqlite" else String,
+        ForeignKey("memory_source.id", ondelete="CASCADE"),
+        nullable=False,
+    )
+    chunk_id = Column(String, nullable=False)
+    created_at = Column(DateTime, server_default=func.now())
+    __table_args__ = (
+        Index(
+            "ix_memory_source_chunk_source_chunk",
+            "memory_source_id",
+            "chunk_id",
+            unique=True,
+        ),
+    )
 
 
 def ensure_conversation_timestamps():
@@ -713,6 +1073,121 @@ def ensure_conversation_timestamps():
         raise
 
 
+def ensure_message_types():
+    """
+    Adds the message_type and parent_activity_id columns to an existing message table and
+    fills them in from the content prefixes of messages written before they existed.
+    """
+    inspector = inspect(engine)
+    if "message" not in inspector.get_table_names():
+        return
+    columns = [column["name"] for column in inspector.get_columns("message")]
+    with engine.begin() as connection:
+        for column in ["message_type", "parent_activity_id"]:
+            if column not in columns:
+                logging.info(f"Adding {column} column to message table")
+                connection.execute(
+                    text(f"ALTER TABLE message ADD COLUMN {column} VARCHAR")
+                )
+        connection.execute(
+            text(
+                "UPDATE message SET message_type = :message_type "
+                "WHERE message_type IS NULL AND content LIKE '[ACTIVITY]%'"
+            ),
+            {"message_type": MESSAGE_TYPE_ACTIVITY},
+        )
+    # Subactivity parent IDs are parsed in batches, the ID sits at the start of the content
+    while True:
+        with engine.begin() as connection:
+            rows = connection.execute(
+                text(
+                    "SELECT id, substr(content, 1, 100) FROM message "
+                    "WHERE message_type IS NULL AND content LIKE '[SUBACTIVITY]%' "
+                    "LIMIT 1000"
+                )
+            ).fetchall()
+            if not rows:
+                break
+            updates = []
+            for message_id, content in rows:
+                message_type, parent_activity_id = get_message_type(content)
+                updates.append(
+                    {
+                        "id": message_id,
+                        "message_type": message_type,
+                        "parent_activity_id": parent_activity_id,
+                    }
+                )
+            connection.execute(
+                text(
+                    "UPDATE message SET message_type = :message_type, "
+                    "parent_activity_id = :parent_activity_id WHERE id = :id"
+                ),
+                updates,
+            )
+    with engine.begin() as connection:
+        updated = connection.execute(
+            text(
+                "UPDATE message SET message_type = :message_type "
+                "WHERE message_type IS NULL"
+            ),
+            {"message_type": MESSAGE_TYPE_MESSAGE},
+        ).rowcount
+    if updated:
+        logging.info(f"Backfilled message types for {updated} messages")
+
+
+def add_missing_columns(table: str, column_types: dict):
+    """Adds columns, given as name to SQL type and constraints, missing from an existing table"""
+    inspector = inspect(engine)
+    if table not in inspector.get_table_names():
+        return
+    columns = [column["name"] for column in inspector.get_columns(table)]
+    with engine.begin() as connection:
+        for column, column_type in column_types.items():
+            if column not in columns:
+                logging.info(f"Adding {column} column to {table} table")
+                connection.execute(
+                    text(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+                )
+
+
+def ensure_conversation_forks():
+    """Adds the parent_id, fork_timestamp and fork_message_id columns to an existing conversation table"""
+    add_missing_columns(
+        "conversation",
+        {
+            "parent_id": "VARCHAR" if DATABASE_TYPE == "sqlite" else "UUID",
+            "fork_timestamp": "DATETIME" if DATABASE_TYPE == "sqlite" else "TIMESTAMP",
+            "fork_message_id": "VARCHAR" if DATABASE_TYPE == "sqlite" else "UUID",
+        },
+    )
+
+
+def ensure_agent_config_versions():
+    """Adds the config_version column to an existing agent table"""
+    add_missing_columns("agent", {"config_version": "INTEGER NOT NULL DEFAULT 0"})
+
+
+def ensure_prompt_versions():
+    """Adds the version column to an existing prompt table"""
+    add_missing_columns("prompt", {"version": "INTEGER NOT NULL DEFAULT 0"})
+
+
+def ensure_indexes():
+    """Creates indexes declared on the models that are missing from existing tables"""
+    inspector = inspect(engine)
+    tables = inspector.get_table_names()
+    for table in Base.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                logging.info(f"Creating index {index.name} on {table.name}")
+                index.create(engine)
+
+
 # Add this near the top of your file, after imports
 if getenv("DATABASE_TYPE") == "sqlite":
     ensure_conversation_timestamps()
@@ -726,6 +1201,12 @@ if __name__ == "__main__":
         ensure_conversation_timestamps()
     # Create any missing tables
     Base.metadata.create_all(engine)
+    # Add columns and indexes that tables created by older versions are missing
+    ensure_message_types()
+    ensure_conversation_forks()
+    ensure_agent_config_versions()
+    ensure_prompt_versions()
+    ensure_indexes()
     logging.info("Database tables verified/created.")
 
     # Import seed data
@@ -0,0 +1,190 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+import numpy as np
+from collections import OrderedDict
+from hashlib import sha256
+from Globals import getenv
+
+logging.basicConfig(
+    level=getenv("LOG_LEVEL"),
+    format=getenv("LOG_FORMAT"),
+)
+
+
+def normalize_embedding_text(text) -> str:
+    return " ".join(str(text).split())
+
+
+class EmbeddingCache:
+    """
+    LRU cache for query embeddings keyed by (embedding provider, model, endpoint, normalized
+    text), so agents that use the same provider with another model or server do not share
+    entries.
+
+    Entries expire after `ttl` seconds and the least recently used entries are evicted once
+    `max_size` is reached. If `path` is set, entries are also persisted to a SQLite file so
+    they survive restarts and are shared between workers on the same host.
+    """
+
+    def __init__(self, max_size: int = 4096, ttl: int = 86400, path: str = ""):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if self.path:
+            try:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with sqlite3.connect(self.path) as conn:
+                    conn.execute(
+                        "CREATE TABLE IF NOT EXISTS embedding_cache (key TEXT PRIMARY KEY, embedding TEXT NOT NULL, created_at REAL NOT NULL)"
+                    )
+            except Exception as e:
+                logging.warning(f"Embedding cache persistence disabled: {e}")
+                self.path = ""
+
+    def make_key(self, provider: str, model: str, text: str, endpoint: str = "") -> str:
+        normalized = normalize_embedding_text(text)
+        return sha256(
+            f"{provider}\n{model}\n{endpoint}\n{normalized}".encode()
+        ).hexdigest()
+
+    def get(self, key: str):
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                created_at, embedding = entry
+                if now - created_at <= self.ttl:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return embedding
+                del self.entries[key]
+        embedding = self._read_disk(key=key, now=now)
+        with self.lock:
+            if embedding is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+        self._store(key=key, embedding=embedding, created_at=now)
+        return embedding
+
+    def set(self, key: str, embedding):
+        embedding = np.asarray(embedding)
+        created_at = time.time()
+        self._store(key=key, embedding=embedding, created_at=created_at)
+        self._write_disk(key=key, embedding=embedding, created_at=created_at)
+        return embedding
+
+    def get_or_compute(
+        self, provider: str, model: str, text: str, compute, endpoint: str = ""
+    ):
+        key = self.make_key(
+            provider=provider, model=model, text=text, endpoint=endpoint
+        )
+        embedding = self.get(key)
+        if embedding is None:
+            embedding = self.set(key, compute(text))
+        return embedding
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.disk_hits = 0
+            self.misses = 0
+            self.evictions = 0
+        if self.path:
+            try:
+                with sqlite3.connect(self.path) as conn:
+                    conn.execute("DELETE FROM embedding_cache")
+            except Exception as e:
+                logging.warning(f"Error clearing embedding cache: {e}")
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "persistent": bool(self.path),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (
+                    (self.hits + self.disk_hits) / lookups if lookups > 0 else 0.0
+                ),
+            }
+
+    def _store(self, key: str, embedding, created_at: float):
+        with self.lock:
+            self.entries[key] = (created_at, embedding)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def _read_disk(self, key: str, now: float):
+        if not self.path:
+            return None
+        try:
+            with sqlite3.connect(self.path) as conn:
+                row = conn.execute(
+                    "SELECT embedding, created_at FROM embedding_cache WHERE key = ?",
+                    (key,),
+                ).fetchone()
+                if not row:
+                    return None
+                if now - row[1] > self.ttl:
+                    conn.execute("DELETE FROM embedding_cache WHERE key = ?", (key,))
+                    return None
+                return np.asarray(json.loads(row[0]))
+        except Exception as e:
+            logging.warning(f"Error reading embedding cache: {e}")
+            return None
+
+    def _write_disk(self, key: str, embedding, created_at: float):
+        if not self.path:
+            return
+        try:
+            with sqlite3.connect(self.path) as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO embedding_cache (key, embedding, created_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(embedding.tolist()), created_at),
+                )
+        except Exception as e:
+            logging.warning(f"Error writing embedding cache: {e}")
+
+
+def get_embedding_model_name(embedder) -> str:
+    if embedder is None:
+        return ""
+    for attribute in ["model_name", "_model_name", "MODEL_NAME"]:
+        model_name = getattr(embedder, attribute, None)
+        if model_name:
+            return str(model_name)
+    return type(embedder).__name__
+
+
+def get_embedding_endpoint(provider) -> str:
+    """The API endpoint a provider computes embeddings at, empty for local embedders."""
+    return str(getattr(provider, "API_URI", "") or "").rstrip("/")
+
+
+embedding_cache = EmbeddingCache(
+    max_size=int(getenv("EMBEDDING_CACHE_SIZE")),
+    ttl=int(getenv("EMBEDDING_CACHE_TTL")),
+    path=getenv("EMBEDDING_CACHE_PATH"),
+)
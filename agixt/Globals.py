@@ -1,7 +1,8 @@
 import os
 import json
-import tiktoken
+import tempfile
 from dotenv import load_dotenv
+from Tokens import count_tokens
 
 load_dotenv()
 
@@ -35,15 +36,43 @@ def getenv(var_name: str):
         "REGISTRATION_DISABLED": "false",
         "CREATE_AGENT_ON_REGISTER": "true",
         "CREATE_AGIXT_AGENT": "true",
+        "SPACY_MODEL": "en_core_web_sm",
+        "NLP_PROFILE": "keywords",
+        "NLP_BATCH_SIZE": 64,
+        "NLP_WINDOW_SIZE": 100000,
+        "EMBEDDING_BATCH_SIZE": 64,
+        "EMBEDDING_CACHE_SIZE": 4096,
+        "EMBEDDING_CACHE_TTL": 86400,
+        "VECTOR_STORE": "chroma",
+        "VECTOR_STORE_PATH": os.path.join(os.getcwd(), "vector_store"),
+        "VECTOR_INDEX": "flat",
+        "VECTOR_INDEX_MIN_ROWS": 50000,
+        "VECTOR_IVF_NPROBE": 16,
+        "VECTOR_HNSW_M": 16,
+        "VECTOR_HNSW_EF_CONSTRUCTION": 200,
+        "VECTOR_HNSW_EF": 64,
+        "IDENTITY_CACHE_TTL": 300,
+        "IDENTITY_CACHE_SIZE": 10000,
+        "DATABASE_ASYNC": "true",
+        "MESSAGE_LOG_FLUSH_INTERVAL": 0.05,
+        "MESSAGE_LOG_BATCH_SIZE": 500,
+        "AGENT_REGISTRY_TTL": 300,
+        "AGENT_REGISTRY_SIZE": 100,
+        "AGENT_CONFIG_CACHE_TTL": 300,
+        "AGENT_CONFIG_CACHE_SIZE": 1000,
+        "COMMAND_CATALOG_CACHE_SIZE": 500,
+        "PROMPT_CACHE_TTL": 300,
+        "PROMPT_CACHE_SIZE": 1000,
+        "EXTENSION_MANIFEST_PATH": os.path.join(
+            tempfile.gettempdir(), "agixt", "extension_manifest.json"
+        ),
     }
     default_value = default_values[var_name] if var_name in default_values else ""
     return os.getenv(var_name, default_value)
 
 
-def get_tokens(text: str) -> int:
-    encoding = tiktoken.get_encoding("cl100k_base")
-    num_tokens = len(encoding.encode(text))
-    return num_tokens
+def get_tokens(text: str, model: str = "", approximate: bool = False) -> int:
+    return count_tokens(text=text, model=model, approximate=approximate)
 
 
 def get_default_agent_settings():
@@ -0,0 +1,262 @@
+import os
+import json
+import time
+import pytz
+import logging
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from DB import (
+    Agent as AgentModel,
+    Conversation,
+    User,
+    UserPreferences,
+    get_session,
+)
+from Globals import getenv
+
+logging.basicConfig(
+    level=getenv("LOG_LEVEL"),
+    format=getenv("LOG_FORMAT"),
+)
+
+USER_IDS = "user"
+CONVERSATION_IDS = "conversation"
+AGENT_IDS = "agent"
+TIMEZONES = "timezone"
+REGISTRATION_SETTINGS = "registration_settings"
+
+
+class IdentityCache:
+    """
+    Per-worker cache mapping natural keys (emails, conversation and agent names) to database IDs.
+
+    Entries expire after `ttl` seconds so renames and deletes made by other workers are picked
+    up, and the owning code invalidates entries directly when it renames or deletes a row.
+    Lookups that find nothing are not cached.
+    """
+
+    def __init__(self, ttl: int = 300, max_size: int = 10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, namespace: str, key):
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get((namespace, key))
+            if entry is not None:
+                expires_at, value = entry
+                if now < expires_at:
+                    self.entries.move_to_end((namespace, key))
+                    self.hits += 1
+                    return value
+                del self.entries[(namespace, key)]
+            self.misses += 1
+            return None
+
+    def set(self, namespace: str, key, value):
+        if value is None:
+            return
+        with self.lock:
+            self.entries[(namespace, key)] = (time.time() + self.ttl, value)
+            self.entries.move_to_end((namespace, key))
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def resolve(self, namespace: str, key, loader):
+        value = self.get(namespace, key)
+        if value is None:
+            value = loader()
+            self.set(namespace, key, value)
+        return value
+
+    def invalidate(self, namespace: str, key):
+        with self.lock:
+            self.entries.pop((namespace, key), None)
+
+    def invalidate_matching(self, namespace: str, predicate):
+        """Drops every entry of the namespace whose key satisfies `predicate`."""
+        with self.lock:
+            for entry_key in [
+                entry_key
+                for entry_key in self.entries
+                if entry_key[0] == namespace and predicate(entry_key[1])
+            ]:
+                del self.entries[entry_key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+identity_cache = IdentityCache(
+    ttl=int(getenv("IDENTITY_CACHE_TTL")),
+    max_size=int(getenv("IDENTITY_CACHE_SIZE")),
+)
+
+
+def get_cached_user_id(email: str):
+    """Returns the ID of the user with this email, or None if there is no such user."""
+
+    def load():
+        session = get_session()
+        user = session.query(User.id).filter(User.email == email).first()
+        session.close()
+        return user[0] if user else None
+
+    return identity_cache.resolve(USER_IDS, email, load)
+
+
+def get_cached_conversation_id(user_id, conversation_name: str, verify: bool = True):
+    """
+    Returns the ID of the user's conversation with this name, or None if it does not exist.
+
+    Another worker may have renamed or deleted the cached conversation, so unless `verify`
+    is off a cached ID is only returned while the conversation still has this name, and is
+    looked up again otherwise. Callers that pass `verify=False` must check the name when
+    they use the ID, as MessageLog does when it writes messages.
+    """
+    key = (str(user_id), conversation_name)
+    conversation_id = identity_cache.get(CONVERSATION_IDS, key)
+    session = get_session()
+    if conversation_id is not None and verify:
+        current = (
+            session.query(Conversation.id)
+            .filter(
+                Conversation.id == conversation_id,
+                Conversation.name == conversation_name,
+                Conversation.user_id == user_id,
+            )
+            .first()
+        )
+        if not current:
+            identity_cache.invalidate(CONVERSATION_IDS, key)
+            conversation_id = None
+    if conversation_id is None:
+        conversation = (
+            session.query(Conversation.id)
+            .filter(
+                Conversation.name == conversation_name,
+                Conversation.user_id == user_id,
+            )
+            .first()
+        )
+        conversation_id = conversation[0] if conversation else None
+        identity_cache.set(CONVERSATION_IDS, key, conversation_id)
+    session.close()
+    return conversation_id
+
+
+def get_cached_agent_id(user_id, agent_name: str):
+    """Returns the ID of the agent with this name owned by the user, or None if it does not exist."""
+
+    def load():
+        session = get_session()
+        agent = (
+            session.query(AgentModel.id)
+            .filter(AgentModel.name == agent_name, AgentModel.user_id == user_id)
+            .first()
+        )
+        session.close()
+        return agent[0] if agent else None
+
+    return identity_cache.resolve(AGENT_IDS, (str(user_id), agent_name), load)
+
+
+def cache_conversation_id(user_id, conversation_name: str, conversation_id):
+    identity_cache.set(
+        CONVERSATION_IDS, (str(user_id), conversation_name), conversation_id
+    )
+
+
+def invalidate_conversation_id(user_id, conversation_name: str):
+    identity_cache.invalidate(CONVERSATION_IDS, (str(user_id), conversation_name))
+
+
+def invalidate_agent_id(user_id, agent_name: str):
+    identity_cache.invalidate(AGENT_IDS, (str(user_id), agent_name))
+
+
+def get_cached_timezone(user_id):
+    """
+    Returns the user's timezone preference as a pytz timezone. Users without one get the TZ
+    environment variable, and unknown timezone names fall back to UTC.
+    """
+
+    def load():
+        session = get_session()
+        preference = (
+            session.query(UserPreferences.pref_value)
+            .filter(
+                UserPreferences.user_id == user_id,
+                UserPreferences.pref_key == "timezone",
+            )
+            .first()
+        )
+        session.close()
+        timezone = preference[0] if preference and preference[0] else getenv("TZ")
+        try:
+            return pytz.timezone(timezone)
+        except pytz.UnknownTimeZoneError:
+            return pytz.utc
+
+    return identity_cache.resolve(TIMEZONES, str(user_id), load)
+
+
+def invalidate_timezone(user_id):
+    identity_cache.invalidate(TIMEZONES, str(user_id))
+
+
+@lru_cache(maxsize=None)
+def get_registration_requirement_keys() -> tuple:
+    """Returns the user preference keys named in registration_requirements.json."""
+    if not os.path.exists("registration_requirements.json"):
+        return ()
+    with open("registration_requirements.json", "r") as file:
+        requirements = json.load(file)
+    return tuple(requirements) if requirements else ()
+
+
+def get_cached_registration_settings(user_id) -> dict:
+    """
+    Returns the user's answers to the registration requirements, which override the settings
+    of every agent the user runs.
+    """
+    keys = get_registration_requirement_keys()
+    if not keys:
+        return {}
+
+    def load():
+        session = get_session()
+        preferences = (
+            session.query(UserPreferences.pref_key, UserPreferences.pref_value)
+            .filter(
+                UserPreferences.user_id == user_id,
+                UserPreferences.pref_key.in_(keys),
+            )
+            .all()
+        )
+        session.close()
+        return {key: str(value) for key, value in preferences}
+
+    return identity_cache.resolve(REGISTRATION_SETTINGS, str(user_id), load)
+
+
+def invalidate_registration_settings(user_id):
+    identity_cache.invalidate(REGISTRATION_SETTINGS, str(user_id))
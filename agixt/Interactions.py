@@ -10,8 +10,9 @@ import asyncio
 from datetime import datetime
 from readers.file import FileReader
 from Websearch import Websearch
-from Extensions import Extensions
-from Memories import extract_keywords
+from Extensions import Extensions, get_chain_version
+from NLP import extract_keywords
+from Memories import get_memories_from_collections
 from ApiClient import (
     Agent,
     Prompts,
@@ -20,6 +21,10 @@ from ApiClient import (
     AGIXT_URI,
 )
 from Globals import getenv, DEFAULT_USER, get_tokens
+from IdentityCache import IdentityCache
+from Tokens import count_tokens_batch
+from Prompts import get_prompt_template
+from DB import run_db
 
 logging.basicConfig(
     level=getenv("LOG_LEVEL"),
@@ -27,6 +32,78 @@ logging.basicConfig(
 )
 
 
+COMMAND_CATALOGS = "command_catalog"
+# Placeholder the command catalog is formatted into prompts as, so it is counted only once
+COMMANDS_PLACEHOLDER = "\x00COMMANDS\x00"
+
+# Rendered command catalog prompt blocks of this worker, see Interactions.get_command_catalog
+command_catalogs = IdentityCache(
+    ttl=int(getenv("AGENT_CONFIG_CACHE_TTL")),
+    max_size=int(getenv("COMMAND_CATALOG_CACHE_SIZE")),
+)
+
+
+def render_command_catalog(
+    agent_extensions, working_directory: str, conversation_outputs: str
+):
+    """Renders the "Available Commands" prompt block from get_agent_extensions() output."""
+    commands = [
+        "## Available Commands\n\n**See command execution examples of commands that the assistant has access to below:**\n"
+    ]
+    for extension in agent_extensions:
+        enabled_commands = [
+            command for command in extension["commands"] if command["enabled"] == True
+        ]
+        if enabled_commands == []:
+            continue
+        commands.append(
+            f"\n### {extension['extension_name']}\nDescription: {extension['description']}\n"
+        )
+        for command in enabled_commands:
+            command_friendly_name = command["friendly_name"]
+            commands.append(
+                f"\n#### {command_friendly_name}\nDescription: {command['description']}\nCommand execution format:\n"
+            )
+            commands.append(f"<execute>\n<name>{command_friendly_name}</name>\n")
+            for arg_name in command["command_args"].keys():
+                if arg_name != "chain_name":
+                    commands.append(
+                        f"<{arg_name}>The assistant will fill in the value based on relevance to the conversation.</{arg_name}>\n"
+                    )
+                else:
+                    commands.append(
+                        f"<chain_name>{command_friendly_name}</chain_name>\n"
+                    )
+            commands.append("</execute>\n")
+    commands.append(f"""## Command Execution Guidelines
+- **The assistant has commands available to use if they would be useful to provide a better user experience.**
+- Reference examples for correct syntax and usage of commands.
+- To execute a command, the assistant should use the following format:
+
+<execute>
+<name>COMMAND_NAME</name>
+<ARG1_NAME>ARG1_VALUE</ARG1_NAME>
+<ARG2_NAME>ARG2_VALUE</ARG2_NAME>
+...
+</execute>
+
+- All inputs are strings and must be appropriately filled in with the correct values.
+- The assistant can execute a command anywhere in the response, and the commands will be executed in the order they appear.
+- If referencing a file path, use the assistant's working directory as the file path. The assistant's working directory is {working_directory}.
+- Only reference files in the working directory! The assistant cannot access files outside of the working directory.
+- All files in the working directory will be immediately available to the user and agent in this folder: {conversation_outputs}
+- The assistant will receive the command output before the user does and will be able to reference the output in the response.
+- The assistant can choose to execute as many commands as needed in the response in the order that they should be executed.
+- Once the assistant executes a command, it should stop at </execute> and wait for the command output before continuing.
+- The assistant should never generate a <output> tag in the response. The assistant will receive the command output and will be able to reference the output in the response.
+- If there is an <output> tag in the assistants previous responses in context, it refers to the command execution output. Use this output to determine if the command was successful, and to course correct if needed.
+- Any time the assistant executes a command, the text generation should end with </execute>. The assistant will be informed of the command output before the user receives the response to give the assistant the opportunity to evaluate the output and ensure it is correct, exploring different options if needed.
+- After command execution, increase step budget by 5, continue thinking, executing more commands if necessary for self-error correct unless user intervention is required, and then respond to the user.
+- Command executions should all take place BEFORE the <answer> block! Never inside the <answer> block. Only the response to the user goes inside the <answer> block.
+- **THE ASSISTANT CANNOT EXECUTE A COMMAND THAT IS NOT ON THE LIST OF EXAMPLES!**""")
+    return "".join(commands)
+
+
 class Interactions:
     def __init__(
         self,
@@ -34,13 +111,18 @@ class Interactions:
         user=DEFAULT_USER,
         ApiClient=None,
         collection_id: str = "0",
+        agent=None,
     ):
         self.ApiClient = ApiClient
         self.user = user
         self.uri = getenv("AGIXT_URI")
         if agent_name != "":
             self.agent_name = agent_name
-            self.agent = Agent(self.agent_name, user=user, ApiClient=self.ApiClient)
+            self.agent = (
+                agent
+                if agent is not None
+                else Agent(self.agent_name, user=user, ApiClient=self.ApiClient)
+            )
             self.websearch = Websearch(
                 collection_number=collection_id,
                 agent=self.agent,
@@ -85,18 +167,7 @@ class Interactions:
     def custom_format(self, string, **kwargs):
         if isinstance(string, list):
             string = "".join(str(x) for x in string)
-
-        def replace(match):
-            key = match.group(1)
-            value = kwargs.get(key, match.group(0))
-            if isinstance(value, list):
-                return "".join(str(x) for x in value)
-            else:
-                return str(value)
-
-        pattern = r"(?<!{){([^{}\n]+)}(?!})"
-        result = re.sub(pattern, replace, string)
-        return result
+        return get_prompt_template(string).render(**kwargs)
 
     async def format_prompt(
         self,
@@ -114,8 +185,10 @@ class Interactions:
             "Default" if "prompt_category" not in kwargs else kwargs["prompt_category"]
         )
         try:
-            prompt = self.cp.get_prompt(
-                prompt_name=prompt_name, prompt_category=prompt_category
+            prompt = await run_db(
+                self.cp.get_prompt,
+                prompt_name=prompt_name,
+                prompt_category=prompt_category,
             )
             prompt_args = self.cp.get_prompt_args(prompt_text=prompt)
         except Exception as e:
@@ -129,7 +202,7 @@ class Interactions:
         if conversation_name == "":
             conversation_name = "-"
         c = Conversations(conversation_name=conversation_name, user=self.user)
-        conversation_id = c.get_conversation_id()
+        conversation_id = await run_db(c.get_conversation_id)
         conversation_outputs = (
             f"http://localhost:7437/outputs/{self.agent.agent_id}/{conversation_id}/"
         )
@@ -142,21 +215,36 @@ class Interactions:
                         min_relevance_score = float(kwargs["min_relevance_score"])
                     except:
                         min_relevance_score = 0.2
-                context += await self.agent_memory.get_memories(
-                    user_input=user_input,
-                    limit=top_results,
-                    min_relevance_score=min_relevance_score,
-                )
-                positive_feedback = await self.positive_feedback_memories.get_memories(
-                    user_input=user_input,
-                    limit=3,
-                    min_relevance_score=0.7,
-                )
-                negative_feedback = await self.negative_feedback_memories.get_memories(
-                    user_input=user_input,
-                    limit=3,
-                    min_relevance_score=0.7,
+                top_results = int(top_results)
+                lookups = [
+                    (self.agent_memory, top_results, min_relevance_score),
+                    (self.positive_feedback_memories, 3, 0.7),
+                    (self.negative_feedback_memories, 3, 0.7),
+                    # Over-fetch conversation memories once, trimmed below by token budget
+                    (self.websearch.agent_memory, top_results * 4, min_relevance_score),
+                ]
+                if "inject_memories_from_collection_number" in kwargs:
+                    collection_id = kwargs["inject_memories_from_collection_number"]
+                    if collection_id not in ["0", "1", "2", "3", "4", "5", "6", "7"]:
+                        lookups.append(
+                            (
+                                FileReader(
+                                    agent_name=self.agent_name,
+                                    agent_config=self.agent.AGENT_CONFIG,
+                                    collection_number=collection_id,
+                                    ApiClient=self.ApiClient,
+                                    user=self.user,
+                                ),
+                                top_results,
+                                min_relevance_score,
+                            )
+                        )
+                memories = await get_memories_from_collections(
+                    user_input=user_input, lookups=lookups
                 )
+                context += memories[0]
+                positive_feedback = memories[1]
+                negative_feedback = memories[2]
                 if positive_feedback or negative_feedback:
                     context.append(
                         f"The users input makes you to remember some feedback from previous interactions:\n"
@@ -167,50 +255,22 @@ class Interactions:
                     if negative_feedback:
                         joined_feedback = "\n".join(negative_feedback)
                         context.append(f"Negative Feedback:\n{joined_feedback}\n")
-                if "inject_memories_from_collection_number" in kwargs:
-                    collection_id = kwargs["inject_memories_from_collection_number"]
-                    if collection_id not in ["0", "1", "2", "3", "4", "5", "6", "7"]:
-                        context += await FileReader(
-                            agent_name=self.agent_name,
-                            agent_config=self.agent.AGENT_CONFIG,
-                            collection_number=collection_id,
-                            ApiClient=self.ApiClient,
-                            user=self.user,
-                        ).get_memories(
-                            user_input=user_input,
-                            limit=top_results,
-                            min_relevance_score=min_relevance_score,
-                        )
-                conversation_context = await self.websearch.agent_memory.get_memories(
-                    user_input=user_input,
-                    limit=top_results,
-                    min_relevance_score=min_relevance_score,
-                )
-                if len(conversation_context) == int(top_results):
-                    conversational_context_tokens = get_tokens(
-                        " ".join(conversation_context)
-                    )
-                    if int(conversational_context_tokens) < 4000:
-                        conversational_results = top_results * 2
-                        conversation_context = (
-                            await self.websearch.agent_memory.get_memories(
-                                user_input=user_input,
-                                limit=conversational_results,
-                                min_relevance_score=min_relevance_score,
-                            )
-                        )
-                        conversational_context_tokens = get_tokens(
-                            " ".join(conversation_context)
-                        )
-                        if int(conversational_context_tokens) < 4000:
-                            conversational_results = conversational_results * 2
-                            conversation_context = (
-                                await self.websearch.agent_memory.get_memories(
-                                    user_input=user_input,
-                                    limit=conversational_results,
-                                    min_relevance_score=min_relevance_score,
-                                )
-                            )
+                if len(memories) > 4:
+                    context += memories[4]
+                # Expand the conversation context to 2x then 4x top_results while it fits in the token budget
+                conversation_memories = memories[3]
+                conversation_context = conversation_memories[:top_results]
+                conversational_results = top_results
+                while (
+                    conversational_results < top_results * 4
+                    and len(conversation_context) == conversational_results
+                    and get_tokens(" ".join(conversation_context), approximate=True)
+                    < 4000
+                ):
+                    conversational_results = conversational_results * 2
+                    conversation_context = conversation_memories[
+                        :conversational_results
+                    ]
                 context += conversation_context
         if "context" in kwargs:
             context.append(kwargs["context"])
@@ -252,47 +312,24 @@ class Interactions:
             except:
                 conversation_results = 5
         conversation_history = ""
-        conversation = c.get_conversation()
-        if "interactions" in conversation:
-            if conversation["interactions"] != []:
-                activity_history = [
-                    interaction
-                    for interaction in conversation["interactions"]
-                    if str(interaction["message"]).startswith("[ACTIVITY]")
-                ]
-                activities = []
-                for activity in activity_history:
-                    if "audio response" not in activity["message"]:
-                        activities.append(activity)
-                if len(activity_history) > 5:
-                    activity_history = activity_history[-5:]
-                interactions = []
-                for interaction in conversation["interactions"]:
-                    if (
-                        not str(interaction["message"]).startswith("<audio controls>")
-                        and not str(interaction["message"]).startswith("[ACTIVITY]")
-                        and not str(interaction["message"]).startswith("[SUBACTIVITY]")
-                    ):
-                        timestamp = (
-                            interaction["timestamp"]
-                            if "timestamp" in interaction
-                            else ""
-                        )
-                        role = interaction["role"] if "role" in interaction else ""
-                        message = (
-                            interaction["message"] if "message" in interaction else ""
-                        )
-                        message = regex.sub(r"(```.*?```)", "", message)
-                        interactions.append(f"{timestamp} {role}: {message} \n ")
-                if len(interactions) > 0:
-                    interactions = interactions[-conversation_results:]
-                    conversation_history = "\n".join(interactions)
-                conversation_history += "\nThe assistant's recent activities:\n"
-                for activity in activity_history:
-                    timestamp = activity["timestamp"]
-                    role = activity["role"]
-                    message = str(activity["message"]).replace("[ACTIVITY]", "")
-                    conversation_history += f"{timestamp} {role}: {message} \n "
+        history = await run_db(
+            c.get_recent_history, limit=conversation_results, activity_limit=5
+        )
+        if history["interactions"] != [] or history["activities"] != []:
+            interactions = []
+            for interaction in history["interactions"]:
+                message = regex.sub(r"(```.*?```)", "", interaction["message"])
+                interactions.append(
+                    f"{interaction['timestamp']} {interaction['role']}: {message} \n "
+                )
+            if len(interactions) > 0:
+                conversation_history = "\n".join(interactions)
+            conversation_history += "\nThe assistant's recent activities:\n"
+            for activity in history["activities"]:
+                timestamp = activity["timestamp"]
+                role = activity["role"]
+                message = str(activity["message"]).replace("[ACTIVITY]", "")
+                conversation_history += f"{timestamp} {role}: {message} \n "
         if conversation_history != "":
             context.append(
                 f"### Recent Activities and Conversation History\n{conversation_history}\n"
@@ -418,69 +455,21 @@ class Interactions:
             if arg in skip_args:
                 del args[arg]
         agent_commands = ""
+        agent_commands_tokens = 0
         if "disable_commands" not in kwargs:
             if len(command_list) > 0:
-                agent_extensions = self.agent.get_agent_extensions()
-                agent_commands = "## Available Commands\n\n**See command execution examples of commands that the assistant has access to below:**\n"
-                for extension in agent_extensions:
-                    if extension["commands"] == []:
-                        continue
-                    extension_name = extension["extension_name"]
-                    extension_description = extension["description"]
-                    enabled_commands = [
-                        command
-                        for command in extension["commands"]
-                        if command["enabled"] == True
-                    ]
-                    if enabled_commands == []:
-                        continue
-                    agent_commands += f"\n### {extension_name}\nDescription: {extension_description}\n"
-                    for command in enabled_commands:
-                        command_friendly_name = command["friendly_name"]
-                        command_description = command["description"]
-                        agent_commands += f"\n#### {command_friendly_name}\nDescription: {command_description}\nCommand execution format:\n"
-                        agent_commands += (
-                            f"<execute>\n<name>{command_friendly_name}</name>\n"
-                        )
-                        for arg_name in command["command_args"].keys():
-                            if arg_name != "chain_name":
-                                agent_commands += f"<{arg_name}>The assistant will fill in the value based on relevance to the conversation.</{arg_name}>\n"
-                            else:
-                                agent_commands += f"<chain_name>{command_friendly_name}</chain_name>\n"
-                        agent_commands += "</execute>\n"
-                agent_commands += f"""## Command Execution Guidelines
-- **The assistant has commands available to use if they would be useful to provide a better user experience.**
-- Reference examples for correct syntax and usage of commands.
-- To execute a command, the assistant should use the following format:
-
-<execute>
-<name>COMMAND_NAME</name>
-<ARG1_NAME>ARG1_VALUE</ARG1_NAME>
-<ARG2_NAME>ARG2_VALUE</ARG2_NAME>
-...
-</execute>
-
-- All inputs are strings and must be appropriately filled in with the correct values.
-- The assistant can execute a command anywhere in the response, and the commands will be executed in the order they appear.
-- If referencing a file path, use the assistant's working directory as the file path. The assistant's working directory is {working_directory}.
-- Only reference files in the working directory! The assistant cannot access files outside of the working directory.
-- All files in the working directory will be immediately available to the user and agent in this folder: {conversation_outputs}
-- The assistant will receive the command output before the user does and will be able to reference the output in the response.
-- The assistant can choose to execute as many commands as needed in the response in the order that they should be executed.
-- Once the assistant executes a command, it should stop at </execute> and wait for the command output before continuing.
-- The assistant should never generate a <output> tag in the response. The assistant will receive the command output and will be able to reference the output in the response.
-- If there is an <output> tag in the assistants previous responses in context, it refers to the command execution output. Use this output to determine if the command was successful, and to course correct if needed.
-- Any time the assistant executes a command, the text generation should end with </execute>. The assistant will be informed of the command output before the user receives the response to give the assistant the opportunity to evaluate the output and ensure it is correct, exploring different options if needed.
-- After command execution, increase step budget by 5, continue thinking, executing more commands if necessary for self-error correct unless user intervention is required, and then respond to the user.
-- Command executions should all take place BEFORE the <answer> block! Never inside the <answer> block. Only the response to the user goes inside the <answer> block.
-- **THE ASSISTANT CANNOT EXECUTE A COMMAND THAT IS NOT ON THE LIST OF EXAMPLES!**"""
+                agent_commands, agent_commands_tokens = self.get_command_catalog(
+                    command_list=command_list,
+                    working_directory=working_directory,
+                    conversation_outputs=conversation_outputs,
+                )
         formatted_prompt = self.custom_format(
             string=prompt,
             user_input=user_input,
             agent_name=self.agent_name,
-            COMMANDS=agent_commands,
+            COMMANDS=COMMANDS_PLACEHOLDER,
             context=context,
-            command_list=agent_commands,
+            command_list=COMMANDS_PLACEHOLDER,
             date=datetime.now().strftime("%B %d, %Y %I:%M %p"),
             working_directory=working_directory,
             helper_agent_name=helper_agent_name,
@@ -490,9 +479,55 @@ class Interactions:
             output_url=conversation_outputs,
             **args,
         )
-        tokens = get_tokens(formatted_prompt)
+        # Count the prompt around the command catalog, whose token count is precomputed
+        parts = formatted_prompt.split(COMMANDS_PLACEHOLDER)
+        tokens = sum(count_tokens_batch(parts)) + agent_commands_tokens * (
+            len(parts) - 1
+        )
+        formatted_prompt = agent_commands.join(parts)
         return formatted_prompt, prompt, tokens
 
+    def get_command_catalog(
+        self, command_list, working_directory: str, conversation_outputs: str
+    ):
+        """
+        Returns the "Available Commands" prompt block for the agent's enabled commands and its
+        token count. Blocks are cached per agent config version, enabled command set, chain
+        version, connected SSO providers and conversation, so a steady-state chat turn reuses
+        the rendered block. The versions and providers are read from the database, so changes
+        made on any worker are seen on the next turn.
+
+        Args:
+            command_list (list): Friendly names of the enabled commands.
+            working_directory (str): The conversation's working directory.
+            conversation_outputs (str): URL of the conversation's output files.
+
+        Returns:
+            tuple: The rendered block and its token count.
+        """
+        chain_version = get_chain_version(self.agent.user_id)
+        key = (
+            self.agent.agent_id,
+            self.agent.config_version,
+            frozenset(command_list),
+            chain_version,
+            self.agent.get_sso_providers(),
+            working_directory,
+            conversation_outputs,
+        )
+        catalog = command_catalogs.get(COMMAND_CATALOGS, key)
+        if catalog is None:
+            # The agent's extensions may be shared with requests that loaded older chains
+            self.agent.extensions.refresh_chains(chain_version)
+            agent_commands = render_command_catalog(
+                agent_extensions=self.agent.get_agent_extensions(),
+                working_directory=working_directory,
+                conversation_outputs=conversation_outputs,
+            )
+            catalog = (agent_commands, get_tokens(agent_commands))
+            command_catalogs.set(COMMAND_CATALOGS, key, catalog)
+        return catalog
+
     def process_thinking_tags(
         self, response: str, thinking_id: str, c: Conversations
     ) -> str:
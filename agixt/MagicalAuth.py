@@ -7,6 +7,11 @@ from DB import (
     get_session,
 )
 from OAuth2Providers import get_sso_provider
+from IdentityCache import (
+    get_cached_user_id,
+    invalidate_registration_settings,
+    invalidate_timezone,
+)
 from Models import UserInfo, Register, Login
 from agixtsdk import AGiXTSDK
 from fastapi import Header, HTTPException
@@ -154,6 +159,8 @@ def verify_api_key(authorization: str = Header(None)):
             db = get_session()
             user = db.query(User).filter(User.id == token["sub"]).first()
         except Exception as e:
+            if "db" in locals():
+                db.close()
             raise HTTPException(status_code=401, detail="Invalid API Key")
         if user.is_active == False:
             user_preferences = MagicalAuth(token=authorization).get_user_preferences()
@@ -211,17 +218,9 @@ def get_sso_credentials(user_id):
 
 
 def get_user_id(user: str):
-    session = get_session()
-    user_data = session.query(User).filter(User.email == user).first()
-    if user_data is None:
-        session.close()
-        raise HTTPException(status_code=404, detail=f"User {user} not found.")
-    try:
-        user_id = user_data.id
-    except Exception as e:
-        session.close()
+    user_id = get_cached_user_id(user)
+    if user_id is None:
         raise HTTPException(status_code=404, detail=f"User {user} not found.")
-    session.close()
     return user_id
 
 
@@ -355,9 +354,9 @@ class MagicalAuth:
         email = email.lower()
         session = get_session()
         user = session.query(User).filter(User.email == email).first()
+        session.close()
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
-        session.close()
         return True
 
     def add_failed_login(self, ip_address):
@@ -652,6 +651,9 @@ class MagicalAuth:
                     user_preference.pref_value = str(value)
         session.commit()
         session.close()
+        if "timezone" in kwargs:
+            invalidate_timezone(self.user_id)
+        invalidate_registration_settings(self.user_id)
         return "User updated successfully."
 
     def delete_user(self):
@@ -3,19 +3,16 @@ import os
 import asyncio
 import sys
 import json
-import time
-import spacy
-import chromadb
-from chromadb.config import Settings
-from chromadb.api.types import QueryResult
-from numpy import array, linalg, ndarray
+from numpy import array, flatnonzero, ndarray
 from hashlib import sha256
 from Providers import Providers
+from Agent import get_agent_config
 from datetime import datetime
-from collections import Counter
-from typing import List
+from typing import AsyncIterator, Iterator, List, Optional
 from Globals import getenv, DEFAULT_USER
-from textacy.extract.keyterms import textrank
+from NLP import iter_sentences
+from DB import MemorySource, MemorySourceChunk, get_session
+from VectorStore import get_vector_store, normalize_rows
 
 logging.basicConfig(
     level=getenv("LOG_LEVEL"),
@@ -24,21 +21,10 @@ logging.basicConfig(
 if sys.platform == "win32":
     asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
 
-
-def nlp(text):
-    try:
-        sp = spacy.load("en_core_web_sm")
-    except:
-        spacy.cli.download("en_core_web_sm")
-        sp = spacy.load("en_core_web_sm")
-    sp.max_length = 99999999999999999999999
-    return sp(text)
-
-
-def extract_keywords(doc=None, text="", limit=10):
-    if not doc:
-        doc = nlp(text)
-    return [k for k, s in textrank(doc, topn=limit)]
+# Maximum number of IDs per IN clause when updating memory source manifests
+MANIFEST_BATCH_SIZE = 500
+# Registered for a collection once its existing memories were scanned for their sources
+SOURCE_REGISTRY_MARKER = "__source_registry_backfilled__"
 
 
 def snake(old_str: str = ""):
@@ -64,92 +50,34 @@ def snake(old_str: str = ""):
     return snake_str
 
 
-def compute_similarity_scores(embedding: ndarray, embedding_array: ndarray) -> ndarray:
-    query_norm = linalg.norm(embedding)
-    collection_norm = linalg.norm(embedding_array, axis=1)
-    valid_indices = (query_norm != 0) & (collection_norm != 0)
-    similarity_scores = array([-1.0] * embedding_array.shape[0])
+def distances_to_relevance_scores(distances: ndarray, space: str = "l2") -> ndarray:
+    """
+    Converts Chroma distances to cosine relevance scores in one vectorized pass.
+    Embeddings are normalized to unit length before they are stored or queried, so squared
+    L2 distance is 2 - 2cos whatever the embedder returns.
 
-    if valid_indices.any():
-        similarity_scores[valid_indices] = embedding.dot(
-            embedding_array[valid_indices].T
-        ) / (query_norm * collection_norm[valid_indices])
-    else:
-        raise ValueError(f"Invalid vectors: {embedding_array} or {embedding}")
-    return similarity_scores
+    Args:
+        distances: Distances returned by `collection.query()`
+        space: The collection's `hnsw:space` (l2, cosine or ip)
 
+    Returns:
+        ndarray: Relevance scores, higher is more relevant
+    """
+    if space == "l2":
+        return 1.0 - distances / 2.0
+    return 1.0 - distances
 
-def query_results_to_records(results: "QueryResult"):
-    try:
-        if isinstance(results["ids"][0], str):
-            for k, v in results.items():
-                results[k] = [v]
-    except IndexError:
-        return []
-    memory_records = []
-    for id, document, embedding, metadata in zip(
-        results["ids"][0],
-        results["documents"][0],
-        results["embeddings"][0],
-        results["metadatas"][0],
-    ):
-        if metadata:
-            memory_records.append(
-                {
-                    "external_source_name": metadata.get(
-                        "external_source_name", "user input"
-                    ),
-                    "id": metadata["id"],
-                    "description": metadata["description"],
-                    "text": document,
-                    "embedding": embedding,
-                    "additional_metadata": metadata["additional_metadata"],
-                    "key": id,
-                    "timestamp": metadata["timestamp"],
-                }
-            )
-    return memory_records
 
-
-def get_chroma_client():
-    """
-    To use an external Chroma server, set the following environment variables:
-        CHROMA_HOST: The host of the Chroma server
-        CHROMA_PORT: The port of the Chroma server
-        CHROMA_API_KEY: The API key of the Chroma server
-        CHROMA_SSL: Set to "true" if the Chroma server uses SSL
-    """
-    chroma_host = getenv("CHROMA_HOST")
-    chroma_settings = Settings(
-        anonymized_telemetry=False,
-    )
-    if chroma_host:
-        # Use external Chroma server
-        try:
-            chroma_api_key = getenv("CHROMA_API_KEY")
-            chroma_headers = (
-                {"Authorization": f"Bearer {chroma_api_key}"} if chroma_api_key else {}
-            )
-            return chromadb.HttpClient(
-                host=chroma_host,
-                port=getenv("CHROMA_PORT"),
-                ssl=(False if getenv("CHROMA_SSL").lower() != "true" else True),
-                headers=chroma_headers,
-                settings=chroma_settings,
-            )
-        except:
-            # If the external Chroma server is not available, use local memories folder
-            logging.warning(
-                f"Chroma server at {chroma_host} is not available. Using local memories folder."
-            )
-    # Persist to local memories folder
-    memories_dir = os.path.join(os.getcwd(), "memories")
-    if not os.path.exists(memories_dir):
-        os.makedirs(memories_dir)
-    return chromadb.PersistentClient(
-        path=memories_dir,
-        settings=chroma_settings,
-    )
+def query_result_to_record(id: str, document: str, metadata: dict) -> dict:
+    return {
+        "external_source_name": metadata.get("external_source_name", "user input"),
+        "id": metadata["id"],
+        "description": metadata["description"],
+        "text": document,
+        "additional_metadata": metadata["additional_metadata"],
+        "key": id,
+        "timestamp": metadata["timestamp"],
+    }
 
 
 def hash_user_id(user: str, length: int = 8) -> str:
@@ -243,6 +171,68 @@ def get_base_collection_name(user: str, agent_name: str) -> str:
     return snake(f"{user}_{agent_name}")
 
 
+def generate_chunks(text: str, chunk_size: int) -> Iterator[str]:
+    """
+    Groups sentences into chunks of up to `chunk_size` spaCy tokens.
+    Only the current window of text is parsed at a time, so memory use does not grow with the document.
+    """
+    chunk = []
+    chunk_len = 0
+    for sentence in iter_sentences(text=text):
+        if chunk_len + len(sentence) > chunk_size and chunk:
+            yield " ".join(chunk)
+            chunk = []
+            chunk_len = 0
+        chunk.extend(sentence)
+        chunk_len += len(sentence)
+    if chunk:
+        yield " ".join(chunk)
+
+
+async def get_memories_from_collections(
+    user_input: str, lookups: List[tuple]
+) -> List[List[str]]:
+    """
+    Retrieves memories from several collections for the same query.
+    The query is embedded once and every collection is queried concurrently.
+
+    Args:
+        user_input: Query text
+        lookups: List of (Memories, limit, min_relevance_score) tuples
+
+    Returns:
+        List[List[str]]: Memories for each lookup, in the same order as `lookups`
+    """
+    if not user_input or not lookups:
+        return [[] for _ in lookups]
+    try:
+        embedding = await lookups[0][0].embed_query(user_input)
+    except Exception as e:
+        logging.warning(f"Error embedding query for memory retrieval: {e}")
+        return [[] for _ in lookups]
+    results = await asyncio.gather(
+        *[
+            memories.get_memories(
+                user_input=user_input,
+                limit=limit,
+                min_relevance_score=min_relevance_score,
+                embedding=embedding,
+            )
+            for memories, limit, min_relevance_score in lookups
+        ],
+        return_exceptions=True,
+    )
+    memories_list = []
+    for (memories, limit, min_relevance_score), result in zip(lookups, results):
+        if isinstance(result, Exception):
+            logging.warning(
+                f"Error retrieving memories from {memories.collection_name}: {result}"
+            )
+            result = []
+        memories_list.append(result)
+    return memories_list
+
+
 class Memories:
     def __init__(
         self,
@@ -269,7 +259,7 @@ class Memories:
             collection_id=self.collection_number,
         )
         if agent_config is None:
-            agent_config = ApiClient.get_agentconfig(agent_name=agent_name)
+            agent_config = get_agent_config(agent_name=agent_name, user=user)
         self.agent_config = (
             agent_config
             if agent_config
@@ -280,7 +270,7 @@ class Memories:
             if "settings" in self.agent_config
             else {"embeddings_provider": "default"}
         )
-        self.chroma_client = get_chroma_client()
+        self.vector_store = get_vector_store()
         self.ApiClient = ApiClient
         self.embedding_provider = Providers(
             name="default",
@@ -292,12 +282,19 @@ class Memories:
             else 256
         )
         self.embedder = self.embedding_provider.embedder
+        try:
+            self.embedding_batch_size = int(getenv("EMBEDDING_BATCH_SIZE"))
+        except:
+            self.embedding_batch_size = 64
+        if self.embedding_batch_size < 1:
+            self.embedding_batch_size = 1
         self.summarize_content = summarize_content
         self.failures = 0
 
     async def wipe_memory(self):
         try:
-            self.chroma_client.delete_collection(name=self.collection_name)
+            self.vector_store.delete_collection(name=self.collection_name)
+            self.unregister_external_source()
             return True
         except:
             return False
@@ -354,43 +351,46 @@ class Memories:
 
     # get collections that start with the collection name
     async def get_collections(self):
-        collections = self.chroma_client.list_collections()
+        collections = self.vector_store.list_collections()
         prefix = get_user_collections_prefix(self.user)
         # Returns collections that start with the user's prefix
         return [
-            collection.name
-            for collection in collections
-            if collection.name.startswith(prefix)
+            collection for collection in collections if collection.startswith(prefix)
         ]
 
     async def get_collection(self):
         try:
-            return self.chroma_client.get_or_create_collection(
+            return self.vector_store.get_or_create_collection(
                 name=self.collection_name, embedding_function=self.embedder
             )
         except Exception as e:
-            try:
-                logging.warning(
-                    f"Error275 {e} getting collection: {self.collection_name}"
-                )
-                return self.chroma_client.create_collection(
-                    name=self.collection_name,
-                    embedding_function=self.embedder,
-                    get_or_create=True,
-                )
-            except Exception as e:
-                logging.warning(
-                    f"Error282 {e} getting collection: {self.collection_name}"
-                )
-                return None
+            logging.warning(f"Error282 {e} getting collection: {self.collection_name}")
+            return None
 
     async def delete_memory(self, key: str):
         collection = await self.get_collection()
         try:
             collection.delete(ids=key)
-            return True
         except:
             return False
+        session = get_session()
+        try:
+            source_ids = [
+                source[0]
+                for source in session.query(MemorySource.id)
+                .filter(MemorySource.collection_name == self.collection_name)
+                .all()
+            ]
+            session.query(MemorySourceChunk).filter(
+                MemorySourceChunk.memory_source_id.in_(source_ids),
+                MemorySourceChunk.chunk_id == key,
+            ).delete(synchronize_session=False)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            logging.warning(f"Error updating memory source manifest: {e}")
+        session.close()
+        return True
 
     async def summarize_text(self, text: str) -> str:
         # Chunk size is 1/2 the max tokens of the agent
@@ -419,113 +419,287 @@ class Memories:
         if text:
             if not isinstance(text, str):
                 text = str(text)
-            # Check for duplicates from external sources (files or URLs)
-            if external_source.startswith(("file", "http://", "https://")):
+            # Files and URLs replace what was learned from them before, anything else is appended
+            replace_source = external_source.startswith(("file", "http://", "https://"))
+            if self.summarize_content:
+                text = await self.summarize_text(text=text)
+            manifest = set()
+            if replace_source:
+                # Replacing a source needs its full manifest to find chunks that were dropped
                 try:
-                    # Get all external sources in this collection
-                    existing_sources = await self.get_external_data_sources()
-
-                    # Check if this source already exists in memory
-                    for source in existing_sources:
-                        if source == external_source:
-                            logging.info(
-                                f"Found existing content in memory from source: {external_source}"
-                            )
-                            # Delete existing memories for this source
-                            await self.delete_memories_from_external_source(
-                                external_source
-                            )
+                    await self.ensure_source_registry()
+                    manifest = self.get_source_manifest(external_source=external_source)
+                except Exception as e:
+                    logging.warning(f"Error reading memory source manifest: {e}")
+                    manifest = None
+                if manifest is None:
+                    # Sources learned before chunk manifests existed have timestamped chunk IDs
+                    try:
+                        if await self.delete_memories_from_external_source(
+                            external_source
+                        ):
                             logging.info(
                                 f"Deleted existing content from source: {external_source}"
                             )
-                            break
+                    except Exception as e:
+                        logging.warning(f"Error checking for existing content: {e}")
+                    manifest = set()
+            # Chunks are embedded in batches as they stream out of the chunker
+            seen_ids = set()
+            unchanged_ids = set()
+            written_ids = []
+            batch_ids = []
+            batch = []
+            async for chunk in self.stream_chunks(
+                text=text, chunk_size=self.chunk_size
+            ):
+                chunk_id = self.get_chunk_id(
+                    external_source=external_source, chunk=chunk
+                )
+                if chunk_id in seen_ids:
+                    continue
+                seen_ids.add(chunk_id)
+                if chunk_id in manifest:
+                    unchanged_ids.add(chunk_id)
+                    continue
+                batch_ids.append(chunk_id)
+                batch.append(chunk)
+                if len(batch) >= self.embedding_batch_size:
+                    written_ids.extend(
+                        await self.write_new_chunks(
+                            collection=collection,
+                            chunk_ids=batch_ids,
+                            chunks=batch,
+                            user_input=user_input,
+                            external_source=external_source,
+                            check_stored=not replace_source,
+                            unchanged_ids=unchanged_ids,
+                        )
+                    )
+                    batch_ids = []
+                    batch = []
+            if batch:
+                written_ids.extend(
+                    await self.write_new_chunks(
+                        collection=collection,
+                        chunk_ids=batch_ids,
+                        chunks=batch,
+                        user_input=user_input,
+                        external_source=external_source,
+                        check_stored=not replace_source,
+                        unchanged_ids=unchanged_ids,
+                    )
+                )
+            # Remove chunks that are no longer part of the source once the new ones are stored
+            removed_ids = list(manifest - seen_ids) if replace_source else []
+            if removed_ids:
+                try:
+                    collection.delete(ids=removed_ids)
                 except Exception as e:
-                    logging.warning(f"Error checking for existing content: {e}")
-            if self.summarize_content:
-                text = await self.summarize_text(text=text)
-            chunks = await self.chunk_content(text=text, chunk_size=self.chunk_size)
-            for chunk in chunks:
-                metadata = {
-                    "timestamp": datetime.now().isoformat(),
+                    logging.warning(f"Error deleting removed chunks: {e}")
+                    removed_ids = []
+            logging.info(
+                f"Learned {external_source}: {len(written_ids)} new, {len(unchanged_ids)} unchanged, {len(removed_ids)} removed chunks."
+            )
+            try:
+                self.update_source_manifest(
+                    external_source=external_source,
+                    added=written_ids,
+                    removed=removed_ids,
+                )
+            except Exception as e:
+                logging.warning(f"Error registering memory source: {e}")
+        return True
+
+    async def write_new_chunks(
+        self,
+        collection,
+        chunk_ids: List[str],
+        chunks: List[str],
+        user_input: str,
+        external_source: str,
+        check_stored: bool,
+        unchanged_ids: set,
+    ) -> List[str]:
+        """
+        Writes a batch of chunks, skipping the ones the source already has stored when check_stored is set.
+        """
+        if check_stored:
+            try:
+                stored_ids = self.get_source_manifest(
+                    external_source=external_source, chunk_ids=chunk_ids
+                )
+            except Exception as e:
+                logging.warning(f"Error reading memory source manifest: {e}")
+                stored_ids = set()
+            if stored_ids:
+                unchanged_ids.update(stored_ids)
+                new_chunks = [
+                    (chunk_id, chunk)
+                    for chunk_id, chunk in zip(chunk_ids, chunks)
+                    if chunk_id not in stored_ids
+                ]
+                if not new_chunks:
+                    return []
+                chunk_ids = [chunk_id for chunk_id, _ in new_chunks]
+                chunks = [chunk for _, chunk in new_chunks]
+        return await self.write_chunks_to_collection(
+            collection=collection,
+            chunk_ids=chunk_ids,
+            chunks=chunks,
+            user_input=user_input,
+            external_source=external_source,
+        )
+
+    async def write_chunks_to_collection(
+        self,
+        collection,
+        chunk_ids: List[str],
+        chunks: List[str],
+        user_input: str,
+        external_source: str,
+    ) -> List[str]:
+        timestamp = datetime.now().isoformat()
+        metadatas = []
+        for chunk_id, chunk in zip(chunk_ids, chunks):
+            metadatas.append(
+                {
+                    "timestamp": timestamp,
                     "is_reference": str(False),
                     "external_source_name": external_source,
                     "description": user_input,
                     "additional_metadata": chunk,
-                    "id": sha256(
-                        (chunk + datetime.now().isoformat()).encode()
-                    ).hexdigest(),
+                    "id": chunk_id,
                 }
-                try:
+            )
+        if await self.add_batch_to_collection(
+            collection=collection, documents=chunks, metadatas=metadatas
+        ):
+            return chunk_ids
+        return []
+
+    def get_chunk_id(self, external_source: str, chunk: str) -> str:
+        """
+        Content-addressed chunk ID. Identical text from the same source always gets the same ID.
+        """
+        return sha256(f"{external_source}\n{chunk}".encode()).hexdigest()
+
+    async def embed_documents(self, documents: List[str]) -> List[List[float]]:
+        """
+        Embeds a batch of documents with one vectorized call to the provider's embedder.
+
+        Args:
+            documents: Documents to embed
+
+        Returns:
+            List[List[float]]: One unit-length embedding per document, or None if there is no
+                embedder
+        """
+        if not self.embedder:
+            return None
+        embeddings = await asyncio.to_thread(self.embedder, documents)
+        return normalize_rows(array(embeddings, dtype=float)).tolist()
+
+    async def add_batch_to_collection(
+        self, collection, documents: List[str], metadatas: List[dict]
+    ) -> bool:
+        """
+        Embeds and inserts a batch of chunks with a single `collection.add()` call.
+        Failed inserts are retried with exponential backoff without blocking the event loop.
+        """
+        ids = [metadata["id"] for metadata in metadatas]
+        try:
+            embeddings = await self.embed_documents(documents=documents)
+        except Exception as e:
+            logging.warning(f"Error embedding batch of {len(documents)} chunks: {e}")
+            embeddings = None
+        delay = 0.1
+        retries = 5
+        for attempt in range(retries + 1):
+            try:
+                if embeddings:
                     collection.add(
-                        ids=metadata["id"],
-                        metadatas=metadata,
-                        documents=chunk,
+                        ids=ids,
+                        embeddings=embeddings,
+                        metadatas=metadatas,
+                        documents=documents,
                     )
-                except:
-                    self.failures += 1
-                    for i in range(5):
-                        try:
-                            time.sleep(0.1)
-                            collection.add(
-                                ids=metadata["id"],
-                                metadatas=metadata,
-                                documents=chunk,
-                            )
-                            self.failures = 0
-                            break
-                        except:
-                            self.failures += 1
-                            if self.failures > 5:
-                                break
-                            continue
-        return True
+                else:
+                    collection.add(ids=ids, metadatas=metadatas, documents=documents)
+                self.failures = 0
+                return True
+            except Exception as e:
+                self.failures += 1
+                logging.warning(
+                    f"Error adding {len(ids)} chunks to {self.collection_name} (attempt {attempt + 1}): {e}"
+                )
+                if attempt < retries:
+                    await asyncio.sleep(delay)
+                    delay *= 2
+        return False
+
+    async def embed_query(self, user_input: str):
+        return await asyncio.to_thread(self.embedding_provider.embeddings, user_input)
 
     async def get_memories_data(
         self,
         user_input: str,
         limit: int,
         min_relevance_score: float = 0.0,
+        embedding=None,
+        include_embeddings: bool = False,
     ) -> List[dict]:
         if not user_input:
             return ""
         collection = await self.get_collection()
         if collection == None:
             return ""
-        embedding = array(self.embedding_provider.embeddings(user_input))
-        results = collection.query(
+        if embedding is None:
+            embedding = await self.embed_query(user_input)
+        # Unit length like the stored embeddings, which distances_to_relevance_scores relies on
+        embedding = normalize_rows(array(embedding, dtype=float).reshape(1, -1))[0]
+        include = ["distances", "metadatas", "documents"]
+        if include_embeddings:
+            include.append("embeddings")
+        results = await asyncio.to_thread(
+            collection.query,
             query_embeddings=embedding.tolist(),
             n_results=limit,
-            include=["embeddings", "metadatas", "documents"],
+            include=include,
         )
-        embedding_array = array(results["embeddings"][0])
-        if len(embedding_array) == 0:
+        distances = array(results["distances"][0], dtype=float)
+        if len(distances) == 0:
             return []
-        embedding_array = embedding_array.reshape(embedding_array.shape[0], -1)
-        if len(embedding.shape) == 2:
-            embedding = embedding.reshape(
-                embedding.shape[1],
-            )
-        similarity_score = compute_similarity_scores(
-            embedding=embedding, embedding_array=embedding_array
-        )
-        record_list = []
-        for record, score in zip(query_results_to_records(results), similarity_score):
-            record["relevance_score"] = score
-            record_list.append(record)
-        sorted_results = sorted(
-            record_list, key=lambda x: x["relevance_score"], reverse=True
+        space = (collection.metadata or {}).get("hnsw:space", "l2")
+        relevance_scores = distances_to_relevance_scores(
+            distances=distances, space=space
         )
-        filtered_results = [
-            x for x in sorted_results if x["relevance_score"] >= min_relevance_score
-        ]
-        top_results = filtered_results[:limit]
-        return top_results
+        # Vector stores return results ordered by distance, so they are already sorted by relevance
+        records = []
+        for index in flatnonzero(relevance_scores >= min_relevance_score):
+            metadata = results["metadatas"][0][index]
+            if not metadata:
+                continue
+            record = query_result_to_record(
+                id=results["ids"][0][index],
+                document=results["documents"][0][index],
+                metadata=metadata,
+            )
+            record["relevance_score"] = float(relevance_scores[index])
+            if include_embeddings:
+                embedding = results["embeddings"][0][index]
+                record["embedding"] = (
+                    embedding.tolist() if hasattr(embedding, "tolist") else embedding
+                )
+            records.append(record)
+        return records[:limit]
 
     async def get_memories(
         self,
         user_input: str,
         limit: int,
         min_relevance_score: float = 0.0,
+        embedding=None,
     ) -> List[str]:
         # If this is a conversation ID, update the collection name
         if len(self.collection_number) > 4:
@@ -542,6 +716,7 @@ class Memories:
             user_input=user_input,
             limit=limit,
             min_relevance_score=min_relevance_score,
+            embedding=embedding,
         )
         logging.info(f"{len(results)} user results found in {self.collection_name}")
         if isinstance(results, str):
@@ -570,79 +745,228 @@ class Memories:
                     response.append(metadata)
         return response
 
+    def get_registered_sources(self) -> List[str]:
+        session = get_session()
+        sources = (
+            session.query(MemorySource.external_source)
+            .filter(
+                MemorySource.collection_name == self.collection_name,
+                MemorySource.external_source != SOURCE_REGISTRY_MARKER,
+            )
+            .all()
+        )
+        session.close()
+        return [source[0] for source in sources]
+
+    def register_external_sources(self, external_sources: List[str]):
+        session = get_session()
+        existing_sources = {
+            source[0]
+            for source in session.query(MemorySource.external_source)
+            .filter(
+                MemorySource.collection_name == self.collection_name,
+                MemorySource.external_source.in_(external_sources),
+            )
+            .all()
+        }
+        for external_source in set(external_sources) - existing_sources:
+            session.add(
+                MemorySource(
+                    collection_name=self.collection_name,
+                    external_source=external_source,
+                )
+            )
+        try:
+            session.commit()
+        except Exception as e:
+            # Another worker registered the same source first
+            session.rollback()
+            logging.info(f"Memory source already registered: {e}")
+        session.close()
+
+    def unregister_external_source(self, external_source: str = None):
+        session = get_session()
+        query = session.query(MemorySource).filter(
+            MemorySource.collection_name == self.collection_name
+        )
+        if external_source is not None:
+            query = query.filter(MemorySource.external_source == external_source)
+        source_ids = [source.id for source in query.all()]
+        for i in range(0, len(source_ids), MANIFEST_BATCH_SIZE):
+            batch = source_ids[i : i + MANIFEST_BATCH_SIZE]
+            session.query(MemorySourceChunk).filter(
+                MemorySourceChunk.memory_source_id.in_(batch)
+            ).delete(synchronize_session=False)
+            session.query(MemorySource).filter(MemorySource.id.in_(batch)).delete(
+                synchronize_session=False
+            )
+        session.commit()
+        session.close()
+
+    def get_source_manifest(
+        self, external_source: str, chunk_ids: Optional[List[str]] = None
+    ):
+        """
+        Returns the set of chunk IDs stored for a source.
+        Returns None if the source was registered before chunk manifests were recorded.
+        When chunk_ids is given, only those candidates are looked up and the stored subset is returned.
+        """
+        session = get_session()
+        source = (
+            session.query(MemorySource)
+            .filter(
+                MemorySource.collection_name == self.collection_name,
+                MemorySource.external_source == external_source,
+            )
+            .first()
+        )
+        if not source:
+            session.close()
+            return set()
+        if chunk_ids is not None:
+            stored_ids = set()
+            for i in range(0, len(chunk_ids), MANIFEST_BATCH_SIZE):
+                stored_ids.update(
+                    chunk[0]
+                    for chunk in session.query(MemorySourceChunk.chunk_id)
+                    .filter(
+                        MemorySourceChunk.memory_source_id == source.id,
+                        MemorySourceChunk.chunk_id.in_(
+                            chunk_ids[i : i + MANIFEST_BATCH_SIZE]
+                        ),
+                    )
+                    .all()
+                )
+            session.close()
+            return stored_ids
+        stored_ids = {
+            chunk[0]
+            for chunk in session.query(MemorySourceChunk.chunk_id)
+            .filter(MemorySourceChunk.memory_source_id == source.id)
+            .all()
+        }
+        session.close()
+        if not stored_ids:
+            return None
+        return stored_ids
+
+    def update_source_manifest(
+        self, external_source: str, added: List[str], removed: List[str]
+    ):
+        session = get_session()
+        source = (
+            session.query(MemorySource)
+            .filter(
+                MemorySource.collection_name == self.collection_name,
+                MemorySource.external_source == external_source,
+            )
+            .first()
+        )
+        if not source:
+            source = MemorySource(
+                collection_name=self.collection_name,
+                external_source=external_source,
+            )
+            session.add(source)
+            session.flush()
+        for i in range(0, len(removed), MANIFEST_BATCH_SIZE):
+            session.query(MemorySourceChunk).filter(
+                MemorySourceChunk.memory_source_id == source.id,
+                MemorySourceChunk.chunk_id.in_(removed[i : i + MANIFEST_BATCH_SIZE]),
+            ).delete(synchronize_session=False)
+        for chunk_id in added:
+            session.add(
+                MemorySourceChunk(memory_source_id=source.id, chunk_id=chunk_id)
+            )
+        try:
+            session.commit()
+        except Exception as e:
+            # Another worker learned the same source concurrently
+            session.rollback()
+            logging.info(f"Memory source manifest already updated: {e}")
+        session.close()
+
+    async def ensure_source_registry(self):
+        """
+        Collections written before the source registry existed are scanned once to backfill it.
+        The scan registers a marker with the sources it found, so collections whose memories
+        have no source names are not scanned again.
+        """
+        session = get_session()
+        registered = (
+            session.query(MemorySource.id)
+            .filter(MemorySource.collection_name == self.collection_name)
+            .first()
+        )
+        session.close()
+        if registered:
+            return
+        collection = await self.get_collection()
+        if not collection or collection.count() == 0:
+            return
+        results = collection.get(include=["metadatas"])
+        external_sources = {
+            metadata["external_source_name"]
+            for metadata in results["metadatas"]
+            if metadata and "external_source_name" in metadata
+        }
+        self.register_external_sources(
+            list(external_sources) + [SOURCE_REGISTRY_MARKER]
+        )
+
+    async def has_external_source(self, external_source: str) -> bool:
+        await self.ensure_source_registry()
+        session = get_session()
+        registered = (
+            session.query(MemorySource.id)
+            .filter(
+                MemorySource.collection_name == self.collection_name,
+                MemorySource.external_source == external_source,
+            )
+            .first()
+        )
+        session.close()
+        return registered is not None
+
     async def get_external_data_sources(self):
         """Get a list of all unique external source names from memory collection."""
-        collection = await self.get_collection()
-        if collection:
-            try:
-                # Get all documents and their metadata
-                results = collection.get()
-                if results and "metadatas" in results:
-                    # Extract external source names from all metadata entries
-                    external_sources = [
-                        metadata["external_source_name"]
-                        for metadata in results["metadatas"]
-                        if "external_source_name" in metadata
-                    ]
-                    # Return unique sources
-                    return list(set(external_sources))
-            except Exception as e:
-                logging.warning(f"Error getting external sources: {str(e)}")
+        try:
+            await self.ensure_source_registry()
+            return self.get_registered_sources()
+        except Exception as e:
+            logging.warning(f"Error getting external sources: {str(e)}")
         return []
 
     async def delete_memories_from_external_source(self, external_source: str):
         """Delete all memories from a specific external source."""
+        if not await self.has_external_source(external_source):
+            return False
         collection = await self.get_collection()
         if collection:
             try:
-                # Get all documents and their metadata
-                results = collection.get()
-                if results and "ids" in results and "metadatas" in results:
-                    # Find all IDs where external_source_name matches
-                    ids_to_delete = [
-                        id
-                        for id, metadata in zip(results["ids"], results["metadatas"])
-                        if metadata.get("external_source_name") == external_source
-                    ]
-                    if ids_to_delete:
-                        collection.delete(ids=ids_to_delete)
-                        return True
+                collection.delete(where={"external_source_name": external_source})
+                self.unregister_external_source(external_source=external_source)
+                return True
             except Exception as e:
                 logging.warning(
                     f"Error deleting memories from source {external_source}: {str(e)}"
                 )
         return False
 
-    def score_chunk(self, chunk: str, keywords: set) -> int:
-        """Score a chunk based on the number of query keywords it contains."""
-        chunk_counter = Counter(chunk.split())
-        score = sum(chunk_counter[keyword] for keyword in keywords)
-        return score
+    async def stream_chunks(self, text: str, chunk_size: int) -> AsyncIterator[str]:
+        """
+        Yields sentence-aligned chunks in document order as they are produced.
+        Parsing runs in a worker thread so large documents do not block the event loop.
+        """
+        chunks = generate_chunks(text=text, chunk_size=chunk_size)
+        while True:
+            chunk = await asyncio.to_thread(next, chunks, None)
+            if chunk is None:
+                return
+            yield chunk
 
     async def chunk_content(self, text: str, chunk_size: int) -> List[str]:
-        doc = nlp(text)
-        sentences = list(doc.sents)
-        content_chunks = []
-        chunk = []
-        chunk_len = 0
-        keywords = set(extract_keywords(doc=doc, limit=10))
-        for sentence in sentences:
-            sentence_tokens = len(sentence)
-            if chunk_len + sentence_tokens > chunk_size and chunk:
-                chunk_text = " ".join(token.text for token in chunk)
-                content_chunks.append(
-                    (self.score_chunk(chunk_text, keywords), chunk_text)
-                )
-                chunk = []
-                chunk_len = 0
-
-            chunk.extend(sentence)
-            chunk_len += sentence_tokens
-
-        if chunk:
-            chunk_text = " ".join(token.text for token in chunk)
-            content_chunks.append((self.score_chunk(chunk_text, keywords), chunk_text))
-
-        # Sort the chunks by their score in descending order before returning them
-        content_chunks.sort(key=lambda x: x[0], reverse=True)
-        return [chunk_text for score, chunk_text in content_chunks]
+        return [
+            chunk
+            async for chunk in self.stream_chunks(text=text, chunk_size=chunk_size)
+        ]
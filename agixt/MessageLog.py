@@ -0,0 +1,341 @@
+import os
+import time
+import uuid
+import atexit
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from DB import Conversation, Message, DATABASE_TYPE, new_session
+from Globals import getenv
+from IdentityCache import (
+    cache_conversation_id,
+    get_cached_conversation_id,
+    invalidate_conversation_id,
+)
+from sqlalchemy import insert
+from sqlalchemy.exc import (
+    DBAPIError,
+    DisconnectionError,
+    InterfaceError,
+    OperationalError,
+    TimeoutError as PoolTimeoutError,
+)
+from sqlalchemy.sql import func
+
+logging.basicConfig(
+    level=getenv("LOG_LEVEL"),
+    format=getenv("LOG_FORMAT"),
+)
+
+
+def is_transient(error: Exception) -> bool:
+    """True for errors that a later retry can succeed after, such as a lost connection."""
+    if isinstance(
+        error, (OperationalError, InterfaceError, DisconnectionError, PoolTimeoutError)
+    ):
+        return True
+    return isinstance(error, DBAPIError) and error.connection_invalidated
+
+
+class MessageLog:
+    """
+    Write-behind buffer for conversation messages.
+
+    append() assigns the message ID and timestamp on the client and returns immediately. A
+    background thread writes the buffer every `flush_interval` seconds, or sooner once
+    `batch_size` messages are waiting, as one multi-row insert plus one updated_at bump per
+    conversation. Timestamps are strictly increasing within the process, so messages keep the
+    order they were logged in. Anything that reads messages calls flush() first to see its
+    own writes; if the background thread is writing at the time, flush() waits until the
+    messages queued before the call are written. A `flush_interval` of 0 writes every message
+    before append() returns.
+
+    Messages stay queued while the database is unreachable and writing is retried with
+    exponential backoff, from `retry_delay` up to `max_retry_delay` seconds. Only a message
+    the database rejects on its own, such as one that violates a constraint, is dropped.
+    """
+
+    def __init__(
+        self,
+        flush_interval: float = 0.05,
+        batch_size: int = 500,
+        retry_delay: float = 0.5,
+        max_retry_delay: float = 30,
+    ):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.reset()
+        atexit.register(self.flush)
+
+    def reset(self):
+        self.pid = os.getpid()
+        self.pending = []
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        # Notified whenever written_sequence moves or a flush ends
+        self.flushed = threading.Condition(self.lock)
+        self.flushing = False
+        # Sequence number of the last queued message, and of the last message such that it
+        # and every message before it are written or dropped
+        self.sequence = 0
+        self.written_sequence = 0
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.last_timestamp = None
+        self.failures = 0
+        self.retry_at = 0
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(
+                target=self.run, name="MessageLog", daemon=True
+            )
+            self.thread.start()
+
+    def run(self):
+        while True:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            if time.monotonic() < self.retry_at:
+                continue
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Error writing conversation messages: {e}")
+
+    def next_timestamp(self):
+        # Naive UTC to match the database's now(), bumped so no two messages tie
+        timestamp = datetime.now(timezone.utc).replace(tzinfo=None)
+        if self.last_timestamp is not None and timestamp <= self.last_timestamp:
+            timestamp = self.last_timestamp + timedelta(microseconds=1)
+        self.last_timestamp = timestamp
+        return timestamp
+
+    def new_timestamp(self):
+        """Returns a timestamp ordered after every message logged so far."""
+        with self.lock:
+            return self.next_timestamp()
+
+    def check_process(self):
+        if self.pid != os.getpid():
+            # Forked worker, the parent's buffer and thread are not ours
+            self.reset()
+
+    def append(self, user_id, conversation_name: str, conversation_id, role, content):
+        """
+        Queues a message for the conversation and returns its ID and timestamp.
+
+        Args:
+            user_id: ID of the user that owns the conversation.
+            conversation_name (str): Name of the conversation, used to find or recreate it if
+                `conversation_id` no longer exists when the message is written.
+            conversation_id: Cached ID of the conversation.
+            role: Role of the message author.
+            content: Message content.
+
+        Returns:
+            tuple: ID of the new message and its timestamp.
+        """
+        self.check_process()
+        message_id = uuid.uuid4()
+        with self.lock:
+            timestamp = self.next_timestamp()
+            self.sequence += 1
+            self.pending.append(
+                {
+                    "sequence": self.sequence,
+                    "user_id": user_id,
+                    "conversation_name": conversation_name,
+                    "row": {
+                        "id": (
+                            str(message_id) if DATABASE_TYPE == "sqlite" else message_id
+                        ),
+                        "role": role,
+                        "content": content,
+                        "conversation_id": conversation_id,
+                        "timestamp": timestamp,
+                        "updated_at": timestamp,
+                        "feedback_received": False,
+                    },
+                }
+            )
+            pending = len(self.pending)
+            if self.flush_interval > 0:
+                self.start()
+        if self.flush_interval <= 0:
+            self.flush()
+        elif pending >= self.batch_size:
+            self.wakeup.set()
+        return str(message_id), timestamp
+
+    def flush(self, wait: bool = True):
+        """
+        Writes every queued message. Messages that could not be written because the database
+        is unreachable stay queued, and the background writer retries them after a backoff.
+
+        Args:
+            wait (bool): If another thread is already flushing, wait until it has written the
+                messages queued before this call, or write them here if it stops first.
+                Otherwise return at once and leave the queue to that flush.
+        """
+        self.check_process()
+        with self.lock:
+            target = self.sequence
+        while True:
+            if self.flush_lock.acquire(blocking=False):
+                break
+            if not wait:
+                return
+            with self.flushed:
+                self.flushed.wait_for(
+                    lambda: self.written_sequence >= target or not self.flushing
+                )
+                if self.written_sequence >= target:
+                    return
+        with self.lock:
+            self.flushing = True
+        try:
+            while True:
+                with self.lock:
+                    entries = self.pending[: self.batch_size]
+                    del self.pending[: self.batch_size]
+                if not entries:
+                    return
+                try:
+                    self.write(entries)
+                    self.failures = 0
+                    self.retry_at = 0
+                    self.mark_written(entries[-1])
+                    continue
+                except Exception as e:
+                    error = e
+                if not is_transient(error):
+                    # Find and drop the messages the database rejects, keep the rest
+                    retry = self.write_each(entries)
+                    if len(retry) < len(entries):
+                        self.mark_written(entries[len(entries) - len(retry) - 1])
+                    if not retry:
+                        continue
+                    entries = retry
+                self.requeue(entries, error)
+                return
+        finally:
+            with self.flushed:
+                self.flushing = False
+                self.flush_lock.release()
+                self.flushed.notify_all()
+
+    def mark_written(self, entry):
+        """Records that `entry` and every message queued before it are written or dropped."""
+        with self.flushed:
+            self.written_sequence = entry["sequence"]
+            self.flushed.notify_all()
+
+    def requeue(self, entries, error):
+        # Back at the front of the queue, so messages keep their order
+        with self.lock:
+            self.pending[:0] = entries
+            pending = len(self.pending)
+        self.failures += 1
+        delay = min(self.retry_delay * 2 ** (self.failures - 1), self.max_retry_delay)
+        self.retry_at = time.monotonic() + delay
+        logging.warning(
+            f"Writing conversation messages failed, retrying {pending} queued messages in {delay:g}s: {error}"
+        )
+
+    def write(self, entries):
+        session = new_session()
+        try:
+            self.resolve_conversations(session, entries)
+            rows = [entry["row"] for entry in entries]
+            session.execute(insert(Message), rows)
+            conversation_ids = list({row["conversation_id"] for row in rows})
+            session.query(Conversation).filter(
+                Conversation.id.in_(conversation_ids)
+            ).update({Conversation.updated_at: func.now()}, synchronize_session=False)
+            session.commit()
+        except:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def write_each(self, entries):
+        """
+        Writes the messages one at a time, dropping those the database rejects. Returns the
+        ones that failed with a transient error, to be retried.
+        """
+        retry = []
+        for index, entry in enumerate(entries):
+            try:
+                self.write([entry])
+            except Exception as e:
+                if is_transient(e):
+                    # The database went away, keep this and every later message
+                    retry.extend(entries[index:])
+                    break
+                logging.error(
+                    f"Dropping message {entry['row']['id']} for conversation {entry['conversation_name']}: {e}"
+                )
+        return retry
+
+    def resolve_conversations(self, session, entries):
+        """
+        Points messages whose conversation was deleted or renamed, possibly by another worker,
+        after its ID was cached at the conversation that now has their name, creating it if
+        needed.
+        """
+        conversation_ids = list({entry["row"]["conversation_id"] for entry in entries})
+        existing = {
+            (str(conversation_id), str(user_id), name)
+            for conversation_id, user_id, name in session.query(
+                Conversation.id, Conversation.user_id, Conversation.name
+            )
+            .filter(Conversation.id.in_(conversation_ids))
+            .all()
+        }
+        replacements = {}
+        for entry in entries:
+            if (
+                str(entry["row"]["conversation_id"]),
+                str(entry["user_id"]),
+                entry["conversation_name"],
+            ) in existing:
+                continue
+            key = (str(entry["user_id"]), entry["conversation_name"])
+            if key not in replacements:
+                invalidate_conversation_id(
+                    user_id=entry["user_id"],
+                    conversation_name=entry["conversation_name"],
+                )
+                conversation_id = get_cached_conversation_id(
+                    user_id=entry["user_id"],
+                    conversation_name=entry["conversation_name"],
+                )
+                if not conversation_id:
+                    conversation = Conversation(
+                        name=entry["conversation_name"], user_id=entry["user_id"]
+                    )
+                    session.add(conversation)
+                    session.flush()
+                    conversation_id = conversation.id
+                    cache_conversation_id(
+                        user_id=entry["user_id"],
+                        conversation_name=entry["conversation_name"],
+                        conversation_id=conversation_id,
+                    )
+                replacements[key] = conversation_id
+            entry["row"]["conversation_id"] = replacements[key]
+
+
+message_log = MessageLog(
+    flush_interval=float(getenv("MESSAGE_LOG_FLUSH_INTERVAL")),
+    batch_size=int(getenv("MESSAGE_LOG_BATCH_SIZE")),
+)
+
+
+def flush_messages():
+    """Writes any queued conversation messages so the next read sees them."""
+    message_log.flush()
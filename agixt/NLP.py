@@ -0,0 +1,159 @@
+import logging
+import threading
+import spacy
+from typing import Iterable, Iterator
+from Globals import getenv
+from textacy.extract.keyterms import textrank
+
+logging.basicConfig(
+    level=getenv("LOG_LEVEL"),
+    format=getenv("LOG_FORMAT"),
+)
+
+# Component sets that can be requested from the shared NLP engine.
+# Each profile is loaded at most once per worker and reused after that.
+#   sentences: Sentence boundaries only (senter), cheapest option.
+#   keywords: Sentence boundaries plus POS tags and lemmas for keyword extraction.
+#   full: The full pipeline including the dependency parser and NER.
+NLP_PROFILES = {
+    "sentences": {
+        "exclude": ["tagger", "parser", "attribute_ruler", "lemmatizer", "ner"],
+        "senter": True,
+    },
+    "keywords": {
+        "exclude": ["parser", "ner"],
+        "senter": True,
+    },
+    "full": {
+        "exclude": [],
+        "senter": False,
+    },
+}
+
+_pipelines = {}
+_lock = threading.Lock()
+
+
+def _load_pipeline(model: str, profile: str):
+    config = NLP_PROFILES[profile]
+    try:
+        sp = spacy.load(model, exclude=config["exclude"])
+    except OSError:
+        spacy.cli.download(model)
+        sp = spacy.load(model, exclude=config["exclude"])
+    if config["senter"] and "senter" in sp.disabled:
+        sp.enable_pipe("senter")
+    sp.max_length = 99999999999999999999999
+    logging.info(f"Loaded spaCy model {model} with components: {sp.pipe_names}")
+    return sp
+
+
+def get_nlp(profile: str = ""):
+    """
+    Returns the shared spaCy pipeline for the given profile, loading it on first use.
+
+    Args:
+        profile: One of "sentences", "keywords" or "full". Defaults to the NLP_PROFILE environment variable.
+
+    Returns:
+        spacy.language.Language: The cached pipeline for this worker
+    """
+    if not profile:
+        profile = getenv("NLP_PROFILE")
+    if profile not in NLP_PROFILES:
+        logging.warning(f"Unknown NLP profile {profile}, using keywords.")
+        profile = "keywords"
+    model = getenv("SPACY_MODEL")
+    key = (model, profile)
+    sp = _pipelines.get(key)
+    if sp is None:
+        with _lock:
+            sp = _pipelines.get(key)
+            if sp is None:
+                sp = _load_pipeline(model=model, profile=profile)
+                _pipelines[key] = sp
+    return sp
+
+
+def nlp(text: str, profile: str = ""):
+    return get_nlp(profile=profile)(text)
+
+
+def nlp_pipe(texts: Iterable[str], profile: str = "", batch_size: int = 0) -> Iterator:
+    """
+    Runs many texts through the shared pipeline in batches with `nlp.pipe()`.
+
+    Args:
+        texts: Texts to process
+        profile: Component profile to use
+        batch_size: Number of texts per batch. Defaults to the NLP_BATCH_SIZE environment variable.
+
+    Returns:
+        Iterator: spaCy Doc objects in the same order as the input texts
+    """
+    if not batch_size:
+        batch_size = int(getenv("NLP_BATCH_SIZE"))
+    return get_nlp(profile=profile).pipe(texts, batch_size=batch_size)
+
+
+def iter_text_windows(text: str, window_size: int = 0) -> Iterator[str]:
+    """
+    Splits text into windows of at most `window_size` characters, cutting at the last
+    newline or space in each window where possible.
+    """
+    if not window_size:
+        window_size = int(getenv("NLP_WINDOW_SIZE"))
+    start = 0
+    while start < len(text):
+        end = start + window_size
+        if end < len(text):
+            cut = text.rfind("\n", start, end)
+            if cut <= start:
+                cut = text.rfind(" ", start, end)
+            if cut > start:
+                end = cut + 1
+        yield text[start:end]
+        start = end
+
+
+def iter_sentences(text: str, profile: str = "sentences", window_size: int = 0):
+    """
+    Yields the token texts of each sentence in `text` without parsing it as a single doc.
+    The text is parsed one window at a time and the last sentence of each window is carried
+    into the next one so sentences are not split at window boundaries.
+
+    Args:
+        text: Text to split into sentences
+        profile: Component profile to use
+        window_size: Characters per window. Defaults to the NLP_WINDOW_SIZE environment variable.
+
+    Returns:
+        Iterator[List[str]]: Token texts for each sentence, in order
+    """
+    if not window_size:
+        window_size = int(getenv("NLP_WINDOW_SIZE"))
+    sp = get_nlp(profile=profile)
+    pending = ""
+    windows = iter_text_windows(text=text, window_size=window_size)
+    window = next(windows, None)
+    while window is not None:
+        next_window = next(windows, None)
+        doc = sp(pending + window)
+        sentences = list(doc.sents)
+        pending = ""
+        # Carry the trailing sentence over unless it alone fills a window
+        if next_window is not None and len(sentences) > 1:
+            last_sentence = sentences.pop()
+            pending = doc.text[last_sentence.start_char :]
+            if len(pending) >= window_size:
+                sentences.append(last_sentence)
+                pending = ""
+        for sentence in sentences:
+            yield [token.text for token in sentence]
+        window = next_window
+
+
+def extract_keywords(doc=None, text="", limit=10):
+    if not doc:
+        doc = nlp(text)
+    return [k for k, s in textrank(doc, topn=limit)]
@@ -1,7 +1,75 @@
-from DB import Prompt, PromptCategory, Argument, User, get_session
-from Globals import DEFAULT_USER
+from DB import Prompt, PromptCategory, Argument, get_session, query_only
+from Globals import getenv, DEFAULT_USER
 from MagicalAuth import get_user_id
+from IdentityCache import IdentityCache, get_cached_user_id
+from functools import lru_cache
 import os
+import re
+
+PROMPTS = "prompt"
+# Placeholders like {user_input}, but not {{escaped}} braces or spans across lines
+PLACEHOLDER_PATTERN = re.compile(r"(?<!{){([^{}\n]+)}(?!})")
+
+# Resolved prompt text of this worker and the versions it was resolved from, keyed by
+# (user ID, prompt name, prompt category)
+prompt_registry = IdentityCache(
+    ttl=int(getenv("PROMPT_CACHE_TTL")),
+    max_size=int(getenv("PROMPT_CACHE_SIZE")),
+)
+
+
+class PromptTemplate:
+    """
+    A prompt compiled once into literal text and placeholder segments, so rendering is a
+    join instead of a regex pass over the whole prompt.
+    """
+
+    def __init__(self, text: str):
+        # Alternates literal text and placeholder names, starting and ending with text
+        self.segments = PLACEHOLDER_PATTERN.split(text)
+        self.args = self.parse_args(text)
+
+    @staticmethod
+    def parse_args(text: str):
+        args = []
+        start_index = text.find("{")
+        while start_index != -1:
+            end_index = text.find("}", start_index)
+            if end_index != -1:
+                args.append(text[start_index + 1 : end_index])
+                start_index = text.find("{", end_index)
+            else:
+                break
+        return args
+
+    def render(self, **kwargs) -> str:
+        """
+        Fills in the placeholders. Lists are joined, and placeholders without a value are
+        left as they are.
+        """
+        parts = list(self.segments)
+        for index in range(1, len(parts), 2):
+            key = parts[index]
+            if key not in kwargs:
+                parts[index] = "{" + key + "}"
+                continue
+            value = kwargs[key]
+            if isinstance(value, list):
+                parts[index] = "".join(str(x) for x in value)
+            else:
+                parts[index] = str(value)
+        return "".join(parts)
+
+
+@lru_cache(maxsize=int(getenv("PROMPT_CACHE_SIZE")))
+def get_prompt_template(text: str) -> PromptTemplate:
+    """Returns the compiled template for the prompt text."""
+    return PromptTemplate(text)
+
+
+def invalidate_prompt(*prompt_names):
+    """Drops the resolved text of the named prompts for every user and category."""
+    prompt_registry.invalidate_matching(PROMPTS, lambda key: key[1] in prompt_names)
 
 
 class Prompts:
@@ -49,19 +117,58 @@ class Prompts:
             session.add(argument)
         session.commit()
         session.close()
+        invalidate_prompt(prompt_name)
 
     def get_prompt(self, prompt_name: str, prompt_category: str = "Default"):
+        """
+        Returns the prompt's text from this worker's registry, resolving it on first use from
+        the global Default category, then the user's category, then the user's Default
+        category, then the bundled prompt files. The cached text is reused while the prompts
+        it could resolve from are unchanged, which costs one indexed lookup of their versions,
+        so edits made on any worker are seen on the next call.
+        """
+        key = (str(self.user_id), prompt_name, prompt_category)
+        versions = self.get_prompt_versions(prompt_name)
+        entry = prompt_registry.get(PROMPTS, key)
+        if entry is not None and entry[0] == versions:
+            return entry[1]
+        prompt_content = self.load_prompt(
+            prompt_name=prompt_name, prompt_category=prompt_category
+        )
+        prompt_registry.set(PROMPTS, key, (versions, prompt_content))
+        return prompt_content
+
+    def get_prompt_versions(self, prompt_name: str):
+        """
+        Returns the ID and version of every global and user prompt with the name, which
+        changes whenever one of them is added, edited, renamed or deleted.
+        """
         session = get_session()
-        user_data = session.query(User).filter(User.email == DEFAULT_USER).first()
+        user_ids = [self.user_id, get_cached_user_id(DEFAULT_USER)]
+        versions = frozenset(
+            (str(prompt_id), version)
+            for prompt_id, version in session.query(Prompt.id, Prompt.version)
+            .filter(
+                Prompt.name == prompt_name,
+                Prompt.user_id.in_([user_id for user_id in user_ids if user_id]),
+            )
+            .all()
+        )
+        session.close()
+        return versions
+
+    def load_prompt(self, prompt_name: str, prompt_category: str = "Default"):
+        session = get_session()
+        global_user_id = get_cached_user_id(DEFAULT_USER)
         prompt = (
             session.query(Prompt)
             .filter(
                 Prompt.name == prompt_name,
-                Prompt.user_id == user_data.id,
+                Prompt.user_id == global_user_id,
                 Prompt.prompt_category.has(name="Default"),
             )
             .join(PromptCategory)
-            .filter(PromptCategory.name == "Default", Prompt.user_id == user_data.id)
+            .filter(PromptCategory.name == "Default", Prompt.user_id == global_user_id)
             .first()
         )
         if not prompt:
@@ -100,6 +207,7 @@ class Prompts:
             )
             base_path = os.path.join(os.getcwd(), "prompts")
             if not prompt_file.startswith(base_path):
+                session.close()
                 return None
             if os.path.exists(prompt_file):
                 with open(prompt_file, "r") as f:
@@ -134,16 +242,16 @@ class Prompts:
         if not prompt_category:
             prompt_category = "Default"
         session = get_session()
-        user_data = session.query(User).filter(User.email == DEFAULT_USER).first()
+        global_user_id = get_cached_user_id(DEFAULT_USER)
         global_prompts = (
             session.query(Prompt)
             .filter(
-                Prompt.user_id == user_data.id,
+                Prompt.user_id == global_user_id,
                 Prompt.prompt_category.has(name=prompt_category),
             )
             .join(PromptCategory)
             .filter(
-                PromptCategory.name == prompt_category, Prompt.user_id == user_data.id
+                PromptCategory.name == prompt_category, Prompt.user_id == global_user_id
             )
             .all()
         )
@@ -164,16 +272,7 @@ class Prompts:
         return prompts
 
     def get_prompt_args(self, prompt_text):
-        prompt_args = []
-        start_index = prompt_text.find("{")
-        while start_index != -1:
-            end_index = prompt_text.find("}", start_index)
-            if end_index != -1:
-                prompt_args.append(prompt_text[start_index + 1 : end_index])
-                start_index = prompt_text.find("{", end_index)
-            else:
-                break
-        return prompt_args
+        return list(get_prompt_template(prompt_text).args)
 
     def delete_prompt(self, prompt_name, prompt_category="Default"):
         if not prompt_category:
@@ -192,6 +291,7 @@ class Prompts:
             session.delete(prompt)
             session.commit()
         session.close()
+        invalidate_prompt(prompt_name)
 
     def update_prompt(self, prompt_name, prompt, prompt_category="Default"):
         if not prompt_category:
@@ -226,6 +326,7 @@ class Prompts:
                     session.commit()
                 prompt_obj.prompt_category = prompt_category
             prompt_obj.content = prompt
+            prompt_obj.version = (prompt_obj.version or 0) + 1
             session.commit()
             # Update prompt arguments
             prompt_args = self.get_prompt_args(prompt)
@@ -247,6 +348,7 @@ class Prompts:
                     session.add(argument)
             session.commit()
         session.close()
+        invalidate_prompt(prompt_name)
 
     def rename_prompt(self, prompt_name, new_prompt_name, prompt_category="Default"):
         if not prompt_category:
@@ -267,15 +369,18 @@ class Prompts:
         )
         if prompt:
             prompt.name = new_prompt_name
+            prompt.version = (prompt.version or 0) + 1
             session.commit()
         session.close()
+        invalidate_prompt(prompt_name, new_prompt_name)
 
+    @query_only
     def get_prompt_categories(self):
         session = get_session()
-        user_data = session.query(User).filter(User.email == DEFAULT_USER).first()
+        global_user_id = get_cached_user_id(DEFAULT_USER)
         global_prompt_categories = (
             session.query(PromptCategory)
-            .filter(PromptCategory.user_id == user_data.id)
+            .filter(PromptCategory.user_id == global_user_id)
             .all()
         )
         user_prompt_categories = (
@@ -6,6 +6,11 @@ import os
 import inspect
 import logging
 from Globals import getenv
+from EmbeddingCache import (
+    embedding_cache,
+    get_embedding_endpoint,
+    get_embedding_model_name,
+)
 
 logging.basicConfig(
     level=getenv("LOG_LEVEL"),
@@ -95,6 +100,7 @@ class Providers:
     def __init__(self, name, ApiClient=None, **kwargs):
         if name in DISABLED_PROVIDERS:
             raise AttributeError(f"module {__name__} has no attribute {name}")
+        self.name = name
         try:
             kwargs["ApiClient"] = ApiClient
             module = importlib.import_module(f"providers.{name}")
@@ -111,6 +117,16 @@ class Providers:
     def __getattr__(self, attr):
         return getattr(self.instance, attr)
 
+    def embeddings(self, input):
+        # Query embeddings are cached per (provider, model, endpoint, normalized text)
+        return embedding_cache.get_or_compute(
+            provider=self.name,
+            model=get_embedding_model_name(getattr(self.instance, "embedder", None)),
+            endpoint=get_embedding_endpoint(self.instance),
+            text=input,
+            compute=self.instance.embeddings,
+        )
+
     def install_requirements(self):
         requirements = getattr(self.instance, "requirements", [])
         installed_packages = {pkg.key: pkg.version for pkg in pkg_resources.working_set}
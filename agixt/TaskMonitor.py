@@ -1,7 +1,7 @@
 # TaskMonitor.py
 import asyncio
 import logging
-from DB import get_session, TaskItem
+from DB import get_session, session_scope, TaskItem
 from Task import Task
 from datetime import datetime
 from MagicalAuth import impersonate_user
@@ -38,13 +38,15 @@ class TaskMonitor:
             try:
                 pending_tasks = await self.get_all_pending_tasks()
                 for pending_task in pending_tasks:
-                    # Create task manager with impersonated user context
-                    task_manager = Task(
-                        token=impersonate_user(user_id=pending_task.user_id)
-                    )
                     try:
-                        # Execute single task
-                        await task_manager.execute_pending_tasks()
+                        # Each task runs as one unit of work sharing a database session
+                        with session_scope():
+                            # Create task manager with impersonated user context
+                            task_manager = Task(
+                                token=impersonate_user(user_id=pending_task.user_id)
+                            )
+                            # Execute single task
+                            await task_manager.execute_pending_tasks()
                     except Exception as e:
                         logger.error(
                             f"Error processing task {pending_task.id}: {str(e)}"
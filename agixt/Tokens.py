@@ -0,0 +1,135 @@
+import threading
+import tiktoken
+from collections import OrderedDict
+from functools import lru_cache
+from hashlib import blake2b
+from typing import List
+
+DEFAULT_ENCODING = "cl100k_base"
+# Texts shorter than this are cheaper to encode than to hash and look up.
+MIN_CACHED_LENGTH = 256
+MAX_CACHED_COUNTS = 2048
+# Rough characters per token for English text with cl100k_base / o200k_base.
+APPROXIMATE_CHARS_PER_TOKEN = 4
+
+_counts = OrderedDict()
+_counts_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def get_encoding(encoding_name: str = DEFAULT_ENCODING):
+    return tiktoken.get_encoding(encoding_name)
+
+
+@lru_cache(maxsize=256)
+def get_encoding_name(model: str = "") -> str:
+    """
+    Resolves the tiktoken encoding used by a model family.
+    Unknown and non-OpenAI models fall back to cl100k_base.
+    """
+    if not model:
+        return DEFAULT_ENCODING
+    try:
+        return tiktoken.encoding_for_model(model).name
+    except KeyError:
+        return DEFAULT_ENCODING
+
+
+def approximate_tokens(text: str) -> int:
+    """
+    Estimates the token count without encoding. Good enough for size gating.
+    """
+    if not text:
+        return 0
+    return -(-len(text) // APPROXIMATE_CHARS_PER_TOKEN)
+
+
+def _cache_key(encoding_name: str, text: str):
+    return (encoding_name, len(text), blake2b(text.encode(), digest_size=16).digest())
+
+
+def _get_cached(key):
+    with _counts_lock:
+        count = _counts.get(key)
+        if count is not None:
+            _counts.move_to_end(key)
+        return count
+
+
+def _set_cached(key, count: int):
+    with _counts_lock:
+        _counts[key] = count
+        _counts.move_to_end(key)
+        while len(_counts) > MAX_CACHED_COUNTS:
+            _counts.popitem(last=False)
+
+
+def count_tokens(text: str, model: str = "", approximate: bool = False) -> int:
+    """
+    Counts tokens in a string.
+
+    Args:
+        text: Text to count tokens for
+        model: Model name used to pick the encoding. Defaults to cl100k_base.
+        approximate: Estimate from the character count instead of encoding
+
+    Returns:
+        int: Number of tokens
+    """
+    if not text:
+        return 0
+    text = str(text)
+    if approximate:
+        return approximate_tokens(text)
+    encoding_name = get_encoding_name(model)
+    if len(text) < MIN_CACHED_LENGTH:
+        return len(get_encoding(encoding_name).encode(text, disallowed_special=()))
+    key = _cache_key(encoding_name, text)
+    count = _get_cached(key)
+    if count is None:
+        count = len(get_encoding(encoding_name).encode(text, disallowed_special=()))
+        _set_cached(key, count)
+    return count
+
+
+def count_tokens_batch(
+    texts: List[str], model: str = "", approximate: bool = False
+) -> List[int]:
+    """
+    Counts tokens for many strings at once, encoding cache misses in a single batch.
+
+    Args:
+        texts: Texts to count tokens for
+        model: Model name used to pick the encoding. Defaults to cl100k_base.
+        approximate: Estimate from the character count instead of encoding
+
+    Returns:
+        List[int]: Number of tokens for each text, in order
+    """
+    texts = ["" if text is None else str(text) for text in texts]
+    if approximate:
+        return [approximate_tokens(text) for text in texts]
+    encoding_name = get_encoding_name(model)
+    counts = [0] * len(texts)
+    keys = {}
+    missing = []
+    for index, text in enumerate(texts):
+        if not text:
+            continue
+        if len(text) >= MIN_CACHED_LENGTH:
+            key = _cache_key(encoding_name, text)
+            count = _get_cached(key)
+            if count is not None:
+                counts[index] = count
+                continue
+            keys[index] = key
+        missing.append(index)
+    if missing:
+        encoded = get_encoding(encoding_name).encode_batch(
+            [texts[index] for index in missing], disallowed_special=()
+        )
+        for index, tokens in zip(missing, encoded):
+            counts[index] = len(tokens)
+            if index in keys:
+                _set_cached(keys[index], counts[index])
+    return counts
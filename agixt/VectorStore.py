@@ -0,0 +1,769 @@
+import os
+import json
+import sqlite3
+import logging
+import threading
+import numpy as np
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import List
+from Globals import getenv
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+logging.basicConfig(
+    level=getenv("LOG_LEVEL"),
+    format=getenv("LOG_FORMAT"),
+)
+
+# Rows scored per matrix multiplication in a flat scan.
+SCAN_BLOCK_ROWS = 65536
+# Number of IDs per IN clause in SQLite queries.
+SQL_BATCH_SIZE = 500
+
+
+class VectorStore(ABC):
+    """
+    Base class for vector store engines used by Memories.
+
+    Collections returned by an engine follow the subset of the Chroma collection API that
+    Memories uses: add, get, query, delete, count and metadata.
+    """
+
+    @abstractmethod
+    def list_collections(self) -> List[str]:
+        pass
+
+    @abstractmethod
+    def get_or_create_collection(self, name: str, embedding_function=None):
+        pass
+
+    @abstractmethod
+    def delete_collection(self, name: str):
+        pass
+
+
+def get_chroma_client():
+    """
+    To use an external Chroma server, set the following environment variables:
+        CHROMA_HOST: The host of the Chroma server
+        CHROMA_PORT: The port of the Chroma server
+        CHROMA_API_KEY: The API key of the Chroma server
+        CHROMA_SSL: Set to "true" if the Chroma server uses SSL
+    """
+    import chromadb
+    from chromadb.config import Settings
+
+    chroma_host = getenv("CHROMA_HOST")
+    chroma_settings = Settings(
+        anonymized_telemetry=False,
+    )
+    if chroma_host:
+        # Use external Chroma server
+        try:
+            chroma_api_key = getenv("CHROMA_API_KEY")
+            chroma_headers = (
+                {"Authorization": f"Bearer {chroma_api_key}"} if chroma_api_key else {}
+            )
+            return chromadb.HttpClient(
+                host=chroma_host,
+                port=getenv("CHROMA_PORT"),
+                ssl=(False if getenv("CHROMA_SSL").lower() != "true" else True),
+                headers=chroma_headers,
+                settings=chroma_settings,
+            )
+        except:
+            # If the external Chroma server is not available, use local memories folder
+            logging.warning(
+                f"Chroma server at {chroma_host} is not available. Using local memories folder."
+            )
+    # Persist to local memories folder
+    memories_dir = os.path.join(os.getcwd(), "memories")
+    if not os.path.exists(memories_dir):
+        os.makedirs(memories_dir)
+    return chromadb.PersistentClient(
+        path=memories_dir,
+        settings=chroma_settings,
+    )
+
+
+class ChromaVectorStore(VectorStore):
+    def __init__(self, client=None):
+        self.client = client if client else get_chroma_client()
+
+    def list_collections(self) -> List[str]:
+        # Chroma returns collection objects before 0.6 and names after
+        return [
+            collection if isinstance(collection, str) else collection.name
+            for collection in self.client.list_collections()
+        ]
+
+    def get_or_create_collection(self, name: str, embedding_function=None):
+        try:
+            return self.client.get_or_create_collection(
+                name=name, embedding_function=embedding_function
+            )
+        except Exception as e:
+            logging.warning(f"Error275 {e} getting collection: {name}")
+            return self.client.create_collection(
+                name=name,
+                embedding_function=embedding_function,
+                get_or_create=True,
+            )
+
+    def delete_collection(self, name: str):
+        self.client.delete_collection(name=name)
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, highest first."""
+    if k <= 0 or len(scores) == 0:
+        return np.zeros(0, dtype=np.int64)
+    if k < len(scores):
+        indices = np.argpartition(-scores, k - 1)[:k]
+    else:
+        indices = np.arange(len(scores))
+    return indices[np.argsort(-scores[indices], kind="stable")]
+
+
+class IVFIndex:
+    """
+    Inverted file index over a row matrix. Rows are clustered with spherical k-means and a
+    search only scores rows in the `nprobe` clusters closest to the query.
+    """
+
+    def __init__(self, centroids: np.ndarray, assignments: np.ndarray):
+        self.centroids = centroids
+        self.assignments = assignments
+        self.order = np.argsort(assignments, kind="stable")
+        self.offsets = np.searchsorted(
+            assignments[self.order], np.arange(len(centroids) + 1)
+        )
+
+    @property
+    def rows(self) -> int:
+        return len(self.assignments)
+
+    @classmethod
+    def build(cls, matrix: np.ndarray, iterations: int = 10, seed: int = 0):
+        rows = len(matrix)
+        lists = int(min(4096, max(1, np.sqrt(rows))))
+        rng = np.random.default_rng(seed)
+        sample = matrix[
+            np.sort(rng.choice(rows, size=min(rows, lists * 64), replace=False))
+        ]
+        centroids = sample[rng.choice(len(sample), size=lists, replace=False)].copy()
+        for _ in range(iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            empty = np.bincount(labels, minlength=lists) == 0
+            sums[empty] = centroids[empty]
+            centroids = normalize_rows(sums)
+        return cls(centroids=centroids, assignments=cls.assign(centroids, matrix))
+
+    @staticmethod
+    def assign(centroids: np.ndarray, matrix: np.ndarray) -> np.ndarray:
+        assignments = np.empty(len(matrix), dtype=np.int32)
+        for start in range(0, len(matrix), SCAN_BLOCK_ROWS):
+            block = np.asarray(matrix[start : start + SCAN_BLOCK_ROWS])
+            assignments[start : start + len(block)] = np.argmax(
+                block @ centroids.T, axis=1
+            )
+        return assignments
+
+    def candidates(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        lists = top_k(self.centroids @ query, min(nprobe, len(self.centroids)))
+        return np.concatenate(
+            [self.order[self.offsets[c] : self.offsets[c + 1]] for c in lists]
+        )
+
+    def save(self, path: str, generation: int):
+        np.savez(
+            path,
+            centroids=self.centroids,
+            assignments=self.assignments,
+            generation=generation,
+        )
+
+    @classmethod
+    def load(cls, path: str, generation: int):
+        if not os.path.exists(path):
+            return None
+        data = np.load(path)
+        if int(data["generation"]) != generation:
+            return None
+        return cls(centroids=data["centroids"], assignments=data["assignments"])
+
+
+class HNSWIndex:
+    """
+    Graph index backed by hnswlib, labels are matrix row numbers. It is saved next to the
+    matrix, one file per collection generation, so other workers and restarts load the graph
+    and only add the rows appended since instead of building it again.
+    """
+
+    def __init__(self, index, rows: int):
+        self.index = index
+        self.rows = rows
+        # Rows covered by the saved copy of the graph
+        self.saved_rows = 0
+
+    @staticmethod
+    def get_path(directory: str, generation: int) -> str:
+        return os.path.join(directory, f"hnsw-{generation}.bin")
+
+    @classmethod
+    def build(cls, matrix: np.ndarray, live: np.ndarray):
+        index = hnswlib.Index(space="ip", dim=matrix.shape[1])
+        index.init_index(
+            max_elements=max(1024, len(matrix) * 2),
+            ef_construction=int(getenv("VECTOR_HNSW_EF_CONSTRUCTION")),
+            M=int(getenv("VECTOR_HNSW_M")),
+        )
+        hnsw_index = cls(index=index, rows=0)
+        hnsw_index.add(matrix=matrix, live=live)
+        return hnsw_index
+
+    def add(self, matrix: np.ndarray, live: np.ndarray):
+        if len(matrix) > self.index.get_max_elements():
+            self.index.resize_index(len(matrix) * 2)
+        for start in range(self.rows, len(matrix), SCAN_BLOCK_ROWS):
+            end = min(start + SCAN_BLOCK_ROWS, len(matrix))
+            labels = np.flatnonzero(live[start:end]) + start
+            if len(labels):
+                self.index.add_items(np.asarray(matrix[labels]), labels)
+        self.rows = len(matrix)
+
+    def save(self, directory: str, generation: int):
+        path = self.get_path(directory=directory, generation=generation)
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        self.index.save_index(temporary_path)
+        os.replace(temporary_path, path)
+        self.saved_rows = self.rows
+        # Row numbers of older generations no longer match the matrix
+        for name in os.listdir(directory):
+            if name.startswith("hnsw-") and name.endswith(".bin"):
+                if os.path.join(directory, name) != path:
+                    try:
+                        os.remove(os.path.join(directory, name))
+                    except OSError:
+                        pass
+
+    @classmethod
+    def load(cls, directory: str, generation: int, dimension: int):
+        path = cls.get_path(directory=directory, generation=generation)
+        if not os.path.exists(path):
+            return None
+        index = hnswlib.Index(space="ip", dim=dimension)
+        index.load_index(path)
+        labels = index.get_ids_list()
+        # Rows are append-only within a generation, so every row after the highest label
+        # was either appended since or deleted before the graph was saved
+        hnsw_index = cls(index=index, rows=int(max(labels)) + 1 if labels else 0)
+        hnsw_index.saved_rows = hnsw_index.rows
+        return hnsw_index
+
+    def mark_deleted(self, rows: List[int]):
+        for row in rows:
+            if row < self.rows:
+                try:
+                    self.index.mark_deleted(int(row))
+                except RuntimeError:
+                    pass
+
+    def candidates(self, query: np.ndarray, k: int) -> np.ndarray:
+        k = min(k, self.index.get_current_count())
+        if k <= 0:
+            return np.zeros(0, dtype=np.int64)
+        self.index.set_ef(max(k, int(getenv("VECTOR_HNSW_EF"))))
+        try:
+            labels, _ = self.index.knn_query(query, k=k)
+        except RuntimeError:
+            # Fewer live elements than k after deletions
+            return np.zeros(0, dtype=np.int64)
+        return labels[0].astype(np.int64)
+
+
+class LocalVectorCollection:
+    """
+    In-process collection. Embeddings are L2-normalized and appended to a memory-mapped
+    float32 matrix (vectors.f32), and IDs, documents and metadata are kept in SQLite
+    (records.db), keyed by matrix row. Deleted rows are tombstoned and compacted away once
+    they outnumber the live ones.
+
+    Search is an exact blockwise scan by default. With index_type "ivf" or "hnsw" an
+    approximate index is built once the collection reaches `index_min_rows` rows.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        path: str,
+        embedding_function=None,
+        index_type: str = "flat",
+        index_min_rows: int = 50000,
+    ):
+        self.name = name
+        self.path = path
+        self.embedding_function = embedding_function
+        if index_type == "hnsw" and hnswlib is None:
+            logging.warning("hnswlib is not installed, using the IVF index instead.")
+            index_type = "ivf"
+        self.index_type = index_type
+        self.index_min_rows = index_min_rows
+        self.metadata = {"hnsw:space": "cosine"}
+        os.makedirs(path, exist_ok=True)
+        self.vectors_path = os.path.join(path, "vectors.f32")
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(
+            os.path.join(path, "records.db"), check_same_thread=False
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS records (row INTEGER PRIMARY KEY, id TEXT UNIQUE NOT NULL, document TEXT, metadata TEXT)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)"
+        )
+        self.conn.commit()
+        self.matrix = None
+        self.live = np.zeros(0, dtype=bool)
+        self.data_version = None
+        self.generation = None
+        self.dimension = None
+        self.index = None
+        self.nprobe = int(getenv("VECTOR_IVF_NPROBE"))
+
+    def _get_setting(self, key: str):
+        row = self.conn.execute(
+            "SELECT value FROM settings WHERE key = ?", (key,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _set_setting(self, key: str, value):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+            (key, str(value)),
+        )
+
+    @contextmanager
+    def _write_lock(self):
+        with self.lock:
+            lock_file = open(os.path.join(self.path, ".lock"), "a")
+            try:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                self._refresh()
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+                lock_file.close()
+
+    def _refresh(self):
+        """Reloads the row mask and matrix if another process changed the collection."""
+        data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version == self.data_version and self.matrix is not None:
+            return
+        self.data_version = data_version
+        dimension = self._get_setting("dimension")
+        self.dimension = int(dimension) if dimension else None
+        generation = int(self._get_setting("generation") or 0)
+        if generation != self.generation:
+            self.generation = generation
+            self.index = None
+        self._remap()
+        live = np.zeros(self.rows, dtype=bool)
+        rows = np.array(
+            [row[0] for row in self.conn.execute("SELECT row FROM records")],
+            dtype=np.int64,
+        )
+        live[rows[rows < self.rows]] = True
+        self.live = live
+
+    def _remap(self):
+        if not self.dimension or not os.path.exists(self.vectors_path):
+            self.matrix = np.zeros((0, self.dimension or 0), dtype=np.float32)
+            return
+        rows = os.path.getsize(self.vectors_path) // (self.dimension * 4)
+        if rows == 0:
+            self.matrix = np.zeros((0, self.dimension), dtype=np.float32)
+            return
+        self.matrix = np.memmap(
+            self.vectors_path, dtype=np.float32, mode="r", shape=(rows, self.dimension)
+        )
+
+    @property
+    def rows(self) -> int:
+        return 0 if self.matrix is None else len(self.matrix)
+
+    def count(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+    def add(self, ids, embeddings=None, metadatas=None, documents=None):
+        if isinstance(ids, str):
+            ids = [ids]
+        if embeddings is None:
+            embeddings = self.embedding_function(documents)
+        vectors = normalize_rows(np.asarray(embeddings, dtype=np.float32))
+        metadatas = metadatas if metadatas else [None] * len(ids)
+        documents = documents if documents else [None] * len(ids)
+        with self._write_lock():
+            # Existing IDs are ignored, the same as Chroma's add
+            existing = set()
+            for start in range(0, len(ids), SQL_BATCH_SIZE):
+                batch = ids[start : start + SQL_BATCH_SIZE]
+                existing.update(
+                    row[0]
+                    for row in self.conn.execute(
+                        f"SELECT id FROM records WHERE id IN ({','.join('?' * len(batch))})",
+                        batch,
+                    )
+                )
+            keep = []
+            for i, id in enumerate(ids):
+                if id not in existing:
+                    existing.add(id)
+                    keep.append(i)
+            if not keep:
+                return
+            if self.dimension is None:
+                self.dimension = vectors.shape[1]
+                self._set_setting("dimension", self.dimension)
+            elif vectors.shape[1] != self.dimension:
+                raise ValueError(
+                    f"Embedding dimension {vectors.shape[1]} does not match collection dimension {self.dimension}"
+                )
+            start_row = (
+                os.path.getsize(self.vectors_path) // (self.dimension * 4)
+                if os.path.exists(self.vectors_path)
+                else 0
+            )
+            # Vectors are written before their records so readers never see a record without a row
+            with open(self.vectors_path, "ab") as f:
+                f.write(np.ascontiguousarray(vectors[keep]).tobytes())
+            self.conn.executemany(
+                "INSERT INTO records (row, id, document, metadata) VALUES (?, ?, ?, ?)",
+                [
+                    (
+                        start_row + offset,
+                        ids[i],
+                        documents[i],
+                        json.dumps(metadatas[i]) if metadatas[i] is not None else None,
+                    )
+                    for offset, i in enumerate(keep)
+                ],
+            )
+            self.conn.commit()
+            self._remap()
+            live = np.zeros(self.rows, dtype=bool)
+            live[: len(self.live)] = self.live
+            live[start_row : start_row + len(keep)] = True
+            self.live = live
+
+    def _where_clause(self, ids=None, where=None):
+        clauses = []
+        params = []
+        if ids is not None:
+            if isinstance(ids, str):
+                ids = [ids]
+            clauses.append(f"id IN ({','.join('?' * len(ids))})")
+            params.extend(ids)
+        for key, value in (where or {}).items():
+            clauses.append("json_extract(metadata, ?) = ?")
+            params.extend([f'$."{key}"', value])
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def get(self, ids=None, where=None, include=["metadatas", "documents"]):
+        with self.lock:
+            self._refresh()
+            clause, params = self._where_clause(ids=ids, where=where)
+            rows = self.conn.execute(
+                f"SELECT row, id, document, metadata FROM records{clause} ORDER BY row",
+                params,
+            ).fetchall()
+            results = {"ids": [row[1] for row in rows]}
+            if "documents" in include:
+                results["documents"] = [row[2] for row in rows]
+            if "metadatas" in include:
+                results["metadatas"] = [
+                    json.loads(row[3]) if row[3] else None for row in rows
+                ]
+            if "embeddings" in include:
+                results["embeddings"] = [
+                    np.asarray(self.matrix[row[0]]) for row in rows
+                ]
+            return results
+
+    def delete(self, ids=None, where=None):
+        if ids is None and where is None:
+            return
+        with self._write_lock():
+            clause, params = self._where_clause(ids=ids, where=where)
+            rows = [
+                row[0]
+                for row in self.conn.execute(
+                    f"SELECT row FROM records{clause}", params
+                ).fetchall()
+            ]
+            if not rows:
+                return
+            for start in range(0, len(rows), SQL_BATCH_SIZE):
+                batch = rows[start : start + SQL_BATCH_SIZE]
+                self.conn.execute(
+                    f"DELETE FROM records WHERE row IN ({','.join('?' * len(batch))})",
+                    batch,
+                )
+            self.conn.commit()
+            rows = np.array(rows, dtype=np.int64)
+            self.live[rows[rows < len(self.live)]] = False
+            if isinstance(self.index, HNSWIndex):
+                self.index.mark_deleted(rows.tolist())
+            live_rows = int(self.live.sum())
+            if self.rows - live_rows > max(1000, live_rows):
+                self._compact()
+
+    def _compact(self):
+        """Rewrites the matrix without tombstoned rows. Called with the write lock held."""
+        live_rows = np.flatnonzero(self.live)
+        temp_path = f"{self.vectors_path}.tmp"
+        with open(temp_path, "wb") as f:
+            for start in range(0, len(live_rows), SCAN_BLOCK_ROWS):
+                block = live_rows[start : start + SCAN_BLOCK_ROWS]
+                f.write(np.ascontiguousarray(self.matrix[block]).tobytes())
+        # Rows only move down, so renumbering in ascending order never collides
+        self.conn.executemany(
+            "UPDATE records SET row = ? WHERE row = ?",
+            [(new_row, int(old_row)) for new_row, old_row in enumerate(live_rows)],
+        )
+        self.generation = (self.generation or 0) + 1
+        self._set_setting("generation", self.generation)
+        self.matrix = None
+        os.replace(temp_path, self.vectors_path)
+        self.conn.commit()
+        self.index = None
+        self._remap()
+        self.live = np.ones(self.rows, dtype=bool)
+        logging.info(
+            f"Compacted vector collection {self.name} to {len(live_rows)} rows."
+        )
+
+    def _get_index(self):
+        if self.index_type == "flat" or int(self.live.sum()) < self.index_min_rows:
+            return None
+        if self.index is None:
+            if self.index_type == "ivf":
+                index_path = os.path.join(self.path, "ivf.npz")
+                self.index = IVFIndex.load(path=index_path, generation=self.generation)
+                if self.index is None or self.index.rows > self.rows:
+                    self.index = IVFIndex.build(self.matrix)
+                    self.index.save(path=index_path, generation=self.generation)
+            else:
+                self.index = HNSWIndex.load(
+                    directory=self.path,
+                    generation=self.generation,
+                    dimension=self.dimension,
+                )
+                if self.index is None or self.index.rows > self.rows:
+                    self.index = HNSWIndex.build(matrix=self.matrix, live=self.live)
+                    self.index.save(directory=self.path, generation=self.generation)
+                else:
+                    # Rows deleted since the graph was saved
+                    self.index.mark_deleted(
+                        np.flatnonzero(~self.live[: self.index.rows]).tolist()
+                    )
+            logging.info(
+                f"Built {self.index_type} index for vector collection {self.name} with {self.rows} rows."
+            )
+        if isinstance(self.index, HNSWIndex) and self.index.rows < self.rows:
+            self.index.add(matrix=self.matrix, live=self.live)
+            if self.rows - self.index.saved_rows > max(
+                SCAN_BLOCK_ROWS, self.index.saved_rows // 10
+            ):
+                self.index.save(directory=self.path, generation=self.generation)
+        elif isinstance(self.index, IVFIndex) and self.rows - self.index.rows > max(
+            SCAN_BLOCK_ROWS, self.index.rows // 10
+        ):
+            # Re-sort the inverted lists once the unindexed tail gets large
+            assignments = np.concatenate(
+                [
+                    self.index.assignments,
+                    IVFIndex.assign(
+                        self.index.centroids, self.matrix[self.index.rows :]
+                    ),
+                ]
+            )
+            self.index = IVFIndex(
+                centroids=self.index.centroids, assignments=assignments
+            )
+        return self.index
+
+    def _scan(self, query: np.ndarray, rows: np.ndarray, k: int):
+        scores = np.asarray(self.matrix[rows]) @ query
+        best = top_k(scores, k)
+        return rows[best], scores[best]
+
+    def _search(self, query: np.ndarray, k: int):
+        index = self._get_index()
+        if index is None:
+            best_rows = np.zeros(0, dtype=np.int64)
+            best_scores = np.zeros(0, dtype=np.float32)
+            for start in range(0, self.rows, SCAN_BLOCK_ROWS):
+                block_rows = np.flatnonzero(self.live[start : start + SCAN_BLOCK_ROWS])
+                if not len(block_rows):
+                    continue
+                rows, scores = self._scan(query, block_rows + start, k)
+                best_rows = np.concatenate([best_rows, rows])
+                best_scores = np.concatenate([best_scores, scores])
+                best = top_k(best_scores, k)
+                best_rows, best_scores = best_rows[best], best_scores[best]
+            return best_rows, best_scores
+        if isinstance(index, IVFIndex):
+            candidates = index.candidates(query, self.nprobe)
+        else:
+            candidates = index.candidates(query, k + 16)
+        # Rows appended since the index was built are scanned exactly
+        candidates = np.concatenate([candidates, np.arange(index.rows, self.rows)])
+        candidates = candidates[self.live[candidates]]
+        return self._scan(query, candidates, k)
+
+    def query(self, query_embeddings, n_results: int = 10, include=None, **kwargs):
+        if include is None:
+            include = ["metadatas", "documents", "distances"]
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        if queries.ndim == 1:
+            queries = queries[None, :]
+        queries = normalize_rows(queries)
+        results = {"ids": []}
+        for key in ["documents", "metadatas", "distances", "embeddings"]:
+            if key in include:
+                results[key] = []
+        with self.lock:
+            self._refresh()
+            for query in queries:
+                if self.rows == 0:
+                    rows, scores = np.zeros(0, dtype=np.int64), np.zeros(0)
+                else:
+                    rows, scores = self._search(query, n_results)
+                records = {}
+                rows_list = [int(row) for row in rows]
+                for start in range(0, len(rows_list), SQL_BATCH_SIZE):
+                    batch = rows_list[start : start + SQL_BATCH_SIZE]
+                    for row in self.conn.execute(
+                        f"SELECT row, id, document, metadata FROM records WHERE row IN ({','.join('?' * len(batch))})",
+                        batch,
+                    ):
+                        records[row[0]] = row
+                found = [
+                    (row, score)
+                    for row, score in zip(rows_list, scores)
+                    if row in records
+                ]
+                results["ids"].append([records[row][1] for row, _ in found])
+                if "documents" in results:
+                    results["documents"].append([records[row][2] for row, _ in found])
+                if "metadatas" in results:
+                    results["metadatas"].append(
+                        [
+                            json.loads(records[row][3]) if records[row][3] else None
+                            for row, _ in found
+                        ]
+                    )
+                if "distances" in results:
+                    # Cosine distance, the same scale Chroma uses for "hnsw:space": "cosine"
+                    results["distances"].append(
+                        [float(1.0 - score) for _, score in found]
+                    )
+                if "embeddings" in results:
+                    results["embeddings"].append(
+                        [np.asarray(self.matrix[row]) for row, _ in found]
+                    )
+        return results
+
+
+class LocalVectorStore(VectorStore):
+    def __init__(self, path: str = "", index_type: str = "", index_min_rows: int = 0):
+        # Outside Chroma's memories directory, so neither engine sees the other's files
+        self.path = path if path else getenv("VECTOR_STORE_PATH")
+        self.index_type = index_type if index_type else getenv("VECTOR_INDEX").lower()
+        self.index_min_rows = (
+            index_min_rows if index_min_rows else int(getenv("VECTOR_INDEX_MIN_ROWS"))
+        )
+        os.makedirs(self.path, exist_ok=True)
+        self.collections = {}
+        self.lock = threading.Lock()
+
+    def list_collections(self) -> List[str]:
+        return [
+            name
+            for name in os.listdir(self.path)
+            if os.path.exists(os.path.join(self.path, name, "records.db"))
+        ]
+
+    def get_or_create_collection(self, name: str, embedding_function=None):
+        with self.lock:
+            collection = self.collections.get(name)
+            if collection is None:
+                collection = LocalVectorCollection(
+                    name=name,
+                    path=os.path.join(self.path, name),
+                    embedding_function=embedding_function,
+                    index_type=self.index_type,
+                    index_min_rows=self.index_min_rows,
+                )
+                self.collections[name] = collection
+            elif embedding_function is not None:
+                collection.embedding_function = embedding_function
+            return collection
+
+    def delete_collection(self, name: str):
+        import shutil
+
+        with self.lock:
+            collection = self.collections.pop(name, None)
+            if collection:
+                with collection.lock:
+                    collection.conn.close()
+            collection_path = os.path.join(self.path, name)
+            if not os.path.exists(collection_path):
+                raise ValueError(f"Collection {name} does not exist")
+            shutil.rmtree(collection_path)
+
+
+_local_stores = {}
+_local_stores_lock = threading.Lock()
+
+
+def get_vector_store(engine: str = "") -> VectorStore:
+    """
+    Returns the vector store engine configured for this deployment.
+
+    Args:
+        engine: "chroma" or "local". Defaults to the VECTOR_STORE environment variable.
+
+    Returns:
+        VectorStore: The Chroma client wrapper, or the in-process store shared by this worker
+    """
+    if not engine:
+        engine = getenv("VECTOR_STORE").lower()
+    if engine == "local":
+        with _local_stores_lock:
+            store = _local_stores.get(engine)
+            if store is None:
+                store = LocalVectorStore()
+                _local_stores[engine] = store
+            return store
+    return ChromaVectorStore()
@@ -0,0 +1,121 @@
+"""
+Compares vector store engines on recall and query latency with synthetic embeddings.
+
+Usage:
+    python VectorStoreBenchmark.py --rows 100000 --dimension 384 --queries 200 --k 10
+
+Recall@k is measured against the exact results of the local flat engine. Engines whose
+dependencies are not installed (hnswlib, chromadb) are skipped.
+"""
+
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+from VectorStore import (
+    ChromaVectorStore,
+    LocalVectorStore,
+    hnswlib,
+)
+
+
+def make_embeddings(rows: int, dimension: int, clusters: int, seed: int = 0):
+    # Clustered data, closer to real embeddings than uniform noise
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dimension)).astype(np.float32)
+    labels = rng.integers(0, clusters, size=rows)
+    noise = rng.normal(scale=0.5, size=(rows, dimension)).astype(np.float32)
+    return centers[labels] + noise
+
+
+def load_collection(collection, embeddings: np.ndarray, batch_size: int = 5000):
+    start = time.perf_counter()
+    for i in range(0, len(embeddings), batch_size):
+        batch = embeddings[i : i + batch_size]
+        ids = [str(j) for j in range(i, i + len(batch))]
+        collection.add(
+            ids=ids,
+            embeddings=batch.tolist(),
+            metadatas=[{"id": id} for id in ids],
+            documents=ids,
+        )
+    return time.perf_counter() - start
+
+
+def run_queries(collection, queries: np.ndarray, k: int):
+    results = []
+    latencies = []
+    # The first query builds any approximate index, so it is timed separately
+    start = time.perf_counter()
+    collection.query(query_embeddings=queries[0].tolist(), n_results=k)
+    warmup = time.perf_counter() - start
+    for query in queries:
+        start = time.perf_counter()
+        response = collection.query(query_embeddings=query.tolist(), n_results=k)
+        latencies.append(time.perf_counter() - start)
+        results.append(set(response["ids"][0]))
+    return results, np.array(latencies) * 1000, warmup
+
+
+def benchmark(rows: int, dimension: int, queries: int, k: int, clusters: int):
+    embeddings = make_embeddings(rows=rows, dimension=dimension, clusters=clusters)
+    query_vectors = make_embeddings(
+        rows=queries, dimension=dimension, clusters=clusters, seed=1
+    )
+    engines = [("local-flat", "flat"), ("local-ivf", "ivf")]
+    if hnswlib is not None:
+        engines.append(("local-hnsw", "hnsw"))
+    try:
+        import chromadb
+
+        engines.append(("chroma", "chroma"))
+    except ImportError:
+        pass
+    ground_truth = None
+    print(f"{rows} rows, {dimension} dimensions, {queries} queries, k={k}")
+    print(
+        f"{'engine':<12} {'load s':>8} {'first q s':>10} {'p50 ms':>8} {'p95 ms':>8} {'recall':>8}"
+    )
+    for name, index_type in engines:
+        path = tempfile.mkdtemp()
+        try:
+            if index_type == "chroma":
+                store = ChromaVectorStore(client=chromadb.PersistentClient(path=path))
+                collection = store.client.get_or_create_collection(
+                    name="benchmark", metadata={"hnsw:space": "cosine"}
+                )
+            else:
+                store = LocalVectorStore(
+                    path=path, index_type=index_type, index_min_rows=1
+                )
+                collection = store.get_or_create_collection(name="benchmark")
+            load_time = load_collection(collection, embeddings)
+            results, latencies, warmup = run_queries(collection, query_vectors, k)
+            if ground_truth is None:
+                ground_truth = results
+            recall = np.mean(
+                [len(found & truth) / k for found, truth in zip(results, ground_truth)]
+            )
+            print(
+                f"{name:<12} {load_time:>8.2f} {warmup:>10.2f} {np.percentile(latencies, 50):>8.2f} {np.percentile(latencies, 95):>8.2f} {recall:>8.3f}"
+            )
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--clusters", type=int, default=256)
+    args = parser.parse_args()
+    benchmark(
+        rows=args.rows,
+        dimension=args.dimension,
+        queries=args.queries,
+        k=args.k,
+        clusters=args.clusters,
+    )
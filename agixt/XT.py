@@ -1,9 +1,10 @@
 from Interactions import Interactions
-from ApiClient import get_api_client, Conversations, Prompts, Chain
+from ApiClient import get_api_client, get_agent, Conversations, Prompts, Chain
 from readers.file import FileReader
 from Extensions import Extensions
 from pydub import AudioSegment
 from Globals import getenv, get_tokens, DEFAULT_SETTINGS
+from Tokens import count_tokens_batch
 from Models import ChatCompletions, TasksToDo, ChainCommandName, TranslationRequest
 from datetime import datetime
 from typing import (
@@ -15,6 +16,7 @@ from typing import (
     get_type_hints,
 )
 from MagicalAuth import MagicalAuth
+from DB import run_db
 from enum import Enum
 from pydantic import BaseModel
 import pdfplumber
@@ -77,6 +79,12 @@ class AGiXT:
             user=self.user_email,
             ApiClient=self.ApiClient,
             collection_id=self.collection_id,
+            agent=get_agent(
+                agent_name=self.agent_name,
+                user=self.user_email,
+                ApiClient=self.ApiClient,
+                api_key=api_key,
+            ),
         )
         self.agent = self.agent_interactions.agent
         self.agent_settings = (
@@ -1846,8 +1854,10 @@ class AGiXT:
                     message=response,
                 )
         try:
-            prompt_tokens = get_tokens(new_prompt) + self.input_tokens
-            completion_tokens = get_tokens(response)
+            prompt_tokens, completion_tokens = count_tokens_batch(
+                [new_prompt, response]
+            )
+            prompt_tokens += self.input_tokens
             total_tokens = int(prompt_tokens) + int(completion_tokens)
             logging.info(f"Input tokens: {prompt_tokens}")
             logging.info(f"Completion tokens: {completion_tokens}")
@@ -1857,7 +1867,8 @@ class AGiXT:
                 response = "Unable to retrieve response."
                 logging.error(f"Error getting response: {response}")
         try:
-            self.auth.increase_token_counts(
+            await run_db(
+                self.auth.increase_token_counts,
                 input_tokens=prompt_tokens,
                 output_tokens=completion_tokens,
             )
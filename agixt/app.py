@@ -14,6 +14,7 @@ from endpoints.Prompt import app as prompt_endpoints
 from endpoints.Provider import app as provider_endpoints
 from endpoints.Auth import app as auth_endpoints
 from Globals import getenv
+from DB import session_scope
 
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
@@ -33,6 +34,24 @@ app = FastAPI(
     docs_url="/",
 )
 
+
+class DatabaseSessionMiddleware:
+    """
+    Runs each HTTP request as one database unit of work so the DB calls it makes share a
+    session. Implemented as plain ASGI so the endpoint runs in the same context.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        with session_scope():
+            await self.app(scope, receive, send)
+
+
+app.add_middleware(DatabaseSessionMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -3,12 +3,14 @@ from fastapi import APIRouter, HTTPException, Depends, Header
 from XT import AGiXT
 from Websearch import Websearch
 from Globals import getenv, get_default_agent, get_agixt_training_urls
+from DB import run_db
 from ApiClient import (
     Agent,
     add_agent,
     delete_agent,
     rename_agent,
     get_agents,
+    get_agent_config,
     verify_api_key,
     get_api_client,
     is_admin,
@@ -199,7 +201,7 @@ async def deleteagent(
 
 @app.get("/api/agent", tags=["Agent"], dependencies=[Depends(verify_api_key)])
 async def getagents(user=Depends(verify_api_key), authorization: str = Header(None)):
-    agents = get_agents(user=user)
+    agents = await run_db(get_agents, user=user)
     create_agent = str(getenv("CREATE_AGENT_ON_REGISTER")).lower() == "true"
     if create_agent:
         agent_list = [agent["name"] for agent in agents]
@@ -234,10 +236,9 @@ async def get_agentconfig(
 ):
     if is_admin(email=user, api_key=authorization) != True:
         raise HTTPException(status_code=403, detail="Access Denied")
-    ApiClient = get_api_client(authorization=authorization)
-    agent_config = Agent(
-        agent_name=agent_name, user=user, ApiClient=ApiClient
-    ).get_agent_config()
+    agent_config = await run_db(
+        lambda: get_agent_config(agent_name=agent_name, user=user)
+    )
     for key, value in agent_config["settings"].items():
         upper_key = str(key).upper()
         if (
@@ -425,7 +426,9 @@ async def delete_browsed_link(
         user=user,
         ApiClient=ApiClient,
     )
-    await websearch.agent_memory.delete_memories_from_external_source(url=url.url)
+    await websearch.agent_memory.delete_memories_from_external_source(
+        external_source=url.url
+    )
     agent.delete_browsed_link(url=url.url, conversation_id=url.collection_number)
     return {"message": "Browsed links deleted."}
 
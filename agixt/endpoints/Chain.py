@@ -1,5 +1,6 @@
 from fastapi import APIRouter, HTTPException, Depends, Header
 from ApiClient import Chain, verify_api_key, get_api_client, is_admin
+from DB import run_db
 from XT import AGiXT
 from Models import (
     RunChain,
@@ -20,7 +21,7 @@ app = APIRouter()
 async def get_chains(user=Depends(verify_api_key), authorization: str = Header(None)):
     if is_admin(email=user, api_key=authorization) != True:
         raise HTTPException(status_code=403, detail="Access Denied")
-    chains = Chain(user=user).get_chains()
+    chains = await run_db(Chain(user=user).get_chains)
     return chains
 
 
@@ -28,7 +29,7 @@ async def get_chains(user=Depends(verify_api_key), authorization: str = Header(N
     "/api/chain/{chain_name}", tags=["Chain"], dependencies=[Depends(verify_api_key)]
 )
 async def get_chain(chain_name: str, user=Depends(verify_api_key)):
-    chain_data = Chain(user=user).get_chain(chain_name=chain_name)
+    chain_data = await run_db(Chain(user=user).get_chain, chain_name=chain_name)
     return {"chain": chain_data}
 
 
@@ -127,7 +128,7 @@ async def get_chain_args(
 ):
     if is_admin(email=user, api_key=authorization) != True:
         raise HTTPException(status_code=403, detail="Access Denied")
-    chain_args = Chain(user=user).get_chain_args(chain_name=chain_name)
+    chain_args = await run_db(Chain(user=user).get_chain_args, chain_name=chain_name)
     return {"chain_args": chain_args}
 
 
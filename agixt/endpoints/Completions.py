@@ -3,7 +3,7 @@ import base64
 import uuid
 from fastapi import APIRouter, Depends, Header
 from Globals import get_tokens
-from ApiClient import Agent, verify_api_key, get_api_client
+from ApiClient import get_agent, verify_api_key, get_api_client
 from providers.default import DefaultProvider
 from fastapi import UploadFile, File, Form
 from typing import Optional, List
@@ -55,7 +55,9 @@ async def embedding(
 ):
     ApiClient = get_api_client(authorization=authorization)
     agent_name = embedding.model
-    agent = Agent(agent_name=agent_name, user=user, ApiClient=ApiClient)
+    agent = get_agent(
+        agent_name=agent_name, user=user, ApiClient=ApiClient, api_key=authorization
+    )
     tokens = get_tokens(embedding.input)
     embedding = agent.embeddings(input=embedding.input)
     return {
@@ -85,7 +87,9 @@ async def speech_to_text(
     authorization: str = Header(None),
 ):
     ApiClient = get_api_client(authorization=authorization)
-    agent = Agent(agent_name=model, user=user, ApiClient=ApiClient)
+    agent = get_agent(
+        agent_name=model, user=user, ApiClient=ApiClient, api_key=authorization
+    )
     audio_format = file.content_type.split("/")[1]
     if audio_format == "x-wav":
         audio_format = "wav"
@@ -115,7 +119,9 @@ async def translate_audio(
     authorization: str = Header(None),
 ):
     ApiClient = get_api_client(authorization=authorization)
-    agent = Agent(agent_name=model, user=user, ApiClient=ApiClient)
+    agent = get_agent(
+        agent_name=model, user=user, ApiClient=ApiClient, api_key=authorization
+    )
     # Save as audio file based on its type
     audio_format = file.content_type.split("/")[1]
     audio_path = f"./WORKSPACE/{uuid.uuid4().hex}.{audio_format}"
@@ -140,7 +146,9 @@ async def text_to_speech(
     user: str = Depends(verify_api_key),
 ):
     ApiClient = get_api_client(authorization=authorization)
-    agent = Agent(agent_name=tts.model, user=user, ApiClient=ApiClient)
+    agent = get_agent(
+        agent_name=tts.model, user=user, ApiClient=ApiClient, api_key=authorization
+    )
     if agent.TTS_PROVIDER != None:
         audio_data = await agent.text_to_speech(text=tts.input)
     else:
@@ -161,7 +169,9 @@ async def generate_image(
     user: str = Depends(verify_api_key),
 ):
     ApiClient = get_api_client(authorization=authorization)
-    agent = Agent(agent_name=image.model, user=user, ApiClient=ApiClient)
+    agent = get_agent(
+        agent_name=image.model, user=user, ApiClient=ApiClient, api_key=authorization
+    )
     images = []
     if int(image.n) > 1:
         for i in range(image.n):
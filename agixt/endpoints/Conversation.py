@@ -1,6 +1,12 @@
-from fastapi import APIRouter, Depends, Header
+from fastapi import APIRouter, Depends, Header, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from ApiClient import verify_api_key
-from Conversations import Conversations, get_conversation_name_by_id
+from DB import run_db
+from Conversations import (
+    Conversations,
+    ConversationImporter,
+    get_conversation_name_by_id,
+)
 from XT import AGiXT
 from Models import (
     HistoryModel,
@@ -15,12 +21,70 @@ from Models import (
     ConversationFork,
 )
 import json
+import tempfile
 from datetime import datetime
+from typing import Optional
 from MagicalAuth import MagicalAuth
 
 app = APIRouter()
 
 
+# Bodies up to this size are validated in memory, larger ones are spooled to disk
+IMPORT_SPOOL_SIZE = 16 * 1024 * 1024
+
+
+async def read_ndjson(request: Request):
+    # Parses the request body line by line, yielding (line number, record) pairs
+    buffer = b""
+    line_number = 0
+    async for chunk in request.stream():
+        buffer += chunk
+        lines = buffer.split(b"\n")
+        buffer = lines.pop()
+        for line in lines:
+            line_number += 1
+            if not line.strip():
+                continue
+            try:
+                yield line_number, json.loads(line)
+            except json.JSONDecodeError:
+                raise HTTPException(
+                    status_code=400, detail=f"Invalid JSON on line {line_number}."
+                )
+    if buffer.strip():
+        try:
+            yield line_number + 1, json.loads(buffer)
+        except json.JSONDecodeError:
+            raise HTTPException(
+                status_code=400, detail=f"Invalid JSON on line {line_number + 1}."
+            )
+
+
+async def import_ndjson(request: Request, importer: ConversationImporter):
+    # Every record is checked before any is written, so a bad line imports nothing
+    with tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_SIZE) as spool:
+        async for line_number, record in read_ndjson(request):
+            try:
+                importer.validate_record(record)
+            except ValueError as e:
+                raise HTTPException(
+                    status_code=400, detail=f"Invalid record on line {line_number}: {e}"
+                )
+            spool.write(json.dumps(record).encode() + b"\n")
+        spool.seek(0)
+        records = []
+        for line in spool:
+            records.append(json.loads(line))
+            if len(records) >= importer.batch_size:
+                await run_db(importer.add_records, records)
+                records = []
+        if records:
+            await run_db(importer.add_records, records)
+    return ResponseMessage(
+        message=f"Imported {importer.messages} messages into {len(importer.conversations)} conversations."
+    )
+
+
 @app.get(
     "/api/conversations",
     tags=["Conversation"],
@@ -28,16 +92,62 @@ app = APIRouter()
 )
 async def get_conversations_list(user=Depends(verify_api_key)):
     c = Conversations(user=user)
-    conversations = c.get_conversations()
+    conversations = await run_db(c.get_conversations)
     if conversations is None:
         conversations = []
-    conversations_with_ids = c.get_conversations_with_ids()
+    conversations_with_ids = await run_db(c.get_conversations_with_ids)
     return {
         "conversations": conversations,
         "conversations_with_ids": conversations_with_ids,
     }
 
 
+@app.get(
+    "/api/conversations/list",
+    tags=["Conversation"],
+    dependencies=[Depends(verify_api_key)],
+)
+async def get_conversations_page(
+    limit: int = 50,
+    before: Optional[str] = None,
+    search: Optional[str] = None,
+    user=Depends(verify_api_key),
+):
+    # Pass next_cursor back as `before` to get the next page
+    return await run_db(
+        Conversations(user=user).get_conversation_list,
+        limit=limit,
+        before=before,
+        search=search,
+    )
+
+
+@app.get(
+    "/api/conversations/export",
+    tags=["Conversation"],
+    dependencies=[Depends(verify_api_key)],
+)
+async def export_conversations(user=Depends(verify_api_key)):
+    # NDJSON: a conversation record, then its messages, for every conversation of the user
+    return StreamingResponse(
+        Conversations(user=user).export_all_lines(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="conversations.ndjson"'},
+    )
+
+
+@app.post(
+    "/api/conversations/import",
+    tags=["Conversation"],
+    dependencies=[Depends(verify_api_key)],
+)
+async def import_conversations(
+    request: Request, user=Depends(verify_api_key)
+) -> ResponseMessage:
+    # Messages are appended to the user's conversations with the exported names
+    return await import_ndjson(request, ConversationImporter(user=user))
+
+
 @app.get(
     "/v1/conversations",
     tags=["Conversation"],
@@ -45,7 +155,7 @@ async def get_conversations_list(user=Depends(verify_api_key)):
 )
 async def get_conversations(user=Depends(verify_api_key)):
     c = Conversations(user=user)
-    conversations = c.get_conversations_with_detail()
+    conversations = await run_db(c.get_conversations_with_detail)
     if not conversations:
         conversations = {}
     # Output: {"conversations": { "conversation_id": { "name": "conversation_name", "created_at": "datetime", "updated_at": "datetime" } } }
@@ -67,12 +177,13 @@ async def get_conversation_history(
     if not conversation_id:
         conversation_name = history.conversation_name
     else:
-        conversation_name = get_conversation_name_by_id(
-            conversation_id=conversation_id, user_id=auth.user_id
+        conversation_name = await run_db(
+            get_conversation_name_by_id,
+            conversation_id=conversation_id,
+            user_id=auth.user_id,
         )
-    conversation_history = Conversations(
-        conversation_name=conversation_name, user=user
-    ).get_conversation(
+    conversation_history = await run_db(
+        Conversations(conversation_name=conversation_name, user=user).get_conversation,
         limit=history.limit,
         page=history.page,
     )
@@ -89,9 +200,10 @@ async def get_conversation_history(
     dependencies=[Depends(verify_api_key)],
 )
 async def get_conversation_history(history: HistoryModel, user=Depends(verify_api_key)):
-    conversation_history = Conversations(
-        conversation_name=history.conversation_name, user=user
-    ).get_conversation(
+    conversation_history = await run_db(
+        Conversations(
+            conversation_name=history.conversation_name, user=user
+        ).get_conversation,
         limit=history.limit,
         page=history.page,
     )
@@ -113,9 +225,11 @@ async def get_conversation_data(
     page: int = 1,
     user=Depends(verify_api_key),
 ):
-    conversation_history = Conversations(
-        conversation_name=conversation_name, user=user
-    ).get_conversation(limit=limit, page=page)
+    conversation_history = await run_db(
+        Conversations(conversation_name=conversation_name, user=user).get_conversation,
+        limit=limit,
+        page=page,
+    )
     if conversation_history is None:
         conversation_history = []
     if "interactions" in conversation_history:
@@ -123,6 +237,61 @@ async def get_conversation_data(
     return {"conversation_history": conversation_history}
 
 
+@app.get(
+    "/api/conversation/{conversation_name}/history",
+    tags=["Conversation"],
+    dependencies=[Depends(verify_api_key)],
+)
+async def get_conversation_history_page(
+    conversation_name: str,
+    limit: int = 100,
+    before: Optional[str] = None,
+    user=Depends(verify_api_key),
+):
+    # Pass next_cursor back as `before` to get the page of older messages
+    conversation_history = await run_db(
+        Conversations(
+            conversation_name=conversation_name, user=user
+        ).get_conversation_history,
+        limit=limit,
+        before=before,
+    )
+    return {
+        "conversation_history": conversation_history["interactions"],
+        "next_cursor": conversation_history["next_cursor"],
+    }
+
+
+@app.get(
+    "/api/conversation/{conversation_name}/export",
+    tags=["Conversation"],
+    dependencies=[Depends(verify_api_key)],
+)
+async def export_conversation(conversation_name: str, user=Depends(verify_api_key)):
+    return StreamingResponse(
+        Conversations(conversation_name=conversation_name, user=user).export_lines(),
+        media_type="application/x-ndjson",
+        headers={
+            "Content-Disposition": f'attachment; filename="{conversation_name}.ndjson"'
+        },
+    )
+
+
+@app.post(
+    "/api/conversation/{conversation_name}/import",
+    tags=["Conversation"],
+    dependencies=[Depends(verify_api_key)],
+)
+async def import_conversation(
+    conversation_name: str, request: Request, user=Depends(verify_api_key)
+) -> ResponseMessage:
+    # Conversation records in the body are ignored, every message goes to this conversation
+    importer = ConversationImporter(
+        user=user, conversation_name=conversation_name, use_record_names=False
+    )
+    return await import_ndjson(request, importer)
+
+
 @app.post(
     "/api/conversation",
     tags=["Conversation"],
@@ -132,9 +301,12 @@ async def new_conversation_history(
     history: ConversationHistoryModel,
     user=Depends(verify_api_key),
 ):
-    Conversations(
-        conversation_name=history.conversation_name, user=user
-    ).new_conversation(conversation_content=history.conversation_content)
+    await run_db(
+        Conversations(
+            conversation_name=history.conversation_name, user=user
+        ).new_conversation,
+        conversation_content=history.conversation_content,
+    )
     return {"conversation_history": history.conversation_content}
 
 
@@ -146,9 +318,11 @@ async def new_conversation_history(
 async def delete_conversation_history(
     history: ConversationHistoryModel, user=Depends(verify_api_key)
 ) -> ResponseMessage:
-    Conversations(
-        conversation_name=history.conversation_name, user=user
-    ).delete_conversation()
+    await run_db(
+        Conversations(
+            conversation_name=history.conversation_name, user=user
+        ).delete_conversation
+    )
     return ResponseMessage(
         message=f"Conversation `{history.conversation_name}` for agent {history.agent_name} deleted."
     )
@@ -162,9 +336,12 @@ async def delete_conversation_history(
 async def delete_history_message(
     history: ConversationHistoryMessageModel, user=Depends(verify_api_key)
 ) -> ResponseMessage:
-    Conversations(
-        conversation_name=history.conversation_name, user=user
-    ).delete_message(message=history.message)
+    await run_db(
+        Conversations(
+            conversation_name=history.conversation_name, user=user
+        ).delete_message,
+        message=history.message,
+    )
     return ResponseMessage(message=f"Message deleted.")
 
 
@@ -176,9 +353,10 @@ async def delete_history_message(
 async def update_history_message(
     history: UpdateConversationHistoryMessageModel, user=Depends(verify_api_key)
 ) -> ResponseMessage:
-    Conversations(
-        conversation_name=history.conversation_name, user=user
-    ).update_message(
+    await run_db(
+        Conversations(
+            conversation_name=history.conversation_name, user=user
+        ).update_message,
         message=history.message,
         new_message=history.new_message,
     )
@@ -195,9 +373,10 @@ async def update_by_id(
     history: UpdateMessageModel,
     user=Depends(verify_api_key),
 ) -> ResponseMessage:
-    Conversations(
-        conversation_name=history.conversation_name, user=user
-    ).update_message_by_id(
+    await run_db(
+        Conversations(
+            conversation_name=history.conversation_name, user=user
+        ).update_message_by_id,
         message_id=message_id,
         new_message=history.new_message,
     )
@@ -214,9 +393,10 @@ async def delete_by_id(
     history: DeleteMessageModel,
     user=Depends(verify_api_key),
 ):
-    Conversations(
-        conversation_name=history.conversation_name, user=user
-    ).delete_message_by_id(
+    await run_db(
+        Conversations(
+            conversation_name=history.conversation_name, user=user
+        ).delete_message_by_id,
         message_id=message_id,
     )
     return ResponseMessage(message=f"Message deleted.")
@@ -230,9 +410,10 @@ async def delete_by_id(
 async def log_interaction(
     log_interaction: LogInteraction, user=Depends(verify_api_key)
 ) -> ResponseMessage:
-    interaction_id = Conversations(
-        conversation_name=log_interaction.conversation_name, user=user
-    ).log_interaction(
+    interaction_id = await run_db(
+        Conversations(
+            conversation_name=log_interaction.conversation_name, user=user
+        ).log_interaction,
         message=log_interaction.message,
         role=log_interaction.role,
     )
@@ -258,7 +439,7 @@ async def rename_conversation(
     )
     c = agixt.conversation
     if rename.new_conversation_name == "-":
-        conversation_list = c.get_conversations()
+        conversation_list = await run_db(c.get_conversations)
         response = await agixt.inference(
             user_input=f"Rename conversation",
             prompt_name="Name Conversation",
@@ -307,7 +488,7 @@ async def rename_conversation(
         rename.new_conversation_name = str(rename.new_conversation_name).replace(
             "#", ""
         )
-    c.rename_conversation(new_name=rename.new_conversation_name)
+    await run_db(c.rename_conversation, new_name=rename.new_conversation_name)
     c = Conversations(conversation_name=rename.new_conversation_name, user=user)
     c.log_interaction(
         message=f"[ACTIVITY][INFO] Conversation renamed to `{rename.new_conversation_name}`.",
@@ -324,7 +505,10 @@ async def rename_conversation(
 async def fork_conversation(
     fork: ConversationFork, user=Depends(verify_api_key)
 ) -> ResponseMessage:
-    new_conversation_name = Conversations(
-        conversation_name=fork.conversation_name, user=user
-    ).fork_conversation(message_id=fork.message_id)
+    new_conversation_name = await run_db(
+        Conversations(
+            conversation_name=fork.conversation_name, user=user
+        ).fork_conversation,
+        message_id=fork.message_id,
+    )
     return ResponseMessage(message=f"Forked conversation to {new_conversation_name}")
@@ -2,7 +2,14 @@ import os
 import base64
 import asyncio
 from fastapi import APIRouter, HTTPException, Depends, Header
-from ApiClient import Agent, verify_api_key, get_api_client, WORKERS, is_admin
+from ApiClient import (
+    get_agent,
+    get_agent_config,
+    verify_api_key,
+    get_api_client,
+    WORKERS,
+    is_admin,
+)
 from typing import Dict, Any, List
 from Websearch import Websearch
 from XT import AGiXT
@@ -51,9 +58,7 @@ async def query_memories(
     authorization: str = Header(None),
 ) -> Dict[str, Any]:
     ApiClient = get_api_client(authorization=authorization)
-    agent_config = Agent(
-        agent_name=agent_name, user=user, ApiClient=ApiClient
-    ).get_agent_config()
+    agent_config = get_agent_config(agent_name=agent_name, user=user)
     memories = await Memories(
         agent_name=agent_name,
         agent_config=agent_config,
@@ -64,6 +69,7 @@ async def query_memories(
         user_input=memory.user_input,
         limit=memory.limit,
         min_relevance_score=memory.min_relevance_score,
+        include_embeddings=True,
     )
     return {"memories": memories}
 
@@ -78,9 +84,7 @@ async def export_agent_memories(
     agent_name: str, user=Depends(verify_api_key), authorization: str = Header(None)
 ) -> Dict[str, Any]:
     ApiClient = get_api_client(authorization=authorization)
-    agent_config = Agent(
-        agent_name=agent_name, user=user, ApiClient=ApiClient
-    ).get_agent_config()
+    agent_config = get_agent_config(agent_name=agent_name, user=user)
     memories = await Memories(
         agent_name=agent_name, agent_config=agent_config, ApiClient=ApiClient, user=user
     ).export_collections_to_json()
@@ -99,9 +103,7 @@ async def import_agent_memories(
     authorization: str = Header(None),
 ) -> ResponseMessage:
     ApiClient = get_api_client(authorization=authorization)
-    agent_config = Agent(
-        agent_name=agent_name, user=user, ApiClient=ApiClient
-    ).get_agent_config()
+    agent_config = get_agent_config(agent_name=agent_name, user=user)
     await Memories(
         agent_name=agent_name, agent_config=agent_config, ApiClient=ApiClient, user=user
     ).import_collections_from_json(memories)
@@ -120,9 +122,7 @@ async def learn_text(
     authorization: str = Header(None),
 ) -> ResponseMessage:
     ApiClient = get_api_client(authorization=authorization)
-    agent_config = Agent(
-        agent_name=agent_name, user=user, ApiClient=ApiClient
-    ).get_agent_config()
+    agent_config = get_agent_config(agent_name=agent_name, user=user)
     if len(data.collection_number) > 4:
         conversation = Conversations(
             conversation_name=data.collection_number, user=user
@@ -215,7 +215,9 @@ async def learn_url(
 ) -> ResponseMessage:
     timestamp = datetime.now().strftime("%Y-%m-%d")
     ApiClient = get_api_client(authorization=authorization)
-    agent = Agent(agent_name=agent_name, user=user, ApiClient=ApiClient)
+    agent = get_agent(
+        agent_name=agent_name, user=user, ApiClient=ApiClient, api_key=authorization
+    )
     url.url = url.url.replace(" ", "%20")
     websearch = Websearch(
         collection_number=url.collection_number,
@@ -248,9 +250,7 @@ async def learn_github_repo(
     authorization: str = Header(None),
 ) -> ResponseMessage:
     ApiClient = get_api_client(authorization=authorization)
-    agent_config = Agent(
-        agent_name=agent_name, user=user, ApiClient=ApiClient
-    ).get_agent_config()
+    agent_config = get_agent_config(agent_name=agent_name, user=user)
     await GithubReader(
         agent_name=agent_name,
         agent_config=agent_config,
@@ -281,9 +281,7 @@ async def learn_arxiv(
     authorization: str = Header(None),
 ) -> ResponseMessage:
     ApiClient = get_api_client(authorization=authorization)
-    agent_config = Agent(
-        agent_name=agent_name, user=user, ApiClient=ApiClient
-    ).get_agent_config()
+    agent_config = get_agent_config(agent_name=agent_name, user=user)
     await ArxivReader(
         agent_name=agent_name,
         agent_config=agent_config,
@@ -309,9 +307,7 @@ async def learn_youtube(
     authorization: str = Header(None),
 ) -> ResponseMessage:
     ApiClient = get_api_client(authorization=authorization)
-    agent_config = Agent(
-        agent_name=agent_name, user=user, ApiClient=ApiClient
-    ).get_agent_config()
+    agent_config = get_agent_config(agent_name=agent_name, user=user)
     await YoutubeReader(
         agent_name=agent_name,
         agent_config=agent_config,
@@ -334,8 +330,7 @@ async def agent_reader(
     authorization: str = Header(None),
 ) -> ResponseMessage:
     ApiClient = get_api_client(authorization=authorization)
-    agent = Agent(agent_name=agent_name, user=user, ApiClient=ApiClient)
-    agent_config = agent.AGENT_CONFIG
+    agent_config = get_agent_config(agent_name=agent_name, user=user)
     collection_number = (
         str(data["collection_number"]) if "collection_number" in data else "0"
     )
@@ -411,10 +406,9 @@ async def wipe_agent_memories(
     if is_admin(email=user, api_key=authorization) != True:
         raise HTTPException(status_code=403, detail="Access Denied")
     ApiClient = get_api_client(authorization=authorization)
-    agent = Agent(agent_name=agent_name, user=user, ApiClient=ApiClient)
     await Memories(
         agent_name=agent_name,
-        agent_config=agent.AGENT_CONFIG,
+        agent_config=get_agent_config(agent_name=agent_name, user=user),
         collection_number="0",
         ApiClient=ApiClient,
         user=user,
@@ -436,10 +430,9 @@ async def wipe_agent_memories(
     if is_admin(email=user, api_key=authorization) != True:
         raise HTTPException(status_code=403, detail="Access Denied")
     ApiClient = get_api_client(authorization=authorization)
-    agent = Agent(agent_name=agent_name, user=user, ApiClient=ApiClient)
     await Memories(
         agent_name=agent_name,
-        agent_config=agent.AGENT_CONFIG,
+        agent_config=get_agent_config(agent_name=agent_name, user=user),
         collection_number=collection_number,
         ApiClient=ApiClient,
         user=user,
@@ -460,10 +453,9 @@ async def delete_agent_memory(
     authorization: str = Header(None),
 ) -> ResponseMessage:
     ApiClient = get_api_client(authorization=authorization)
-    agent = Agent(agent_name=agent_name, user=user, ApiClient=ApiClient)
     await Memories(
         agent_name=agent_name,
-        agent_config=agent.AGENT_CONFIG,
+        agent_config=get_agent_config(agent_name=agent_name, user=user),
         collection_number=collection_number,
         ApiClient=ApiClient,
         user=user,
@@ -582,10 +574,9 @@ async def delete_memories_from_external_source(
     if is_admin(email=user, api_key=authorization) != True:
         raise HTTPException(status_code=403, detail="Access Denied")
     ApiClient = get_api_client(authorization=authorization)
-    agent = Agent(agent_name=agent_name, user=user, ApiClient=ApiClient)
     await Memories(
         agent_name=agent_name,
-        agent_config=agent.AGENT_CONFIG,
+        agent_config=get_agent_config(agent_name=agent_name, user=user),
         collection_number=str(external_source.collection_number),
         ApiClient=ApiClient,
         user=user,
@@ -610,10 +601,9 @@ async def get_unique_external_sources(
     authorization: str = Header(None),
 ) -> Dict[str, Any]:
     ApiClient = get_api_client(authorization=authorization)
-    agent = Agent(agent_name=agent_name, user=user, ApiClient=ApiClient)
     external_sources = await Memories(
         agent_name=agent_name,
-        agent_config=agent.AGENT_CONFIG,
+        agent_config=get_agent_config(agent_name=agent_name, user=user),
         collection_number=collection_number,
         ApiClient=ApiClient,
         user=user,
@@ -1,5 +1,6 @@
 from fastapi import APIRouter, HTTPException, Depends, Header
 from ApiClient import Prompts, verify_api_key, is_admin
+from DB import run_db
 from Models import (
     PromptName,
     PromptList,
@@ -53,8 +54,10 @@ async def add_prompt(
 async def get_prompt_with_category(
     prompt_name: str, prompt_category: str = "Default", user=Depends(verify_api_key)
 ):
-    prompt_content = Prompts(user=user).get_prompt(
-        prompt_name=prompt_name, prompt_category=prompt_category
+    prompt_content = await run_db(
+        Prompts(user=user).get_prompt,
+        prompt_name=prompt_name,
+        prompt_category=prompt_category,
     )
     return {
         "prompt_name": prompt_name,
@@ -72,8 +75,10 @@ async def get_prompt_with_category(
 async def get_prompt(
     prompt_name: str, prompt_category: str = "Default", user=Depends(verify_api_key)
 ):
-    prompt_content = Prompts(user=user).get_prompt(
-        prompt_name=prompt_name, prompt_category=prompt_category
+    prompt_content = await run_db(
+        Prompts(user=user).get_prompt,
+        prompt_name=prompt_name,
+        prompt_category=prompt_category,
     )
     return {"prompt_name": prompt_name, "prompt": prompt_content}
 
@@ -85,7 +90,7 @@ async def get_prompt(
     dependencies=[Depends(verify_api_key)],
 )
 async def get_prompts(user=Depends(verify_api_key)):
-    prompts = Prompts(user=user).get_prompts()
+    prompts = await run_db(Prompts(user=user).get_prompts)
     return {"prompts": prompts}
 
 
@@ -97,7 +102,7 @@ async def get_prompts(user=Depends(verify_api_key)):
     dependencies=[Depends(verify_api_key)],
 )
 async def get_prompt_categories(user=Depends(verify_api_key)):
-    prompt_categories = Prompts(user=user).get_prompt_categories()
+    prompt_categories = await run_db(Prompts(user=user).get_prompt_categories)
     return {"prompt_categories": prompt_categories}
 
 
@@ -108,7 +113,9 @@ async def get_prompt_categories(user=Depends(verify_api_key)):
     dependencies=[Depends(verify_api_key)],
 )
 async def get_prompts(prompt_category: str = "Default", user=Depends(verify_api_key)):
-    prompts = Prompts(user=user).get_prompts(prompt_category=prompt_category)
+    prompts = await run_db(
+        Prompts(user=user).get_prompts, prompt_category=prompt_category
+    )
     return {"prompts": prompts}
 
 
@@ -196,7 +203,9 @@ async def get_prompt_arg(
 ):
     prompt_name = prompt_name.replace("%20", " ")
     prompt_category = prompt_category.replace("%20", " ")
-    prompt = Prompts(user=user).get_prompt(
-        prompt_name=prompt_name, prompt_category=prompt_category
+    prompt = await run_db(
+        Prompts(user=user).get_prompt,
+        prompt_name=prompt_name,
+        prompt_category=prompt_category,
     )
     return {"prompt_args": Prompts(user=user).get_prompt_args(prompt)}
@@ -6,6 +6,8 @@ from Providers import (
     get_providers_with_settings,
     get_providers_by_service,
 )
+from EmbeddingCache import embedding_cache
+from DB import get_pool_metrics
 from ApiClient import verify_api_key, get_api_client, is_admin
 from typing import Any
 
@@ -67,3 +69,45 @@ async def get_embed_providers(user=Depends(verify_api_key)):
 )
 async def get_embedder_info(user=Depends(verify_api_key)) -> Dict[str, Any]:
     return {"embedders": get_providers_by_service(service="embeddings")}
+
+
+# Gets hit/miss counters for the query embedding cache
+@app.get(
+    "/api/embeddings/cache",
+    tags=["Provider"],
+    dependencies=[Depends(verify_api_key)],
+)
+async def get_embedding_cache_stats(
+    user=Depends(verify_api_key), authorization: str = Header(None)
+) -> Dict[str, Any]:
+    if is_admin(email=user, api_key=authorization) != True:
+        raise HTTPException(status_code=403, detail="Access Denied")
+    return {"cache": embedding_cache.stats()}
+
+
+@app.delete(
+    "/api/embeddings/cache",
+    tags=["Provider"],
+    dependencies=[Depends(verify_api_key)],
+)
+async def clear_embedding_cache(
+    user=Depends(verify_api_key), authorization: str = Header(None)
+) -> Dict[str, str]:
+    if is_admin(email=user, api_key=authorization) != True:
+        raise HTTPException(status_code=403, detail="Access Denied")
+    embedding_cache.clear()
+    return {"message": "Embedding cache cleared."}
+
+
+# Gets connection pool and session counters for this worker
+@app.get(
+    "/api/db/pool",
+    tags=["Provider"],
+    dependencies=[Depends(verify_api_key)],
+)
+async def get_database_pool_metrics(
+    user=Depends(verify_api_key), authorization: str = Header(None)
+) -> Dict[str, Any]:
+    if is_admin(email=user, api_key=authorization) != True:
+        raise HTTPException(status_code=403, detail="Access Denied")
+    return {"pool": get_pool_metrics()}
@@ -6,7 +6,6 @@ import pdfplumber
 import zipfile
 import shutil
 import logging
-from datetime import datetime
 import nbformat
 
 
@@ -37,7 +36,7 @@ class FileReader(Memories):
                     else True
                 )
 
-    async def write_file_to_memory(self, file_path: str):
+    async def write_file_to_memory(self, file_path: str, source_name: str = ""):
         base_path = os.path.join(os.getcwd(), "WORKSPACE")
         if self.workspace_restricted:
             file_path = os.path.normpath(os.path.join(base_path, file_path))
@@ -46,6 +45,8 @@ class FileReader(Memories):
         else:
             file_path = os.path.normpath(file_path)
         filename = os.path.basename(file_path)
+        if not source_name:
+            source_name = filename
         """
         if file_path.endswith((".ppt", ".pptx")):
             pdf_file_path = file_path.replace(".pptx", ".pdf").replace(".ppt", ".pdf")
@@ -66,15 +67,32 @@ class FileReader(Memories):
                 content = docx2txt.process(file_path)
             # If zip file, extract it then go over each file with read_file
             elif file_path.endswith(".zip"):
+                temp_path = os.path.join(base_path, "temp")
                 with zipfile.ZipFile(file_path, "r") as zipObj:
-                    zipObj.extractall(path=os.path.join(base_path, "temp"))
+                    zipObj.extractall(path=temp_path)
                 # Iterate over every file that was extracted including subdirectories
-                for root, dirs, files in os.walk(os.path.join(base_path, "temp")):
+                learned_sources = set()
+                for root, dirs, files in os.walk(temp_path):
                     for name in files:
                         file_path = os.path.join(root, name)
                         logging.info(f"Reading file: {file_path}")
-                        await self.write_file_to_memory(file_path=file_path)
-                shutil.rmtree(os.path.join(base_path, "temp"))
+                        member_name = (
+                            f"{source_name}/{os.path.relpath(file_path, temp_path)}"
+                        )
+                        if await self.write_file_to_memory(
+                            file_path=file_path, source_name=member_name
+                        ):
+                            learned_sources.add(f"file {member_name}")
+                shutil.rmtree(temp_path)
+                # Forget files that were removed from the archive since it was last learned
+                for external_source in await self.get_external_data_sources():
+                    if (
+                        external_source.startswith(f"file {source_name}/")
+                        and external_source not in learned_sources
+                    ):
+                        await self.delete_memories_from_external_source(
+                            external_source=external_source
+                        )
             # If it is an audio file, convert it to base64 and read with Whisper STT
             elif file_path.endswith(
                 (".mp3", ".wav", ".ogg", ".m4a", ".flac", ".wma", ".aac")
@@ -103,11 +121,11 @@ class FileReader(Memories):
                     with open(file_path, "r") as f:
                         content = f.read()
             if content != "":
-                timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                # The upload time is kept in the chunk metadata so unchanged files hash the same
                 await self.write_text_to_memory(
                     user_input=file_path,
-                    text=f"Content from file uploaded at {timestamp} named `{filename}`:\n{content}",
-                    external_source=f"file {filename}",
+                    text=f"Content from file named `{source_name}`:\n{content}",
+                    external_source=f"file {source_name}",
                 )
             return True
         except Exception as e:
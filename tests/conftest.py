@@ -0,0 +1,49 @@
+import os
+import sys
+import uuid
+import tempfile
+import pytest
+
+# The agixt modules read their settings and open the database when they are imported, so
+# point them at a throwaway SQLite database before any test module imports them.
+AGIXT_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(__file__)), "agixt")
+TEST_DIRECTORY = tempfile.mkdtemp(prefix="agixt-tests-")
+os.environ.update(
+    DATABASE_TYPE="sqlite",
+    DATABASE_NAME=os.path.join(TEST_DIRECTORY, "agixt"),
+    DATABASE_ASYNC="false",
+    VECTOR_STORE_PATH=os.path.join(TEST_DIRECTORY, "vector_store"),
+    EXTENSION_MANIFEST_PATH="",
+    EMBEDDING_CACHE_PATH="",
+    TZ="UTC",
+)
+sys.path.insert(0, AGIXT_DIRECTORY)
+os.chdir(AGIXT_DIRECTORY)
+
+import DB
+from Globals import DEFAULT_USER
+
+DB.Base.metadata.create_all(DB.engine)
+
+
+def add_user(email: str):
+    session = DB.get_session()
+    if session.query(DB.User).filter(DB.User.email == email).first() is None:
+        session.add(DB.User(email=email))
+        session.commit()
+    session.close()
+
+
+add_user(DEFAULT_USER)
+session = DB.get_session()
+session.add(DB.Provider(name="default"))
+session.commit()
+session.close()
+
+
+@pytest.fixture
+def user():
+    """Email of a new user, so tests do not see each other's conversations and agents."""
+    email = f"{uuid.uuid4().hex}@example.com"
+    add_user(email)
+    return email
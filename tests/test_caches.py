@@ -0,0 +1,120 @@
+"""
+The identity, agent config and prompt caches are per worker. These tests change the database
+directly, the way another worker would, and check that this worker's caches notice.
+"""
+
+import DB
+import IdentityCache
+from Agent import add_agent, get_agent_config
+from Conversations import Conversations
+from IdentityCache import (
+    get_cached_conversation_id,
+    get_cached_user_id,
+    invalidate_registration_settings,
+)
+from MessageLog import flush_messages
+from Prompts import Prompts
+
+
+def rename_conversation_elsewhere(conversation_id, new_name):
+    session = DB.get_session()
+    session.query(DB.Conversation).filter(DB.Conversation.id == conversation_id).update(
+        {DB.Conversation.name: new_name}
+    )
+    session.commit()
+    session.close()
+
+
+def get_messages(conversation_name, user):
+    conversation = Conversations(conversation_name=conversation_name, user=user)
+    return [
+        interaction["message"]
+        for interaction in conversation.get_conversation()["interactions"]
+    ]
+
+
+def test_cached_conversation_id_is_checked_against_its_name(user):
+    Conversations(conversation_name="first", user=user).log_interaction(
+        role="USER", message="hello"
+    )
+    user_id = get_cached_user_id(user)
+    conversation_id = get_cached_conversation_id(
+        user_id=user_id, conversation_name="first"
+    )
+    rename_conversation_elsewhere(conversation_id, "second")
+    assert not get_cached_conversation_id(user_id=user_id, conversation_name="first")
+    assert str(
+        get_cached_conversation_id(user_id=user_id, conversation_name="second")
+    ) == str(conversation_id)
+
+
+def test_messages_follow_a_rename_by_another_worker(user):
+    conversation = Conversations(conversation_name="before", user=user)
+    conversation.log_interaction(role="USER", message="first")
+    conversation_id = conversation.get_conversation_id()
+    flush_messages()
+    rename_conversation_elsewhere(conversation_id, "after")
+    conversation.log_interaction(role="USER", message="second")
+    assert get_messages("after", user) == ["first"]
+    assert get_messages("before", user) == ["second"]
+
+
+def test_agent_config_changes_on_another_worker_are_seen(user):
+    add_agent(
+        agent_name="cached",
+        provider_settings={"provider": "default", "AI_MODEL": "one"},
+        user=user,
+    )
+    assert get_agent_config("cached", user=user)["settings"]["AI_MODEL"] == "one"
+    session = DB.get_session()
+    agent = (
+        session.query(DB.Agent)
+        .filter(DB.Agent.name == "cached", DB.Agent.user_id == get_cached_user_id(user))
+        .first()
+    )
+    session.query(DB.AgentSetting).filter(
+        DB.AgentSetting.agent_id == agent.id, DB.AgentSetting.name == "AI_MODEL"
+    ).update({DB.AgentSetting.value: "two"})
+    agent.config_version = agent.config_version + 1
+    session.commit()
+    session.close()
+    assert get_agent_config("cached", user=user)["settings"]["AI_MODEL"] == "two"
+
+
+def test_registration_settings_override_cached_agent_config(user, monkeypatch):
+    monkeypatch.setattr(
+        IdentityCache, "get_registration_requirement_keys", lambda: ("LANGUAGE",)
+    )
+    add_agent(
+        agent_name="registered",
+        provider_settings={"provider": "default", "LANGUAGE": "en"},
+        user=user,
+    )
+    assert get_agent_config("registered", user=user)["settings"]["LANGUAGE"] == "en"
+    user_id = get_cached_user_id(user)
+    session = DB.get_session()
+    session.add(
+        DB.UserPreferences(user_id=user_id, pref_key="LANGUAGE", pref_value="fr")
+    )
+    session.commit()
+    session.close()
+    invalidate_registration_settings(user_id)
+    assert get_agent_config("registered", user=user)["settings"]["LANGUAGE"] == "fr"
+
+
+def test_prompt_edits_on_another_worker_are_seen(user):
+    prompts = Prompts(user=user)
+    prompts.add_prompt(prompt_name="cached prompt", prompt="Hello {name}")
+    assert prompts.get_prompt("cached prompt") == "Hello {name}"
+    session = DB.get_session()
+    prompt = (
+        session.query(DB.Prompt)
+        .filter(DB.Prompt.name == "cached prompt", DB.Prompt.user_id == prompts.user_id)
+        .first()
+    )
+    prompt.content = "Goodbye {name}"
+    prompt.version = (prompt.version or 0) + 1
+    session.commit()
+    session.close()
+    assert prompts.get_prompt("cached prompt") == "Goodbye {name}"
+    assert prompts.get_prompt_args(prompts.get_prompt("cached prompt")) == ["name"]
@@ -0,0 +1,127 @@
+from Conversations import Conversations
+
+
+def get_messages(conversation_name, user):
+    conversation = Conversations(conversation_name=conversation_name, user=user)
+    return [
+        interaction["message"]
+        for interaction in conversation.get_conversation(limit=1000)["interactions"]
+    ]
+
+
+def get_listed(user, conversation_name):
+    conversations = Conversations(user=user).get_conversation_list(limit=100)
+    for conversation in conversations["conversations"]:
+        if conversation["name"] == conversation_name:
+            return conversation
+    return None
+
+
+def test_history_pages_cover_conversation_in_order(user):
+    conversation = Conversations(conversation_name="paged", user=user)
+    for i in range(95):
+        conversation.log_interaction(role="USER", message=f"message {i}")
+    expected = [
+        interaction["id"]
+        for interaction in conversation.get_conversation(limit=1000)["interactions"]
+    ]
+    seen = []
+    cursor = None
+    pages = 0
+    while True:
+        page = conversation.get_conversation_history(limit=20, before=cursor)
+        seen = [interaction["id"] for interaction in page["interactions"]] + seen
+        pages += 1
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+    assert pages == 5
+    assert seen == expected
+
+
+def test_recent_history_separates_activities(user):
+    conversation = Conversations(conversation_name="recent", user=user)
+    for i in range(10):
+        conversation.log_interaction(role="USER", message=f"message {i}")
+        conversation.log_interaction(role="agent", message=f"[ACTIVITY] activity {i}")
+    history = conversation.get_recent_history(limit=3, activity_limit=2)
+    assert [interaction["message"] for interaction in history["interactions"]] == [
+        "message 7",
+        "message 8",
+        "message 9",
+    ]
+    assert [activity["message"] for activity in history["activities"]] == [
+        "[ACTIVITY] activity 8",
+        "[ACTIVITY] activity 9",
+    ]
+
+
+def test_fork_inherits_history_up_to_the_fork_point(user):
+    parent = Conversations(conversation_name="parent", user=user)
+    for i in range(5):
+        parent.log_interaction(role="USER", message=f"m{i}")
+    history = parent.get_conversation(limit=1000)["interactions"]
+    fork_name = parent.fork_conversation(history[2]["id"])
+    fork = Conversations(conversation_name=fork_name, user=user)
+    fork.log_interaction(role="USER", message="fork only")
+    parent.log_interaction(role="USER", message="parent only")
+    assert get_messages(fork_name, user) == ["m0", "m1", "m2", "fork only"]
+    assert get_messages("parent", user) == ["m0", "m1", "m2", "m3", "m4", "parent only"]
+
+
+def test_fork_of_fork_and_copy_on_write(user):
+    parent = Conversations(conversation_name="root", user=user)
+    for i in range(4):
+        parent.log_interaction(role="USER", message=f"m{i}")
+    history = parent.get_conversation(limit=1000)["interactions"]
+    child_name = parent.fork_conversation(history[3]["id"])
+    child = Conversations(conversation_name=child_name, user=user)
+    child.log_interaction(role="USER", message="child")
+    grandchild_name = child.fork_conversation(history[1]["id"])
+    assert get_messages(grandchild_name, user) == ["m0", "m1"]
+    # Editing an inherited message in a fork leaves the parent's copy alone
+    child.update_message_by_id(history[0]["id"], "edited")
+    assert get_messages(child_name, user)[0] == "edited"
+    assert get_messages("root", user)[0] == "m0"
+    assert get_messages(grandchild_name, user) == ["m0", "m1"]
+    # Deleting the parent keeps the forks' history
+    parent.delete_conversation()
+    assert get_messages(child_name, user) == ["edited", "m1", "m2", "m3", "child"]
+
+
+def test_conversation_list_counts_inherited_messages(user):
+    parent = Conversations(conversation_name="listed", user=user)
+    for i in range(4):
+        parent.log_interaction(role="USER", message=f"m{i}")
+    parent.log_interaction(role="agent", message="[ACTIVITY] working")
+    history = parent.get_conversation(limit=1000)["interactions"]
+    fork_name = parent.fork_conversation(history[1]["id"])
+    listed_parent = get_listed(user, "listed")
+    assert listed_parent["message_count"] == 4
+    assert listed_parent["last_message"] == "m3"
+    listed_fork = get_listed(user, fork_name)
+    assert listed_fork["message_count"] == 2
+    assert listed_fork["last_message"] == "m1"
+    Conversations(conversation_name=fork_name, user=user).log_interaction(
+        role="USER", message="own"
+    )
+    listed_fork = get_listed(user, fork_name)
+    assert listed_fork["message_count"] == 3
+    assert listed_fork["last_message"] == "own"
+
+
+def test_conversation_list_pages(user):
+    for i in range(7):
+        Conversations(conversation_name=f"chat {i}", user=user).log_interaction(
+            role="USER", message="hello"
+        )
+    names = []
+    cursor = None
+    while True:
+        page = Conversations(user=user).get_conversation_list(limit=3, before=cursor)
+        names.extend(conversation["name"] for conversation in page["conversations"])
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+    assert sorted(names) == sorted(f"chat {i}" for i in range(7))
+    assert len(names) == len(set(names))
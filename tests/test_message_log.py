@@ -0,0 +1,135 @@
+import time
+import threading
+import pytest
+import DB
+from MessageLog import MessageLog
+from IdentityCache import get_cached_conversation_id, get_cached_user_id
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+
+@pytest.fixture
+def conversation(user):
+    user_id = get_cached_user_id(user)
+    conversation_id = get_cached_conversation_id(
+        user_id=user_id, conversation_name="log"
+    )
+    if not conversation_id:
+        session = DB.get_session()
+        row = DB.Conversation(name="log", user_id=user_id)
+        session.add(row)
+        session.commit()
+        conversation_id = row.id
+        session.close()
+    return user_id, conversation_id
+
+
+def get_contents(conversation_id):
+    session = DB.get_session()
+    contents = [
+        message.content
+        for message in session.query(DB.Message)
+        .filter(DB.Message.conversation_id == conversation_id)
+        .order_by(DB.Message.timestamp)
+    ]
+    session.close()
+    return contents
+
+
+def append(log, conversation, content):
+    user_id, conversation_id = conversation
+    return log.append(
+        user_id=user_id,
+        conversation_name="log",
+        conversation_id=conversation_id,
+        role="USER",
+        content=content,
+    )
+
+
+def test_messages_keep_their_order(conversation):
+    log = MessageLog(flush_interval=60, batch_size=3)
+    timestamps = [append(log, conversation, f"m{i}")[1] for i in range(10)]
+    log.flush()
+    assert timestamps == sorted(set(timestamps))
+    assert get_contents(conversation[1]) == [f"m{i}" for i in range(10)]
+
+
+def test_transient_errors_keep_messages_queued(conversation):
+    log = MessageLog(flush_interval=60, retry_delay=0.01)
+    write = log.write
+    failures = {"left": 2}
+
+    def flaky_write(entries):
+        if failures["left"]:
+            failures["left"] -= 1
+            raise OperationalError("INSERT", {}, Exception("database is down"))
+        write(entries)
+
+    log.write = flaky_write
+    append(log, conversation, "m0")
+    append(log, conversation, "m1")
+    log.flush()
+    assert len(log.pending) == 2
+    assert get_contents(conversation[1]) == []
+    log.flush()
+    log.flush()
+    assert log.pending == []
+    assert log.failures == 0
+    assert get_contents(conversation[1]) == ["m0", "m1"]
+
+
+def test_rejected_message_is_dropped_alone(conversation):
+    log = MessageLog(flush_interval=60)
+    write = log.write
+
+    def strict_write(entries):
+        if any(entry["row"]["content"] == "bad" for entry in entries):
+            raise IntegrityError("INSERT", {}, Exception("constraint failed"))
+        write(entries)
+
+    log.write = strict_write
+    for content in ["m0", "bad", "m1"]:
+        append(log, conversation, content)
+    log.flush()
+    assert log.pending == []
+    assert get_contents(conversation[1]) == ["m0", "m1"]
+
+
+def test_flush_waits_for_a_flush_in_progress(conversation):
+    log = MessageLog(flush_interval=60)
+    write = log.write
+    started = threading.Event()
+
+    def slow_write(entries):
+        started.set()
+        time.sleep(0.2)
+        write(entries)
+
+    log.write = slow_write
+    append(log, conversation, "m0")
+    writer = threading.Thread(target=log.flush)
+    writer.start()
+    started.wait()
+    # The other thread holds the flush lock, this call must still see m0 written
+    log.flush()
+    assert get_contents(conversation[1]) == ["m0"]
+    writer.join()
+    assert log.written_sequence == log.sequence
+
+
+def test_message_for_renamed_conversation_keeps_its_name(conversation):
+    user_id, conversation_id = conversation
+    log = MessageLog(flush_interval=60)
+    append(log, conversation, "after rename")
+    # Another worker renames the conversation before the message is written
+    session = DB.get_session()
+    session.query(DB.Conversation).filter(DB.Conversation.id == conversation_id).update(
+        {DB.Conversation.name: "renamed"}
+    )
+    session.commit()
+    session.close()
+    log.flush()
+    assert get_contents(conversation_id) == []
+    new_id = get_cached_conversation_id(user_id=user_id, conversation_name="log")
+    assert str(new_id) != str(conversation_id)
+    assert get_contents(new_id) == ["after rename"]
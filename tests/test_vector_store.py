@@ -0,0 +1,101 @@
+import os
+import numpy as np
+import pytest
+from VectorStore import LocalVectorStore, hnswlib
+
+
+@pytest.fixture
+def vectors():
+    return np.random.default_rng(0).normal(size=(400, 16)).astype(np.float32)
+
+
+def add(collection, vectors, start, end):
+    collection.add(
+        ids=[str(i) for i in range(start, end)],
+        embeddings=vectors[start:end],
+        metadatas=[{"position": i} for i in range(start, end)],
+        documents=[f"document {i}" for i in range(start, end)],
+    )
+
+
+def test_query_returns_nearest_with_cosine_distance(tmp_path, vectors):
+    collection = LocalVectorStore(path=str(tmp_path)).get_or_create_collection("c")
+    add(collection, vectors, 0, 100)
+    results = collection.query(query_embeddings=[vectors[7] * 3], n_results=3)
+    assert results["ids"][0][0] == "7"
+    assert results["documents"][0][0] == "document 7"
+    assert results["metadatas"][0][0] == {"position": 7}
+    assert results["distances"][0][0] == pytest.approx(0.0, abs=1e-5)
+    assert results["distances"][0] == sorted(results["distances"][0])
+
+
+def test_existing_ids_are_ignored(tmp_path, vectors):
+    collection = LocalVectorStore(path=str(tmp_path)).get_or_create_collection("c")
+    add(collection, vectors, 0, 10)
+    add(collection, vectors, 5, 15)
+    assert collection.count() == 15
+    assert collection.rows == 15
+
+
+def test_deleted_rows_are_not_returned(tmp_path, vectors):
+    collection = LocalVectorStore(path=str(tmp_path)).get_or_create_collection("c")
+    add(collection, vectors, 0, 50)
+    collection.delete(ids=["7"])
+    collection.delete(where={"position": 8})
+    results = collection.query(query_embeddings=[vectors[7]], n_results=50)
+    assert "7" not in results["ids"][0]
+    assert "8" not in results["ids"][0]
+    assert len(results["ids"][0]) == 48
+
+
+def test_other_instances_see_writes(tmp_path, vectors):
+    first = LocalVectorStore(path=str(tmp_path)).get_or_create_collection("c")
+    second = LocalVectorStore(path=str(tmp_path)).get_or_create_collection("c")
+    add(first, vectors, 0, 20)
+    assert second.query(query_embeddings=[vectors[3]], n_results=1)["ids"] == [["3"]]
+    second.delete(ids=["3"])
+    assert first.get(ids=["3"])["ids"] == []
+
+
+def test_compaction_keeps_ids_and_vectors(tmp_path, vectors):
+    collection = LocalVectorStore(path=str(tmp_path)).get_or_create_collection("c")
+    add(collection, vectors, 0, 100)
+    collection.delete(ids=[str(i) for i in range(100) if i % 4])
+    with collection._write_lock():
+        collection._compact()
+    assert collection.rows == 25
+    assert collection.generation == 1
+    for i in [0, 48, 96]:
+        results = collection.query(query_embeddings=[vectors[i]], n_results=1)
+        assert results["ids"] == [[str(i)]]
+
+
+def test_ivf_index_is_saved_and_finds_neighbours(tmp_path, vectors):
+    store = LocalVectorStore(path=str(tmp_path), index_type="ivf", index_min_rows=100)
+    collection = store.get_or_create_collection("c")
+    add(collection, vectors, 0, 400)
+    collection.nprobe = 1000
+    assert collection.query(query_embeddings=[vectors[42]], n_results=1)["ids"] == [
+        ["42"]
+    ]
+    assert os.path.exists(os.path.join(str(tmp_path), "c", "ivf.npz"))
+
+
+@pytest.mark.skipif(hnswlib is None, reason="hnswlib is not installed")
+def test_hnsw_index_is_loaded_by_other_instances(tmp_path, vectors):
+    first = LocalVectorStore(
+        path=str(tmp_path), index_type="hnsw", index_min_rows=100
+    ).get_or_create_collection("c")
+    add(first, vectors, 0, 300)
+    assert first.query(query_embeddings=[vectors[5]], n_results=1)["ids"] == [["5"]]
+    assert os.path.exists(os.path.join(str(tmp_path), "c", "hnsw-0.bin"))
+    first.delete(ids=["5"])
+    add(first, vectors, 300, 400)
+    second = LocalVectorStore(
+        path=str(tmp_path), index_type="hnsw", index_min_rows=100
+    ).get_or_create_collection("c")
+    assert second.query(query_embeddings=[vectors[350]], n_results=1)["ids"] == [
+        ["350"]
+    ]
+    assert "5" not in second.query(query_embeddings=[vectors[5]], n_results=5)["ids"][0]
+    assert second.index.saved_rows == 300